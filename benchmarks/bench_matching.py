@@ -0,0 +1,120 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation wrong-import-position
+"""
+Throughput and memory of the matching functions on synthetic inputs of growing size.
+
+Times `get_matched_entries`, `rearrangeColumns`, `eia_filtering` and
+`match_by_eia_code_and_add_recid` on tables from `benchmarks/synthetic.py`,
+where `size` is the number of TADS rows and of GADS units; the Velocity Suite
+exports get a fifth of that. Time is the best of `--repeat` runs, memory the
+peak of Python/numpy allocations during one extra run (tracemalloc). With
+`--json` the results are appended to a JSON lines file, so that runs on
+different commits can be compared.
+
+Usage:
+    python benchmarks/bench_matching.py                            # 10k, 100k and 1M
+    python benchmarks/bench_matching.py 10000 100000 --match-rate 0.3
+    python benchmarks/bench_matching.py --json benchmarks/results.jsonl
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import make_gads_inventory, make_tads_inventory, make_velo_plants, make_velo_tlines
+from src.housekeeping_gads import eia_filtering, match_by_eia_code_and_add_recid
+from src.housekeeping_tads import (
+    get_latest_entries,
+    get_matched_entries,
+    rearrangeColumns,
+    sort_and_shift_columns,
+    sort_and_shift_columns_dfVelo,
+)
+
+
+def make_cases(size, matchRate, seed):
+    # (name, function, args, input rows) per benchmarked call; preparation is not timed
+    dfTads = make_tads_inventory(size, seed=seed)
+    dfTadsLatest = get_latest_entries(sort_and_shift_columns(dfTads))
+    dfVeloSorted = sort_and_shift_columns_dfVelo(make_velo_tlines(dfTads, max(size // 5, 1), matchRate=matchRate, seed=seed + 1))
+
+    dfGads = make_gads_inventory(size, seed=seed + 2)
+    dfVeloPlants = make_velo_plants(dfGads, max(size // 5, 1), matchRate=matchRate, seed=seed + 3)
+    dfVeloPlantsEIA = eia_filtering(dfVeloPlants, column_name="EIA ID")
+
+    return [
+        ("get_matched_entries", get_matched_entries, (dfVeloSorted, dfTadsLatest), len(dfVeloSorted) + len(dfTadsLatest)),
+        ("rearrangeColumns", rearrangeColumns, (dfTads,), len(dfTads)),
+        ("eia_filtering", eia_filtering, (dfVeloPlants,), len(dfVeloPlants)),
+        ("match_by_eia_code_and_add_recid", match_by_eia_code_and_add_recid, (dfVeloPlantsEIA, dfGads, True), len(dfVeloPlantsEIA) + len(dfGads)),
+    ]
+
+
+def measure(func, args, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(*args)
+    _, peakBytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(seconds), peakBytes / (1 << 20)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, matchRate=0.5, repeat=3, seed=0, jsonAddr=None):
+    revision = git_revision()
+    print(f"{'function':<34} {'size':>9} {'rows in':>9} {'time [s]':>10} {'rows/s':>12} {'peak [MB]':>10}")
+    results = []
+    for size in sizes:
+        for name, func, args, rowsIn in make_cases(size, matchRate, seed):
+            seconds, peakMB = measure(func, args, repeat)
+            print(f"{name:<34} {size:>9} {rowsIn:>9} {seconds:>10.4f} {rowsIn / seconds:>12.0f} {peakMB:>10.1f}")
+            results.append(
+                {
+                    "function": name,
+                    "size": size,
+                    "rowsIn": rowsIn,
+                    "matchRate": matchRate,
+                    "seconds": seconds,
+                    "rowsPerSecond": rowsIn / seconds,
+                    "peakMB": peakMB,
+                    "revision": revision,
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                }
+            )
+
+    if jsonAddr:
+        with open(jsonAddr, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--match-rate", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="jsonAddr", default=None)
+    cliArgs = parser.parse_args()
+    run(cliArgs.sizes, matchRate=cliArgs.match_rate, repeat=cliArgs.repeat, seed=cliArgs.seed, jsonAddr=cliArgs.jsonAddr)
+
+# %%
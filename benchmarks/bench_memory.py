@@ -0,0 +1,67 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation wrong-import-position
+"""
+Peak RSS of the main TADS and GADS stages on a synthetic national inventory.
+
+Runs the stage sequence of `main_tads.py` (voltage filter, sort, latest
+entries, bus rearrangement, matching) and the GADS EIA filter on `size` rows,
+and prints the process's peak RSS above the memory held by the inputs. Run it
+on two commits to compare how much memory the stages add; peak RSS is per
+process, so every measurement needs a fresh run. Not available on Windows.
+
+Usage:
+    python benchmarks/bench_memory.py                # 2M rows
+    python benchmarks/bench_memory.py 500000
+"""
+
+import argparse
+import gc
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import make_gads_inventory, make_tads_inventory, make_velo_tlines
+from src.housekeeping_gads import eia_filtering
+from src.housekeeping_tads import (
+    get_latest_entries,
+    get_matched_entries,
+    rearrangeColumns,
+    sort_and_shift_columns,
+    sort_and_shift_columns_dfVelo,
+)
+
+
+def peak_rss_mb():
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxRss / (1 << 20) if sys.platform == "darwin" else maxRss / (1 << 10)
+
+
+def run(size):
+    dfTads0 = make_tads_inventory(size)
+    dfGads0 = make_gads_inventory(size)
+    dfVeloTlines0 = make_velo_tlines(dfTads0, max(size // 20, 1))
+    gc.collect()
+    inputsMB = peak_rss_mb()
+
+    start = time.perf_counter()
+    dfTads = dfTads0[dfTads0["VoltageClassCodeName"] != "0-99 kV"]
+    dfTadsLatest = get_latest_entries(sort_and_shift_columns(dfTads))
+    rearrangeColumns(dfTadsLatest)
+    get_matched_entries(sort_and_shift_columns_dfVelo(dfVeloTlines0), dfTadsLatest)
+    eia_filtering(dfGads0, column_name="EIACode")
+    seconds = time.perf_counter() - start
+
+    peakMB = peak_rss_mb()
+    print(f"{size} rows: inputs {inputsMB:.0f} MB, peak {peakMB:.0f} MB, added by the stages {peakMB - inputsMB:.0f} MB, {seconds:.1f} s")
+    return {"size": size, "inputsMB": inputsMB, "peakMB": peakMB, "seconds": seconds}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("size", nargs="?", type=int, default=2_000_000)
+    run(parser.parse_args().size)
+
+# %%
@@ -0,0 +1,89 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation wrong-import-position
+"""
+Benchmark of the TADS reduce step (`rearrangeColumns` + the `SortedBus`/`combo`
+construction in `get_reduced_df`) against the previous row-by-row implementation.
+
+Usage:
+    python benchmarks/bench_reduce_step.py                 # 10k, 100k and 1M rows
+    python benchmarks/bench_reduce_step.py 10000 100000    # custom sizes
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import make_tads_inventory
+from src.housekeeping_tads import get_reduced_df
+from src.schema import reducedTadsColumns
+
+
+def make_tads_match(numRows, numBuses=None, seed=0):
+    """
+    Builds a synthetic matched-TADS DataFrame with the columns `get_reduced_df` needs.
+    """
+    dfMatch = make_tads_inventory(numRows, numBuses=numBuses, seed=seed)
+    dfMatch["Rec_ID"] = np.random.default_rng(seed).integers(0, 10, numRows)
+    return dfMatch
+
+
+def legacy_rearrangeColumns(df, col1="FromBus", col2="ToBus"):
+    df = df.copy()
+    for index, row in df.iterrows():
+        value1 = str(row[col1])
+        value2 = str(row[col2])
+        if value1 > value2:
+            df.at[index, col1] = value2
+            df.at[index, col2] = value1
+    return df
+
+
+def legacy_get_reduced_df(dfMatch):
+    df_reduced = legacy_rearrangeColumns(dfMatch[reducedTadsColumns])
+    df_reduced_copy = df_reduced.copy()
+    df_reduced_copy["CircuitTypeCode_FirstWord"] = (
+        df_reduced_copy["CircuitTypeCode"].str.split().str[0]
+    )
+    df_reduced_copy["SortedBus"] = df_reduced_copy[["FromBus", "ToBus"]].apply(
+        lambda x: "-".join(sorted(x)), axis=1
+    )
+    df_reduced_copy["combo"] = df_reduced_copy.apply(
+        lambda row: f"{row['CircuitTypeCode_FirstWord']} {row['SortedBus']} {row['ElementIdentifierName']}",
+        axis=1,
+    )
+    df_reduced_copy.pop("CircuitTypeCode_FirstWord")
+    df_reduced_copy.pop("SortedBus")
+    df_reduced_copy = df_reduced_copy.sort_values(by=["FromBus", "ToBus"])
+    col = df_reduced_copy.pop("combo")
+    df_reduced_copy.insert(loc=0, column="combo", value=col)
+    return df_reduced_copy
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def run(sizes):
+    print(f"{'rows':>10} {'legacy [s]':>12} {'columnar [s]':>14} {'speedup':>9}")
+    for numRows in sizes:
+        dfMatch = make_tads_match(numRows)
+
+        dfLegacy, tLegacy = time_call(legacy_get_reduced_df, dfMatch)
+        dfColumnar, tColumnar = time_call(get_reduced_df, dfMatch)
+
+        pd.testing.assert_frame_equal(dfLegacy, dfColumnar, check_dtype=False)
+        print(f"{numRows:>10} {tLegacy:>12.3f} {tColumnar:>14.3f} {tLegacy / tColumnar:>8.1f}x")
+
+
+if __name__ == "__main__":
+    sizesArg = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    run(sizesArg)
+
+# %%
@@ -0,0 +1,224 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+"""
+Deterministic synthetic TADS, GADS and Velocity Suite tables for benchmarks.
+
+The tables have the columns and value formats of the real inputs in `rawData/`
+(which is not part of the repository), at any size and with a chosen share of
+Velocity Suite rows that have a counterpart in TADS/GADS. The same arguments
+always give the same tables.
+
+Example
+----------
+>>> dfTads = make_tads_inventory(100_000)
+>>> dfVeloTlines = make_velo_tlines(dfTads, 5_000, matchRate=0.6)
+>>> dfGads = make_gads_inventory(50_000)
+>>> dfVeloPlants = make_velo_plants(dfGads, 2_000, matchRate=0.8)
+>>> dfVeloUnits = make_velo_units(dfVeloPlants)
+"""
+
+import numpy as np
+import pandas as pd
+
+tadsColumns = [
+    "ElementIdentifierName",
+    "CompanyName",
+    "RegionCode",
+    "FromBus",
+    "ToBus",
+    "TertiaryBus",
+    "Miles",
+    "BESExemptedFlag",
+    "NumberOfTerminals",
+    "CircuitTypeCode",
+    "VoltageClassCodeName",
+    "ParentCode",
+    "ConductorsPerPhaseCode",
+    "OverheadGroundWireCode",
+    "InsulatorTypeCode",
+    "CableTypeCode",
+    "StructureMaterialCode",
+    "StructureTypeCode",
+    "CircuitsPerStructureCode",
+    "TerrainCode",
+    "ElevationCode",
+    "InServiceDate",
+    "RetirementDate",
+    "ReportingYearNbr",
+]
+
+tadsVoltageClasses = ["0-99 kV", "100-199 kV", "200-299 kV", "300-399 kV", "400-599 kV", "600-799 kV"]
+tadsCircuitTypes = ["AC Overhead", "AC Underground", "AC Submarine"]
+tadsRegions = ["MRO", "NPCC", "RF", "SERC", "TRE", "WECC"]
+stateNames = ["Illinois", "Indiana", "Wisconsin", "Iowa", "Michigan", "Ohio", "New York", "New Jersey", "Connecticut", "Pennsylvania"]
+stateAbbreviations = ["IL", "IN", "WI", "IA", "MI", "OH", "NY", "NJ", "CT", "PA"]
+capacityColumns = ["Operating Cap MW", "Planned Cap MW", "Canceled Cap MW", "Mothballed Cap MW", "Retired Cap MW"]
+
+
+def make_company_names(numCompanies):
+    # TADS spelling and the Velocity Suite spelling of the same companies
+    tadsNames = np.array([f"Synthetic Transmission Company {i:04d}" for i in range(numCompanies)], dtype=object)
+    veloNames = np.array([f"Synthetic Transmission Co {i:04d} LLC" for i in range(numCompanies)], dtype=object)
+    return tadsNames, veloNames
+
+
+def make_tads_inventory(numRows, numBuses=None, numCompanies=50, numYears=5, seed=0):
+    """
+    Synthetic TADS AC inventory, one row per (line, reporting year) as in "TADS 2024 AC Inventory.csv".
+
+    About `numYears`/2 reporting years per line on average, so `get_latest_entries`
+    has duplicates to remove. Bus names are "Substation <n>", drawn from
+    `numBuses` buses (default `numRows // 4`).
+    """
+    rng = np.random.default_rng(seed)
+    numBuses = numBuses or max(numRows // 4, 10)
+    buses = np.array([f"Substation {i:07d}" for i in range(numBuses)], dtype=object)
+    tadsCompanies, _ = make_company_names(numCompanies)
+
+    # Lines with one or more reporting years each
+    numLines = max(numRows * 2 // (numYears + 1), 1)
+    lineOf = np.sort(rng.integers(0, numLines, numRows))
+    lineFrom = rng.integers(0, numBuses, numLines)
+    lineTo = rng.integers(0, numBuses, numLines)
+    lineCompany = rng.integers(0, numCompanies, numLines)
+
+    df = pd.DataFrame({col: rng.integers(0, 10, numRows) for col in tadsColumns})
+    df["ElementIdentifierName"] = np.array([f"Line {i:08d}" for i in lineOf], dtype=object)
+    df["CompanyName"] = tadsCompanies[lineCompany[lineOf]]
+    df["RegionCode"] = rng.choice(tadsRegions, numRows)
+    df["FromBus"] = buses[lineFrom[lineOf]]
+    df["ToBus"] = buses[lineTo[lineOf]]
+    df["Miles"] = np.round(rng.gamma(2.0, 8.0, numRows), 2)
+    df["CircuitTypeCode"] = rng.choice(tadsCircuitTypes, numRows, p=[0.9, 0.08, 0.02])
+    df["VoltageClassCodeName"] = rng.choice(tadsVoltageClasses, numRows, p=[0.3, 0.35, 0.15, 0.1, 0.07, 0.03])
+    df["InServiceDate"] = pd.to_datetime(rng.integers(1950, 2020, numRows).astype(str), format="%Y").strftime("%m/%d/%Y")
+    df["RetirementDate"] = np.nan
+    df["ReportingYearNbr"] = 2024 - rng.integers(0, numYears, numRows)
+    return df
+
+
+def make_velo_tlines(dfTads, numRows, matchRate=0.5, seed=1):
+    """
+    Synthetic Velocity Suite transmission-line export ("tlines-near-<location>-raw.xlsx").
+
+    A share `matchRate` of the lines have the (From Sub, To Sub) of a TADS line,
+    half of them in reversed direction; the rest connect substations unknown to
+    TADS. Company names use the Velocity Suite spelling of the TADS company.
+    """
+    rng = np.random.default_rng(seed)
+    numMatched = int(round(numRows * matchRate))
+    _, veloCompanies = make_company_names(int(dfTads["CompanyName"].str[-4:].astype(int).max()) + 1)
+
+    tadsPos = rng.integers(0, len(dfTads), numMatched)
+    fromSub = dfTads["FromBus"].to_numpy(dtype=object)[tadsPos]
+    toSub = dfTads["ToBus"].to_numpy(dtype=object)[tadsPos]
+    swap = rng.random(numMatched) < 0.5
+    fromSub, toSub = np.where(swap, toSub, fromSub), np.where(swap, fromSub, toSub)
+    companyIds = dfTads["CompanyName"].str[-4:].astype(int).to_numpy()[tadsPos]
+
+    numUnmatched = numRows - numMatched
+    unknown = np.array([f"Velocity Substation {i:07d}" for i in range(2 * numUnmatched)], dtype=object)
+
+    df = pd.DataFrame(
+        {
+            "Company Name": np.concatenate([veloCompanies[companyIds], veloCompanies[rng.integers(0, len(veloCompanies), numUnmatched)]]),
+            "Name": None,
+            "Voltage kV": rng.choice([69, 115, 138, 161, 230, 345, 500, 765], numRows),
+            "Proposed": rng.choice(["In Service", "Proposed"], numRows, p=[0.9, 0.1]),
+            "Underground": rng.choice(["F", "T"], numRows, p=[0.95, 0.05]),
+            "From Sub": np.concatenate([fromSub, unknown[:numUnmatched]]),
+            "To Sub": np.concatenate([toSub, unknown[numUnmatched:]]),
+            "Length mi": np.round(rng.gamma(2.0, 8.0, numRows), 2),
+            "Rec_ID": rng.permutation(numRows) + 1000,
+        }
+    )
+    df["Name"] = df["From Sub"] + " to " + df["To Sub"] + " " + df["Voltage kV"].astype(str) + " kV"
+    return df.sample(frac=1.0, random_state=seed).reset_index(drop=True)
+
+
+def make_gads_inventory(numUnits, numPlants=None, seed=2):
+    """
+    Synthetic GADS unit inventory ("GADS inventory 2024.csv"), several units per plant.
+
+    Plants have EIA codes 10000, 10001, ...; a few units have no EIA code (0).
+    """
+    rng = np.random.default_rng(seed)
+    numPlants = numPlants or max(numUnits // 3, 1)
+    plantOf = np.sort(rng.integers(0, numPlants, numUnits))
+    plantState = rng.integers(0, len(stateNames), numPlants)
+
+    eiaCode = 10000 + plantOf
+    eiaCode[rng.random(numUnits) < 0.02] = 0
+
+    return pd.DataFrame(
+        {
+            "UnitName": np.array([f"Plant {p:06d} Unit {u}" for p, u in zip(plantOf, rng.integers(1, 9, numUnits))], dtype=object),
+            "UtilityName": np.array([f"Synthetic Utility {p % 500:03d}" for p in plantOf], dtype=object),
+            "UnitCode": np.arange(numUnits) + 100000,
+            "EIACode": eiaCode,
+            "StateName": np.array(stateNames, dtype=object)[plantState[plantOf]],
+            "UnitTypeCodeName": rng.choice(["Fossil-Steam", "Combined Cycle", "Gas Turbine/Jet Engine", "Hydro/Pumped Storage", "Nuclear", "Wind", "Solar"], numUnits),
+            "NetMaximumCapacity": np.round(rng.gamma(2.0, 60.0, numUnits), 1),
+            "CommercialDate": pd.to_datetime(rng.integers(1950, 2023, numUnits).astype(str), format="%Y").strftime("%m/%d/%Y"),
+        }
+    )
+
+
+def make_velo_plants(dfGads, numPlants, matchRate=0.7, seed=3):
+    """
+    Synthetic Velocity Suite generating-plant export ("genPlants-near-<location>-raw.xlsx").
+
+    A share `matchRate` of the plants carry the EIA code of a GADS plant. The
+    'EIA ID' column is text as in the export: mostly a single code, some plants
+    with two codes ("10012, 10013"), some without (empty or "0").
+    """
+    rng = np.random.default_rng(seed)
+    gadsCodes = np.unique(dfGads["EIACode"].to_numpy())
+    gadsCodes = gadsCodes[gadsCodes > 0]
+    numMatched = min(int(round(numPlants * matchRate)), len(gadsCodes))
+
+    codes = np.concatenate(
+        [rng.choice(gadsCodes, numMatched, replace=False), 900000 + np.arange(numPlants - numMatched)]
+    )
+    eiaIds = codes.astype(str).astype(object)
+    twoCodes = rng.random(numPlants) < 0.03
+    eiaIds[twoCodes] = eiaIds[twoCodes] + ", " + (codes[twoCodes] + 1).astype(str)
+    missing = rng.random(numPlants) < 0.05
+    eiaIds[missing] = rng.choice(np.array([None, "0"], dtype=object), int(missing.sum()))
+
+    states = np.array(stateAbbreviations, dtype=object)
+    df = pd.DataFrame(
+        {
+            "Plant Name": np.array([f"Velocity Plant {i:06d}" for i in range(numPlants)], dtype=object),
+            "Plant Operator Name": np.array([f"Synthetic Operator {i % 300:03d}" for i in range(numPlants)], dtype=object),
+            "EIA ID": eiaIds,
+            "Rec_ID": rng.permutation(numPlants) + 5000,
+            "State": states[rng.integers(0, len(states), numPlants)],
+        }
+    )
+    for col in capacityColumns:
+        df[col] = np.round(rng.gamma(1.0, 50.0, numPlants) * (rng.random(numPlants) < 0.5), 1)
+    return df.sample(frac=1.0, random_state=seed).reset_index(drop=True)
+
+
+def make_velo_units(dfVeloPlants, unitsPerPlant=3, seed=4):
+    """
+    Synthetic Velocity Suite generating-unit export ("genUnits-near-<location>-raw.xlsx"),
+    1 to 2 * `unitsPerPlant` - 1 units per plant, linked to the plants by 'Plant Name' only.
+    """
+    rng = np.random.default_rng(seed)
+    numUnits = rng.integers(1, 2 * unitsPerPlant, len(dfVeloPlants))
+    plantNames = np.repeat(dfVeloPlants["Plant Name"].to_numpy(dtype=object), numUnits)
+    unitNumber = np.arange(len(plantNames)) - np.repeat(np.cumsum(numUnits) - numUnits, numUnits) + 1
+
+    return pd.DataFrame(
+        {
+            "Plant Name": plantNames,
+            "Unit": unitNumber,
+            "Unit Capacity MW": np.round(rng.gamma(2.0, 40.0, len(plantNames)), 1),
+            "Fuel Type": rng.choice(["Gas", "Coal", "Water", "Uranium", "Wind", "Sun"], len(plantNames)),
+        }
+    )
+
+
+# %%
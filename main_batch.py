@@ -0,0 +1,122 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation wrong-import-position
+"""
+Batch version of main_tads.py and main_gads.py over many weather stations.
+
+The national TADS and GADS inventories are loaded and preprocessed once and the
+Velocity Suite exports of all locations are parsed into the input cache in
+parallel, then the per-location stages run in parallel on a process pool. Outputs are written to
+processedData/<analysisCategory>/<location>/.
+
+Usage:
+    python main_batch.py                          # locations listed in rawData/locations.txt
+    python main_batch.py chicago-ohare newYork-jfk
+
+With BATCH_TLINES_LAYER and BATCH_STATIONS_LAYER set to a Velocity Suite tlines
+layer and a weather stations layer (MapInfo .TAB), the tlines of every location
+are selected from the layer within BATCH_RADIUS_MILES (default 50) of its station
+instead of being read from tlines-near-<location>-raw.xlsx.
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+wd = os.path.dirname(os.path.abspath(__file__))
+
+from src.batch_runner import run_locations  # Forward Declaration
+from src.excel_loader import prefetch_excel  # Forward Declaration
+from src.input_cache import remove_stale_cache_files  # Forward Declaration
+from src.pipeline_gads import load_gads_inventory, run_gads_location  # Forward Declaration
+from src.pipeline_tads import load_tads_inventory, run_tads_location, select_velo_tlines  # Forward Declaration
+from src.profiling import profiler  # Forward Declaration
+
+
+def get_folders(analysisCategory):
+    rawDataFolder = os.path.join(wd, "rawData", analysisCategory)
+    processedDataFolder = os.path.join(wd, "processedData", analysisCategory)
+    cacheFolder = os.path.join(wd, "cachedData", analysisCategory)
+    return rawDataFolder, processedDataFolder, cacheFolder
+
+
+def prefetch_velo_exports(locations, rawDataFolder, cacheFolder, components, maxWorkers=None):
+    # Parse the Velocity Suite exports of all locations into the input cache on all cores, so that
+    # the per-location stages only load them. Missing files are left for the locations to report.
+    fileAddrs = [os.path.join(rawDataFolder, component + "-near-" + location + "-raw.xlsx") for location in locations for component in components]
+    errors = prefetch_excel([fileAddr for fileAddr in fileAddrs if os.path.exists(fileAddr)], cacheFolder, maxWorkers=maxWorkers)
+    for error in errors.values():
+        print(f"Prefetch failed: {error}")
+
+
+def collect_match_reports(locations, processedDataFolder):
+    # One table with the match report of every location (see src/match_report.py)
+    reportAddrs = {location: os.path.join(processedDataFolder, location, "matchReport-" + location + ".csv") for location in locations}
+    dfReports = [pd.read_csv(reportAddr).assign(location=location) for location, reportAddr in reportAddrs.items() if os.path.exists(reportAddr)]
+    if dfReports:
+        pd.concat(dfReports, ignore_index=True).to_csv(os.path.join(processedDataFolder, "matchReport-all.csv"), index=False)
+
+
+def read_locations(locationsFileAddr):
+    # One location per line, blank lines and lines starting with '#' are ignored
+    with open(locationsFileAddr, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def report(results, analysisCategory):
+    failed = {location: result for location, result in results.items() if isinstance(result, str)}
+    for location, error in failed.items():
+        print(f"[{analysisCategory}] {location} failed:\n{error}")
+
+    dfSummary = pd.DataFrame([result for result in results.values() if isinstance(result, dict)])
+    print(f"[{analysisCategory}] {len(dfSummary)} locations done, {len(failed)} failed.")
+    if not dfSummary.empty:
+        print(dfSummary.to_string(index=False))
+    return dfSummary
+
+
+if __name__ == "__main__":
+    locations = sys.argv[1:] or read_locations(os.path.join(wd, "rawData", "locations.txt"))
+    maxWorkers = int(os.environ.get("BATCH_MAX_WORKERS", "0")) or None
+    useStageStore = os.environ.get("BATCH_INCREMENTAL", "1") == "1"  # skip unchanged TADS and GADS stages on reruns
+    streamTads = os.environ.get("BATCH_STREAM_TADS", "0") == "1"  # chunked TADS read for inventories larger than memory
+    tlinesLayerAddr = os.environ.get("BATCH_TLINES_LAYER")  # select the tlines near each station from one layer
+    stationsLayerAddr = os.environ.get("BATCH_STATIONS_LAYER")
+    radiusMiles = float(os.environ.get("BATCH_RADIUS_MILES", "50"))
+
+    # Transmission lines
+    rawDataFolder, processedDataFolder, cacheFolder = get_folders("transmission_data")
+    remove_stale_cache_files(cacheFolder)  # before any worker process maps a cache file
+    dfTadsNational = load_tads_inventory(rawDataFolder, cacheFolder, streaming=streamTads)
+    if tlinesLayerAddr and stationsLayerAddr:
+        veloTlinesExtracts = select_velo_tlines(tlinesLayerAddr, stationsLayerAddr, locations, radiusMiles=radiusMiles)
+    else:
+        veloTlinesExtracts = {}
+    prefetch_velo_exports([location for location in locations if location not in veloTlinesExtracts], rawDataFolder, cacheFolder, ["tlines"], maxWorkers=maxWorkers)
+    profiler.write_report(os.path.join(processedDataFolder, "runReport-national.json"))  # per-location reports are in the location folders
+    resultsTads = run_locations(
+        locations, run_tads_location, dfTadsNational,
+        rawDataFolder, processedDataFolder, cacheFolder, useStageStore,
+        maxWorkers=maxWorkers,
+        locationKwargs={location: {"veloTlinesLayers": {location: dfExtract}} for location, dfExtract in veloTlinesExtracts.items()},
+    )
+    report(resultsTads, "transmission_data")
+    collect_match_reports(locations, processedDataFolder)
+    del dfTadsNational
+
+    # Generators
+    rawDataFolder, processedDataFolder, cacheFolder = get_folders("generator_data")
+    remove_stale_cache_files(cacheFolder)
+    profiler.reset()
+    dfGadsNational = load_gads_inventory(rawDataFolder, cacheFolder)
+    prefetch_velo_exports(locations, rawDataFolder, cacheFolder, ["genPlants", "genUnits"], maxWorkers=maxWorkers)
+    profiler.write_report(os.path.join(processedDataFolder, "runReport-national.json"))
+    resultsGads = run_locations(
+        locations, run_gads_location, dfGadsNational,
+        rawDataFolder, processedDataFolder, cacheFolder, useStageStore,
+        maxWorkers=maxWorkers,
+    )
+    report(resultsGads, "generator_data")
+    collect_match_reports(locations, processedDataFolder)
+
+# %%
@@ -0,0 +1,47 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation wrong-import-position
+"""
+Local HTTP matching service over the national TADS and GADS inventories.
+
+The inventories are loaded and preprocessed once, as in main_batch.py, and kept
+in memory with their join indexes, so match and lookup requests are answered
+without rerunning main_tads.py or main_gads.py. See src/match_service.py for
+the endpoints.
+
+Usage:
+    python main_service.py                 # http://127.0.0.1:8765
+    python main_service.py 9000
+
+    curl "http://127.0.0.1:8765/tads/tlines?from=Crawford&to=Fisk"
+    curl "http://127.0.0.1:8765/gads/units?eia=10474"
+    curl -X POST http://127.0.0.1:8765/tads/match -d '{"location": "chicago-ohare", "tlines": [{"From Sub": "Crawford", "To Sub": "Fisk", "Rec_ID": 1, "Company Name": "Commonwealth Edison Co"}]}'
+"""
+
+import os
+import sys
+
+wd = os.path.dirname(os.path.abspath(__file__))
+
+from src.match_service import MatchService, serve  # Forward Declaration
+from src.pipeline_gads import load_gads_inventory  # Forward Declaration
+from src.pipeline_tads import load_tads_inventory  # Forward Declaration
+
+
+def get_folders(analysisCategory):
+    rawDataFolder = os.path.join(wd, "rawData", analysisCategory)
+    cacheFolder = os.path.join(wd, "cachedData", analysisCategory)
+    return rawDataFolder, cacheFolder
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    host = os.environ.get("SERVICE_HOST", "127.0.0.1")
+
+    dfTadsNational = load_tads_inventory(*get_folders("transmission_data"))
+    dfGadsNational = load_gads_inventory(*get_folders("generator_data"))
+    service = MatchService(dfTadsNational, dfGadsNational)
+    print(service.health())
+
+    serve(service, host=host, port=port)
+
+# %%
@@ -0,0 +1,96 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation global-statement
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Inventory shared read-only by every location handled in a worker process
+_sharedInventory = None
+
+
+def run_locations(locations, runLocation, sharedInventory, *args, maxWorkers=None, locationKwargs=None):
+    """
+    Run a per-location pipeline stage for many weather stations on a process pool.
+
+    `sharedInventory` (the preprocessed national TADS or GADS frame) is handed to
+    each worker process once, through the pool initializer, instead of once per
+    location. With the 'fork' start method (Linux/macOS) the workers inherit it
+    without any pickling at all. Each location then calls
+    `runLocation(location, sharedInventory, *args, **locationKwargs.get(location, {}))`.
+
+    Parameters
+    ----------
+    - `locations` : list of str
+        Weather stations to process, e.g. ["chicago-ohare", "newYork-jfk"].
+
+    - `runLocation` : callable
+        A module-level function such as `run_tads_location` or `run_gads_location`.
+
+    - `sharedInventory` : pandas.DataFrame
+        The national inventory. Workers must treat it as read-only.
+
+    - `*args` :
+        Further positional arguments passed to `runLocation` (folders etc.).
+
+    - `maxWorkers` : int, optional (default=None)
+        Number of worker processes. None uses `os.cpu_count()`. With
+        `maxWorkers=1` the locations are run in the current process.
+
+    - `locationKwargs` : dict, optional (default=None)
+        Maps locations to keyword arguments passed to `runLocation` for that
+        location only, e.g. its own Velocity Suite extract. Unlike `*args`,
+        which every task carries, only a location's own entry is pickled for
+        its task.
+
+    Returns
+    ----------
+    `results` : dict
+        Maps each location to the return value of `runLocation`, or to the
+        formatted traceback (str) if that location failed. A failing location
+        does not stop the others.
+    """
+    maxWorkers = min(maxWorkers or os.cpu_count() or 1, len(locations)) or 1
+    locationKwargs = locationKwargs or {}
+    results = {}
+
+    if maxWorkers == 1:
+        _init_worker(sharedInventory)
+        for location in locations:
+            results[location] = _run_one(runLocation, location, args, locationKwargs.get(location, {}))
+        return results
+
+    startMethods = multiprocessing.get_all_start_methods()
+    mpContext = multiprocessing.get_context("fork" if "fork" in startMethods else None)
+
+    with ProcessPoolExecutor(
+        max_workers=maxWorkers,
+        mp_context=mpContext,
+        initializer=_init_worker,
+        initargs=(sharedInventory,),
+    ) as executor:
+        futures = {
+            executor.submit(_run_one, runLocation, location, args, locationKwargs.get(location, {})): location
+            for location in locations
+        }
+        for future in as_completed(futures):
+            location = futures[future]
+            results[location] = future.result()
+            print(f"Finished location {location} ({len(results)}/{len(locations)})")
+
+    return {location: results[location] for location in locations}
+
+
+def _init_worker(sharedInventory):
+    global _sharedInventory
+    _sharedInventory = sharedInventory
+
+
+def _run_one(runLocation, location, args, kwargs):
+    try:
+        return runLocation(location, _sharedInventory, *args, **kwargs)
+    except Exception:  # pylint: disable=broad-except
+        return traceback.format_exc()
+
+
+# %%
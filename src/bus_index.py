@@ -0,0 +1,191 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from src.housekeeping_tads import get_canonical_bus_pairs
+from src.input_cache import hash_file, read_csv_cached
+
+indexArrayNames = ("pairLo", "pairHi", "pairOffsets", "pairRows", "busKeys", "busOffsets", "busRows")
+
+
+class BusPairIndex:
+    """
+    Persistent index from bus pairs and single buses to row offsets in the cached TADS table.
+
+    The index maps every direction-agnostic (bus, bus) pair, and every single bus
+    appearing as 'FromBus' or 'ToBus', to the positional row offsets of the TADS
+    lines using it, in the table returned by `read_csv_cached(tadsFileAddr, cacheFolder)`.
+
+    It is stored as plain `.npy` arrays (grouped keys, CSR-style offsets and row
+    offsets) under `cacheFolder/busIndex-<file name>/`, together with the size,
+    modification time and SHA-256 of the TADS file it was built from. Nothing is
+    read until the first lookup. The arrays are then memory-mapped and a dict
+    from key to group is built once, so every further lookup is a constant-time
+    dict access plus a slice. The index is rebuilt only when the TADS file's
+    contents change.
+
+    Parameters
+    ----------
+    - `tadsFileAddr` : str
+        Path of the raw TADS inventory CSV.
+
+    - `cacheFolder` : str
+        Folder of the input cache (see `src.input_cache`), which also holds the index.
+
+    Example
+    ----------
+    >>> busIndex = BusPairIndex(tadsFileAddr, cacheFolder)
+    >>> busIndex.find_tline_by_buses("Crawford", "Fisk")  # same rows as find_tline_by_buses(dfTads0, ...)
+    >>> busIndex.lookup_bus("Crawford")  # row offsets of all lines at a bus
+    """
+
+    def __init__(self, tadsFileAddr, cacheFolder):
+        self.tadsFileAddr = tadsFileAddr
+        self.cacheFolder = cacheFolder
+        self.indexFolder = os.path.join(cacheFolder, "busIndex-" + os.path.basename(tadsFileAddr).replace(".", "_"))
+        self._arrays = None
+        self._pairGroups = None
+        self._busGroups = None
+        self._dfTads = None
+
+    def lookup_pair(self, bus1, bus2):
+        """
+        Returns the row offsets (numpy.ndarray) of all lines between `bus1` and `bus2`, in either direction.
+        """
+        self._load()
+        key = (str(bus1), str(bus2)) if str(bus1) <= str(bus2) else (str(bus2), str(bus1))
+        group = self._pairGroups.get(key)
+        if group is None:
+            return np.empty(0, dtype=np.int64)
+        offsets = self._arrays["pairOffsets"]
+        return np.asarray(self._arrays["pairRows"][offsets[group]:offsets[group + 1]])
+
+    def lookup_bus(self, bus):
+        """
+        Returns the row offsets (numpy.ndarray) of all lines with `bus` as 'FromBus' or 'ToBus'.
+        """
+        self._load()
+        group = self._busGroups.get(str(bus))
+        if group is None:
+            return np.empty(0, dtype=np.int64)
+        offsets = self._arrays["busOffsets"]
+        return np.asarray(self._arrays["busRows"][offsets[group]:offsets[group + 1]])
+
+    def find_tline_by_buses(self, value1, value2):
+        """
+        Indexed version of `helperFunctions.find_tline_by_buses` on the cached TADS table.
+        """
+        return self.get_table().iloc[self.lookup_pair(value1, value2)]
+
+    def get_table(self):
+        """
+        Returns the cached TADS table the row offsets refer to, loaded on first use.
+        """
+        if self._dfTads is None:
+            self._dfTads = read_csv_cached(self.tadsFileAddr, self.cacheFolder)
+        return self._dfTads
+
+    def _load(self):
+        if self._arrays is not None:
+            return
+
+        if not self._is_current():
+            self._build()
+
+        self._arrays = {
+            name: np.load(os.path.join(self.indexFolder, name + ".npy"), mmap_mode="r")
+            for name in indexArrayNames
+        }
+        self._pairGroups = {
+            key: group
+            for group, key in enumerate(zip(self._arrays["pairLo"].tolist(), self._arrays["pairHi"].tolist()))
+        }
+        self._busGroups = {key: group for group, key in enumerate(self._arrays["busKeys"].tolist())}
+
+    def _is_current(self):
+        metaAddr = os.path.join(self.indexFolder, "meta.json")
+        if not os.path.exists(metaAddr):
+            return False
+        with open(metaAddr, encoding="utf-8") as f:
+            meta = json.load(f)
+
+        stat = os.stat(self.tadsFileAddr)
+        if meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+            return True
+        if meta["contentHash"] != hash_file(self.tadsFileAddr):
+            return False
+
+        # Touched but unchanged, remember the new modification time
+        meta["mtime_ns"] = stat.st_mtime_ns
+        with open(metaAddr, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        return True
+
+    def _build(self):
+        print(f"Building bus-pair index for {os.path.basename(self.tadsFileAddr)}.")
+        dfTads = self.get_table()
+        stat = os.stat(self.tadsFileAddr)
+
+        lo, hi = get_canonical_bus_pairs(dfTads, col1="FromBus", col2="ToBus")
+        pairCodes, pairKeys = pd.factorize(pd.MultiIndex.from_arrays([lo, hi]))
+        pairOffsets, pairRows = _group_rows(pairCodes, len(pairKeys))
+
+        # A line with FromBus == ToBus is listed once for that bus
+        positions = np.arange(len(dfTads))
+        buses = np.concatenate([lo, hi])
+        busCodes, busKeys = pd.factorize(buses)
+        busPositions = np.concatenate([positions, positions])
+        order = np.lexsort((busPositions, busCodes))
+        busCodes, busPositions = busCodes[order], busPositions[order]
+        isFirst = np.ones(len(busCodes), dtype=bool)
+        isFirst[1:] = (busCodes[1:] != busCodes[:-1]) | (busPositions[1:] != busPositions[:-1])
+        busOffsets, _ = _group_rows(busCodes[isFirst], len(busKeys))
+        busRows = busPositions[isFirst]
+
+        arrays = {
+            "pairLo": np.asarray(pairKeys.get_level_values(0), dtype=str),
+            "pairHi": np.asarray(pairKeys.get_level_values(1), dtype=str),
+            "pairOffsets": pairOffsets,
+            "pairRows": pairRows,
+            "busKeys": np.asarray(busKeys, dtype=str),
+            "busOffsets": busOffsets,
+            "busRows": busRows,
+        }
+
+        # Write into a fresh folder and swap it in, so a reader never sees half an index
+        tmpFolder = self.indexFolder + ".tmp"
+        shutil.rmtree(tmpFolder, ignore_errors=True)
+        os.makedirs(tmpFolder)
+        for name, values in arrays.items():
+            np.save(os.path.join(tmpFolder, name + ".npy"), values)
+        with open(os.path.join(tmpFolder, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "source": os.path.abspath(self.tadsFileAddr),
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "contentHash": hash_file(self.tadsFileAddr),
+                    "numRows": len(dfTads),
+                },
+                f,
+                indent=2,
+            )
+        shutil.rmtree(self.indexFolder, ignore_errors=True)
+        os.replace(tmpFolder, self.indexFolder)
+
+
+def _group_rows(codes, numGroups):
+    # CSR layout: rows of group g are rows[offsets[g]:offsets[g + 1]], in ascending order
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes, minlength=numGroups)
+    offsets = np.zeros(numGroups + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, order.astype(np.int64)
+
+
+# %%
@@ -0,0 +1,86 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+# Velocity Suite company name -> TADS company name. Rows with an empty 'location'
+# apply everywhere, rows with a location only there and take precedence.
+companyAliasesAddr = os.path.join(os.path.dirname(os.path.abspath(__file__)), "company_aliases.csv")
+
+
+def get_company_alias_lookup(location=None, aliasesFileAddr=companyAliasesAddr):
+    """
+    Compiled alias lookup for `location`: the Velocity Suite names as a `pandas.Index`
+    and the TADS names as an object array of the same length.
+
+    The table is read and compiled once per (file, modification time, location)
+    and reused from memory afterwards.
+    """
+    return _compile_aliases(os.path.abspath(aliasesFileAddr), os.stat(aliasesFileAddr).st_mtime_ns, location)
+
+
+def normalize_company_names(companyNames, location=None, aliasesFileAddr=companyAliasesAddr):
+    """
+    Rename Velocity Suite company names to the exact strings used in TADS, for a whole column at once.
+
+    Names without an alias are returned unchanged.
+
+    Parameters
+    ----------
+    - `companyNames` : pandas.Series
+        Velocity Suite company names, plain strings or categorical.
+
+    - `location` : str, optional (default=None)
+        Weather station, selects the location-specific rows of the alias table
+        in addition to the general ones.
+
+    - `aliasesFileAddr` : str, optional (default=`companyAliasesAddr`)
+        CSV with columns 'veloName', 'tadsName' and optionally 'location'.
+
+    Returns
+    ----------
+    `companyNamesTads` : pandas.Series
+        Same index as `companyNames`. A categorical input gives a categorical
+        output; only its categories are looked up.
+
+    Example
+    ----------
+    >>> normalize_company_names(dfVeloTlines["Company Name"], "chicago-ohare")
+    """
+    aliasKeys, aliasValues = get_company_alias_lookup(location, aliasesFileAddr)
+
+    def apply_aliases(values):
+        positions = aliasKeys.get_indexer(values)
+        return np.where(positions >= 0, aliasValues[positions], values)
+
+    if isinstance(companyNames.dtype, pd.CategoricalDtype):
+        # Several names may map to one TADS name, so the categories are merged rather than renamed
+        renamed = apply_aliases(companyNames.cat.categories.to_numpy(dtype=object))
+        newCategories = pd.Index(pd.unique(renamed))
+        categoryCodes = newCategories.get_indexer(renamed)
+        codes = companyNames.cat.codes.to_numpy()
+        newCodes = np.where(codes >= 0, categoryCodes[codes], -1)
+        return pd.Series(pd.Categorical.from_codes(newCodes, categories=newCategories), index=companyNames.index, name=companyNames.name)
+
+    return pd.Series(apply_aliases(companyNames.to_numpy(dtype=object)), index=companyNames.index, name=companyNames.name)
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_aliases(aliasesFileAddr, mtimeNs, location):  # pylint: disable=unused-argument
+    # mtimeNs is only part of the cache key, so that an edited table is compiled again
+    dfAliases = pd.read_csv(aliasesFileAddr, dtype=str, keep_default_na=False)
+    if "location" not in dfAliases.columns:
+        dfAliases["location"] = ""
+
+    dfAliases = dfAliases[(dfAliases["location"] == "") | (dfAliases["location"] == location)]
+    # General rows first, so that location-specific rows win when keeping the last per name
+    dfAliases = dfAliases.sort_values("location", key=lambda s: s != "", kind="stable")
+    dfAliases = dfAliases.drop_duplicates(subset="veloName", keep="last")
+
+    return pd.Index(dfAliases["veloName"]), dfAliases["tadsName"].to_numpy(dtype=object)
+
+
+# %%
@@ -0,0 +1,150 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from src.input_cache import is_cached, read_cached
+from src.profiling import profile_stage
+
+
+def read_xlsx_streaming(fileAddr, sheetIndex=0):
+    """
+    Read one sheet of an xlsx file by streaming its rows, a faster alternative to `pd.read_excel`.
+
+    The workbook is opened read-only and the cell values are taken row by row
+    as plain Python values, without the per-cell conversion `pd.read_excel`
+    applies; the first row is the header. Column dtypes are inferred from the
+    values, so numbers, strings and dates come out typed as with `pd.read_excel`.
+    Trailing empty rows are dropped. About a fifth faster on the Velocity Suite
+    exports.
+
+    Example
+    ----------
+    >>> dfVeloPlants0 = read_cached(veloFileGenPlantsAddr, cacheFolder, read_xlsx_streaming)
+    """
+    workbook = openpyxl.load_workbook(fileAddr, read_only=True, data_only=True, keep_links=False)
+    try:
+        rows = workbook.worksheets[sheetIndex].iter_rows(values_only=True)
+        header = next(rows, ())
+        df = pd.DataFrame(list(rows), columns=list(header))
+    finally:
+        workbook.close()
+
+    # Read-only sheets can report a larger dimension than the data they hold
+    nonEmptyRows = np.flatnonzero(df.notna().any(axis=1).to_numpy())
+    df = df.iloc[: nonEmptyRows[-1] + 1 if len(nonEmptyRows) else 0]
+
+    return df.infer_objects()
+
+
+def excel_reader(streaming=False):
+    """
+    Returns the reader function and its arguments for `read_cached`: `pd.read_excel`
+    with openpyxl (the same cache entries as `read_excel_cached(..., engine="openpyxl")`),
+    or `read_xlsx_streaming` with `streaming=True`.
+    """
+    if streaming:
+        return read_xlsx_streaming, {}
+    return pd.read_excel, {"engine": "openpyxl"}
+
+
+@profile_stage
+def read_excel_many(fileAddrs, cacheFolder, maxWorkers=None, streaming=False):
+    """
+    Read several xlsx files through the input cache, parsing the ones not cached yet in parallel.
+
+    openpyxl parses in pure Python on one core, so workbooks are parsed in a
+    process pool, one per process. The workers write their result to the
+    columnar input cache (see `src.input_cache.read_cached`) instead of sending
+    it back, and the frames are then loaded from there, memory-mapped, with the
+    dtypes they were parsed with.
+
+    Parameters
+    ----------
+    - `fileAddrs` : list of str
+        The xlsx files, e.g. the Velocity Suite plant and unit exports of a location.
+
+    - `cacheFolder` : str
+        Folder of the input cache.
+
+    - `maxWorkers` : int, optional (default=None)
+        Worker processes. None uses `os.cpu_count()`, at most one per file to parse.
+
+    - `streaming` : bool, optional (default=False)
+        Parse with `read_xlsx_streaming` instead of `pd.read_excel`.
+
+    Returns
+    ----------
+    `frames` : dict
+        Maps every address in `fileAddrs` to its DataFrame.
+
+    Example
+    ----------
+    >>> frames = read_excel_many([veloFileGenPlantsAddr, veloFileGenUnitsAddr], cacheFolder)
+    >>> dfVeloPlants0, dfVeloUnits0 = frames[veloFileGenPlantsAddr], frames[veloFileGenUnitsAddr]
+    """
+    errors = prefetch_excel(fileAddrs, cacheFolder, maxWorkers=maxWorkers, streaming=streaming)
+    if errors:
+        raise RuntimeError("Could not read:\n" + "\n".join(errors.values()))
+
+    reader, readKwargs = excel_reader(streaming)
+    return {fileAddr: read_cached(fileAddr, cacheFolder, reader, **readKwargs) for fileAddr in fileAddrs}
+
+
+def prefetch_excel(fileAddrs, cacheFolder, maxWorkers=None, streaming=False):
+    """
+    Parse the xlsx files in `fileAddrs` that are not in the input cache yet, in a process pool.
+
+    Later reads of these files with the same reader (see `excel_reader`) are
+    cache hits, e.g. the per-location `read_excel_cached` calls of a batch run.
+    A file that cannot be read does not stop the others.
+
+    Returns
+    ----------
+    `errors` : dict
+        Maps the address of every file that could not be read to the error message.
+    """
+    reader, readKwargs = excel_reader(streaming)
+    errors = {fileAddr: f"File not found: {fileAddr}" for fileAddr in fileAddrs if not os.path.exists(fileAddr)}
+    toParse = [
+        fileAddr
+        for fileAddr in dict.fromkeys(fileAddrs)
+        if fileAddr not in errors and not is_cached(fileAddr, cacheFolder, reader, **readKwargs)
+    ]
+    maxWorkers = min(maxWorkers or os.cpu_count() or 1, len(toParse))
+
+    if maxWorkers <= 1:
+        for fileAddr in toParse:
+            error = _parse_into_cache(fileAddr, cacheFolder, streaming)
+            if error is not None:
+                errors[fileAddr] = error
+        return errors
+
+    startMethods = multiprocessing.get_all_start_methods()
+    mpContext = multiprocessing.get_context("fork" if "fork" in startMethods else None)
+
+    with ProcessPoolExecutor(max_workers=maxWorkers, mp_context=mpContext) as executor:
+        futures = {executor.submit(_parse_into_cache, fileAddr, cacheFolder, streaming): fileAddr for fileAddr in toParse}
+        for future in as_completed(futures):
+            error = future.result()
+            if error is not None:
+                errors[futures[future]] = error
+
+    return errors
+
+
+def _parse_into_cache(fileAddr, cacheFolder, streaming):
+    reader, readKwargs = excel_reader(streaming)
+    try:
+        read_cached(fileAddr, cacheFolder, reader, **readKwargs)
+    except Exception as error:  # pylint: disable=broad-except
+        return f"{os.path.basename(fileAddr)}: {type(error).__name__}: {error}"
+    return None
+
+
+# %%
@@ -0,0 +1,251 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import re
+
+import numpy as np
+import pandas as pd
+
+from src.profiling import profile_stage
+
+# Spelling variants seen in substation names, applied to whole words after upper-casing
+substationAbbreviations = {
+    "SUBSTATION": "",
+    "SUB": "",
+    "SS": "",
+    "STATION": "",
+    "STA": "",
+    "SW": "SWITCHING",
+    "SWITCH": "SWITCHING",
+    "SWYD": "SWITCHYARD",
+    "JCT": "JUNCTION",
+    "JUNC": "JUNCTION",
+    "TP": "TAP",
+    "N": "NORTH",
+    "S": "SOUTH",
+    "E": "EAST",
+    "W": "WEST",
+    "NO": "NORTH",
+    "SO": "SOUTH",
+    "MT": "MOUNT",
+    "PT": "POINT",
+    "CRK": "CREEK",
+    "CR": "CREEK",
+    "LK": "LAKE",
+    "HTS": "HEIGHTS",
+    "FT": "FORT",
+}
+
+
+def normalize_substation_names(names):
+    """
+    Normalize substation names for fuzzy comparison.
+
+    Upper-cases, replaces punctuation by spaces, expands or drops common
+    abbreviations (see `substationAbbreviations`) and collapses whitespace.
+    Missing names stay missing (NaN).
+
+    Example
+    ----------
+    >>> normalize_substation_names(pd.Series(["Crawford Sub.", "N. Aurora SS", None, "Mt. Prospect Jct"])).tolist()
+    ['CRAWFORD', 'NORTH AURORA', nan, 'MOUNT PROSPECT JUNCTION']
+    """
+    abbreviationPattern = r"\b(" + "|".join(map(re.escape, substationAbbreviations)) + r")\b"
+
+    # Work on the distinct names only, then broadcast back
+    codes, uniqueNames = pd.factorize(names.astype(str).to_numpy(), use_na_sentinel=False)
+    uniqueNorm = (
+        pd.Series(uniqueNames, dtype=object)
+        .str.upper()
+        .str.replace(r"[^A-Z0-9 ]", " ", regex=True)
+        .str.replace(abbreviationPattern, lambda m: substationAbbreviations[m.group(0)], regex=True)
+        .str.replace(r"\s+", " ", regex=True)
+        .str.strip()
+    )
+
+    normNames = uniqueNorm.to_numpy()[codes]
+    # astype(str) turned missing names into "nan", which must not match anything
+    normNames[names.isna().to_numpy()] = np.nan
+
+    return pd.Series(normNames, index=names.index)
+
+
+def get_name_candidates(veloNames, tadsNames, minScore=0.6, topK=3, maxGramPostings=1000, maxBlockCandidates=20):
+    """
+    Ranked fuzzy candidates in `tadsNames` for every name in `veloNames`, without all-pairs comparison.
+
+    Every name is split into padded character trigrams. Blocking: only pairs
+    sharing at least one trigram that occurs in at most `maxGramPostings` TADS
+    names are considered (very common trigrams such as " NO" would pair almost
+    every name), and per Velocity Suite name only the `maxBlockCandidates` pairs
+    sharing the most such trigrams are kept. Those candidates are then scored
+    with the Dice coefficient over all their trigrams, computed with joins and
+    group-bys over the whole candidate set at once.
+
+    Parameters
+    ----------
+    - `veloNames`, `tadsNames` : array-like of str
+        Normalized (see `normalize_substation_names`) distinct names.
+
+    - `minScore` : float, optional (default=0.6)
+        Minimum Dice similarity of a candidate (1.0 for identical names).
+
+    - `topK` : int, optional (default=3)
+        Number of best candidates kept per Velocity Suite name.
+
+    - `maxGramPostings`, `maxBlockCandidates` : int, optional
+        Blocking limits, see above.
+
+    Returns
+    ----------
+    `dfCandidates` : pandas.DataFrame
+        Columns 'veloName', 'tadsName', 'score' and 'rank' (1 = best).
+    """
+    dfVeloGrams = _explode_trigrams(veloNames, "veloId")
+    dfTadsGrams = _explode_trigrams(tadsNames, "tadsId")
+
+    veloSizes = dfVeloGrams.groupby("veloId").size()
+    tadsSizes = dfTadsGrams.groupby("tadsId").size()
+
+    # Blocking on rare trigrams
+    postings = dfTadsGrams.groupby("gram").size()
+    rareGrams = postings.index[postings <= maxGramPostings]
+    dfBlock = dfVeloGrams[dfVeloGrams["gram"].isin(rareGrams)].merge(
+        dfTadsGrams[dfTadsGrams["gram"].isin(rareGrams)], on="gram"
+    )
+    dfBlock = dfBlock.groupby(["veloId", "tadsId"]).size().rename("sharedRare").reset_index()
+    dfBlock = dfBlock.sort_values(["veloId", "sharedRare"], ascending=[True, False], kind="stable")
+    dfBlock = dfBlock.groupby("veloId").head(maxBlockCandidates)
+
+    # Exact Dice score over all trigrams of the candidate pairs
+    dfShared = dfBlock[["veloId", "tadsId"]].merge(dfVeloGrams, on="veloId").merge(dfTadsGrams, on=["tadsId", "gram"])
+    dfScores = dfShared.groupby(["veloId", "tadsId"]).size().rename("shared").reset_index()
+    dfScores["score"] = 2.0 * dfScores["shared"] / (
+        veloSizes.reindex(dfScores["veloId"]).to_numpy() + tadsSizes.reindex(dfScores["tadsId"]).to_numpy()
+    )
+
+    dfScores = dfScores[dfScores["score"] >= minScore]
+    dfScores = dfScores.sort_values(["veloId", "score"], ascending=[True, False], kind="stable")
+    dfScores["rank"] = dfScores.groupby("veloId").cumcount() + 1
+    dfScores = dfScores[dfScores["rank"] <= topK]
+
+    veloNames = np.asarray(veloNames, dtype=object)
+    tadsNames = np.asarray(tadsNames, dtype=object)
+    return pd.DataFrame(
+        {
+            "veloName": veloNames[dfScores["veloId"].to_numpy()],
+            "tadsName": tadsNames[dfScores["tadsId"].to_numpy()],
+            "score": dfScores["score"].to_numpy(),
+            "rank": dfScores["rank"].to_numpy(),
+        }
+    )
+
+
+@profile_stage
+def propose_fuzzy_matches(dfVeloUnmatched, dfTadsLatest, minScore=0.6, topK=3, **candidateKwargs):
+    """
+    Propose ranked TADS lines for Velocity Suite lines that `get_matched_entries` left unmatched.
+
+    Substation names of both sides are normalized, fuzzy candidates are generated
+    once per distinct name with `get_name_candidates`, and a TADS line becomes a
+    candidate for a Velocity Suite line when both of its buses are name candidates
+    of the line's two substations, in either direction. The line score is the
+    mean of the two name scores.
+
+    Parameters
+    ----------
+    - `dfVeloUnmatched` : pandas.DataFrame
+        Velocity Suite lines with 'From Sub', 'To Sub' and 'Rec_ID'.
+
+    - `dfTadsLatest` : pandas.DataFrame
+        TADS lines with 'FromBus' and 'ToBus'.
+
+    - `minScore` : float, optional (default=0.6)
+        Minimum name similarity of each of the two buses.
+
+    - `topK` : int, optional (default=3)
+        Number of proposals kept per Velocity Suite line.
+
+    - `**candidateKwargs` :
+        Passed to `get_name_candidates` (blocking limits).
+
+    Returns
+    ----------
+    `dfProposals` : pandas.DataFrame
+        One row per proposal with the Velocity Suite 'Rec_ID', 'From Sub' and
+        'To Sub', the TADS 'FromBus' and 'ToBus', the TADS row label 'TadsIndex',
+        'fromScore', 'toScore', the line 'score' and its 'rank' (1 = best).
+
+    Example
+    ----------
+    >>> dfVeloUnmatched = dfVeloTlinesSorted[~dfVeloTlinesSorted.index.isin(dfMatchVSTlines_with_Tads.index)]
+    >>> dfProposals = propose_fuzzy_matches(dfVeloUnmatched, dfTadsLatest)
+    """
+    veloFrom = normalize_substation_names(dfVeloUnmatched["From Sub"]).to_numpy()
+    veloTo = normalize_substation_names(dfVeloUnmatched["To Sub"]).to_numpy()
+    tadsFrom = normalize_substation_names(dfTadsLatest["FromBus"]).to_numpy()
+    tadsTo = normalize_substation_names(dfTadsLatest["ToBus"]).to_numpy()
+
+    # Lines with a missing substation name get no proposals for it
+    veloNames = pd.unique(np.concatenate([veloFrom, veloTo]))
+    veloNames = veloNames[pd.notna(veloNames)]
+    tadsNames = pd.unique(np.concatenate([tadsFrom, tadsTo]))
+    tadsNames = tadsNames[pd.notna(tadsNames)]
+    dfNameCandidates = get_name_candidates(
+        veloNames, tadsNames, minScore=minScore, topK=max(topK, 5), **candidateKwargs
+    )[["veloName", "tadsName", "score"]]
+
+    dfVeloLines = pd.DataFrame({"veloPos": np.arange(len(dfVeloUnmatched)), "veloFrom": veloFrom, "veloTo": veloTo})
+    dfTadsLines = pd.DataFrame({"tadsPos": np.arange(len(dfTadsLatest)), "tadsFrom": tadsFrom, "tadsTo": tadsTo})
+
+    dfLines = []
+    # Same direction (From Sub ~ FromBus, To Sub ~ ToBus) and reversed direction
+    for tadsCol1, tadsCol2 in [("tadsFrom", "tadsTo"), ("tadsTo", "tadsFrom")]:
+        dfCand = dfVeloLines.merge(
+            dfNameCandidates.rename(columns={"veloName": "veloFrom", "tadsName": tadsCol1, "score": "fromScore"}),
+            on="veloFrom",
+        )
+        dfCand = dfCand.merge(dfTadsLines, on=tadsCol1)
+        dfCand = dfCand.merge(
+            dfNameCandidates.rename(columns={"veloName": "veloTo", "tadsName": tadsCol2, "score": "toScore"}),
+            on=["veloTo", tadsCol2],
+        )
+        dfLines.append(dfCand[["veloPos", "tadsPos", "fromScore", "toScore"]])
+
+    dfLines = pd.concat(dfLines, ignore_index=True)
+    dfLines["score"] = (dfLines["fromScore"] + dfLines["toScore"]) / 2
+    dfLines = dfLines.sort_values(["veloPos", "score"], ascending=[True, False], kind="stable")
+    dfLines = dfLines.drop_duplicates(subset=["veloPos", "tadsPos"])
+    dfLines["rank"] = dfLines.groupby("veloPos").cumcount() + 1
+    dfLines = dfLines[dfLines["rank"] <= topK]
+
+    veloPos = dfLines["veloPos"].to_numpy()
+    tadsPos = dfLines["tadsPos"].to_numpy()
+    return pd.DataFrame(
+        {
+            "Rec_ID": dfVeloUnmatched["Rec_ID"].to_numpy()[veloPos],
+            "From Sub": dfVeloUnmatched["From Sub"].to_numpy()[veloPos],
+            "To Sub": dfVeloUnmatched["To Sub"].to_numpy()[veloPos],
+            "FromBus": dfTadsLatest["FromBus"].to_numpy()[tadsPos],
+            "ToBus": dfTadsLatest["ToBus"].to_numpy()[tadsPos],
+            "TadsIndex": dfTadsLatest.index.to_numpy()[tadsPos],
+            "fromScore": dfLines["fromScore"].to_numpy(),
+            "toScore": dfLines["toScore"].to_numpy(),
+            "score": dfLines["score"].to_numpy(),
+            "rank": dfLines["rank"].to_numpy(),
+        }
+    )
+
+
+def _explode_trigrams(names, idCol):
+    # One row per distinct (name id, trigram) of the space-padded names
+    ids = []
+    grams = []
+    for nameId, name in enumerate(names):
+        padded = f" {name} "
+        nameGrams = {padded[i:i + 3] for i in range(len(padded) - 2)}
+        ids.extend([nameId] * len(nameGrams))
+        grams.extend(nameGrams)
+    return pd.DataFrame({idCol: np.asarray(ids, dtype=np.int64), "gram": pd.Series(grams, dtype=object)})
+
+
+# %%
@@ -9,6 +9,9 @@ def find_tline_by_buses(
     """
     Finds rows in a DataFrame where a tuple of values matches two columns.
 
+    Every call scans the whole DataFrame. For many interactive lookups on the
+    national TADS inventory, use `src.bus_index.BusPairIndex` instead.
+
     Args:
         df (pandas.DataFrame): The DataFrame to search.
         col1_name (str): The name of the first column.
@@ -1,8 +1,12 @@
 # %%
 # pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import numpy as np
 import pandas as pd
-import us
 
+from src.profiling import profile_stage
+from src.us_states import state_mask
+
+@profile_stage
 def match_by_eia_code(dfVeloP, dfGads):
     """
     Filters `dfGads` at places with matching `EIACode` in `dfVeloP`
@@ -46,6 +50,7 @@ def match_by_eia_code(dfVeloP, dfGads):
     return dfGadsFiltered
 
 
+@profile_stage
 def match_by_eia_code_and_add_recid(dfVeloP, dfGads, getMatchVeloP=False):
     """
     Filters dfGads at places where it has a matching EIA Code with `dfVeloP`
@@ -106,14 +111,21 @@ def match_by_eia_code_and_add_recid(dfVeloP, dfGads, getMatchVeloP=False):
     0   10474     R1
     2   10552     R3
     """
+    # Compare EIA codes as integers on both sides (see normalize_eia_ids)
+    veloEiaIds, _ = normalize_eia_ids(dfVeloP["EIA ID"])
+    gadsEiaIds, _ = normalize_eia_ids(dfGads["EIACode"])
+
     # Drop duplicates in dfVeloP to avoid creating extra rows in the merge
-    dfVeloP_unique = dfVeloP[["EIA ID", "Rec_ID"]].drop_duplicates(subset=["EIA ID"])
+    dfVeloP_unique = pd.DataFrame(
+        {"EIA ID": veloEiaIds.to_numpy(), "Rec_ID": dfVeloP["Rec_ID"].to_numpy()}
+    )
+    dfVeloP_unique = dfVeloP_unique.dropna(subset=["EIA ID"]).drop_duplicates(subset=["EIA ID"])
 
-    # Merge dfVeloP and dfGads on 'EIA ID' and 'EIACode' columns to add 'Rec_ID' from dfVeloP to dfGads
+    # Merge dfVeloP and dfGads on the integer 'EIA ID' and 'EIACode' keys to add 'Rec_ID' from dfVeloP to dfGads
     dfMerged = pd.merge(
-        dfGads,
+        dfGads.assign(EIACodeKey=gadsEiaIds.to_numpy()),
         dfVeloP_unique,
-        left_on="EIACode",
+        left_on="EIACodeKey",
         right_on="EIA ID",
         how="left",
     )
@@ -121,16 +133,18 @@ def match_by_eia_code_and_add_recid(dfVeloP, dfGads, getMatchVeloP=False):
     # Drop rows where 'Rec_ID' is NaN (implying no matching EIA ID)
     dfGadsFiltered = dfMerged.dropna(subset=["Rec_ID"])
 
-    # Drop the duplicate 'EIA ID' column from the merge
-    dfGadsFiltered = dfGadsFiltered.drop(columns=["EIA ID"])
+    # Drop the key columns used for the merge
+    dfGadsFiltered = dfGadsFiltered.drop(columns=["EIACodeKey", "EIA ID"])
 
     if getMatchVeloP:
         # Filter dfVeloP to include only the rows that were matched with dfGads
-        dfVeloPFiltered = dfVeloP[dfVeloP["EIA ID"].isin(dfGadsFiltered["EIACode"])]
+        matchedEiaIds = dfMerged.loc[dfMerged["Rec_ID"].notna(), "EIACodeKey"].unique()
+        dfVeloPFiltered = dfVeloP[veloEiaIds.isin(matchedEiaIds).fillna(False).astype(bool).to_numpy()]
         return dfGadsFiltered, dfVeloPFiltered
 
     return dfGadsFiltered
 
+@profile_stage
 def match_by_plant_name_and_add_eia_recid(dfVeloP, dfVeloU):
     """
     Merge dfVeloP and dfVeloU on 'Plant Name' to add 'EIA ID' and 'Rec_ID'.
@@ -175,23 +189,288 @@ def match_by_plant_name_and_add_eia_recid(dfVeloP, dfVeloU):
     1    Plant D     NaN    NaN
     2    Plant C     103     R3
     """
-    # Merge dfVeloP and dfVeloU on 'Plant Name' to add 'EIA ID' from dfVeloP to dfVeloU
-    dfMerged = pd.merge(
-        dfVeloU, dfVeloP[["Plant Name", "EIA ID", "Rec_ID"]], on="Plant Name", how="left"
-    )
+    # Merge dfVeloP and dfVeloU on 'Plant Name' to add 'EIA ID' from dfVeloP to dfVeloU.
+    # Plant names repeated in dfVeloP multiply unit rows, which join_on_keys reports.
+    dfMerged = join_on_keys(dfVeloU, dfVeloP[["Plant Name", "EIA ID", "Rec_ID"]], ["Plant Name"], how="left")
 
     return dfMerged
 
 
-def eia_filtering(df, column_name="EIA ID"):
+def normalize_unit_ids(series):
+    """
+    Normalize generating-unit identifiers so that GADS unit names and Velocity Suite unit numbers compare equal.
+
+    Upper-cases, replaces punctuation by spaces, drops the words "UNIT", "GEN",
+    "GENERATOR" and "NO", joins a letter prefix to the number that follows it
+    ("CT 1" -> "CT1"), keeps the last token and strips its leading zeros. The
+    distinct values are normalized once and broadcast back.
+
+    Parameters
+    ----------
+    - `series` : pandas.Series
+        Unit names or numbers, e.g. `dfGads["UnitName"]` or `dfVeloU["Unit"]`, of any dtype.
+
+    Returns
+    ----------
+    `unitIds` : pandas.Series
+        The normalized identifiers as strings (missing where there is none), with the index of `series`.
+
+    Example
+    ----------
+    >>> normalize_unit_ids(pd.Series(["Joliet 29 Unit 07", "Elgin Energy Center CT 1", 3])).tolist()
+    ['7', 'CT1', '3']
+    """
+    codes, uniqueValues = pd.factorize(series.to_numpy(dtype=object))
+    uniqueIds = (
+        pd.Series(uniqueValues, dtype="string")
+        .str.upper()
+        .str.replace(r"[^A-Z0-9 ]", " ", regex=True)
+        .str.replace(r"\b(?:UNIT|GEN|GENERATOR|NO)\b", " ", regex=True)
+        .str.replace(r"\b([A-Z]+)\s+(?=\d)", r"\1", regex=True)
+        .str.split()
+        .str[-1]
+        .str.replace(r"^0+(?=\w)", "", regex=True)
+    )
+    uniqueIds = uniqueIds.to_numpy(dtype=object, na_value=None)
+
+    unitIds = np.full(len(series), None, dtype=object)
+    valid = codes >= 0
+    unitIds[valid] = uniqueIds[codes[valid]]
+    return pd.Series(unitIds, index=series.index)
+
+
+def join_on_keys(dfLeft, dfRight, leftOn, rightOn=None, how="inner", maxFanOut=None, getStats=False):
+    """
+    Hash join of two DataFrames on one or more key columns, with duplicate-key detection and fan-out statistics.
+
+    Before joining, both sides' keys are coded together and counted, so the
+    output size is known up front: a key duplicated on both sides multiplies
+    rows, and `maxFanOut` stops such a join before it is materialized. Rows with
+    a missing value in any key column never match (pandas would match them with
+    each other). A line is printed when rows of `dfLeft` match several rows of `dfRight`.
+
+    Parameters
+    ----------
+    - `dfLeft`, `dfRight` : pandas.DataFrame
+
+    - `leftOn` : list of str
+        Key columns of `dfLeft`.
+
+    - `rightOn` : list of str, optional (default=`leftOn`)
+        Key columns of `dfRight`, in the order of `leftOn`.
+
+    - `how` : {"inner", "left"}, optional (default="inner")
+
+    - `maxFanOut` : int, optional (default=None)
+        Largest number of `dfRight` rows a `dfLeft` row may match. If exceeded,
+        a ValueError naming the worst keys is raised. None does not limit it.
+
+    - `getStats` : bool, optional (default=False)
+        If set to True, the function also returns the join statistics.
+
+    Returns
+    ----------
+    If `getStats` is False:
+        `dfJoined` : pandas.DataFrame
+            As `pandas.merge(dfLeft, dfRight, left_on=leftOn, right_on=rightOn, how=how)`.
+
+    If `getStats` is True:
+        `dfJoined`, `stats` : pandas.DataFrame, dict
+            `stats` holds 'leftRows', 'rightRows', 'leftDuplicateKeys' and
+            'rightDuplicateKeys' (keys occurring more than once), 'matchedLeftRows',
+            'outputRows', 'maxFanOut' (most right rows matched by one left row) and
+            'fanOut' (output rows per matched left row).
+
+    Example
+    ----------
+    >>> dfUnits = pd.DataFrame({'EIA ID': [1, 1, 2], 'Unit': ['1', '2', '1']})
+    >>> dfGads = pd.DataFrame({'EIACode': [1, 1, 2], 'UnitId': ['1', '1', '1']})
+    >>> dfJoined, stats = join_on_keys(dfUnits, dfGads, ["EIA ID", "Unit"], ["EIACode", "UnitId"], getStats=True)
+    1 keys repeat in the right table of the join on ['EIA ID', 'Unit']: 2 matched rows give 3 rows (max fan-out 2).
+    >>> stats["outputRows"], stats["maxFanOut"]
+    (3, 2)
+    """
+    if how not in ("inner", "left"):
+        raise ValueError(f"Unsupported join '{how}', expected 'inner' or 'left'")
+    rightOn = list(rightOn or leftOn)
+    leftOn = list(leftOn)
+
+    # Code the keys of both sides together: equal keys get equal codes, keys with a missing value get -1
+    keyNames = [f"key{i}" for i in range(len(leftOn))]
+    keys = pd.concat(
+        [
+            dfLeft[leftOn].set_axis(keyNames, axis=1).astype(object),
+            dfRight[rightOn].set_axis(keyNames, axis=1).astype(object),
+        ],
+        ignore_index=True,
+    )
+    codes = keys.groupby(keyNames, sort=False, dropna=True).ngroup().fillna(-1).astype("int64").to_numpy()
+    leftCodes, rightCodes = codes[: len(dfLeft)], codes[len(dfLeft):]
+
+    numKeys = int(codes.max()) + 1 if len(codes) else 0
+    leftCounts = np.bincount(leftCodes[leftCodes >= 0], minlength=numKeys)
+    rightCounts = np.bincount(rightCodes[rightCodes >= 0], minlength=numKeys)
+    fanOutPerLeftRow = np.where(leftCodes >= 0, rightCounts[np.maximum(leftCodes, 0)], 0)
+
+    matchedLeftRows = int((fanOutPerLeftRow > 0).sum())
+    matchedOutputRows = int(fanOutPerLeftRow.sum())
+    outputRows = matchedOutputRows + (len(dfLeft) - matchedLeftRows if how == "left" else 0)
+    stats = {
+        "leftRows": len(dfLeft),
+        "rightRows": len(dfRight),
+        "leftDuplicateKeys": int((leftCounts > 1).sum()),
+        "rightDuplicateKeys": int((rightCounts > 1).sum()),
+        "matchedLeftRows": matchedLeftRows,
+        "outputRows": outputRows,
+        "maxFanOut": int(fanOutPerLeftRow.max()) if len(fanOutPerLeftRow) else 0,
+        "fanOut": outputRows / matchedLeftRows if matchedLeftRows else 0.0,
+    }
+
+    if maxFanOut is not None and stats["maxFanOut"] > maxFanOut:
+        worstRows = np.flatnonzero(fanOutPerLeftRow > maxFanOut)
+        worstRows = worstRows[np.argsort(-fanOutPerLeftRow[worstRows], kind="stable")]
+        worstKeys = dfLeft[leftOn].iloc[worstRows].drop_duplicates().head(5).to_dict("records")
+        raise ValueError(f"Join on {leftOn} would give up to {stats['maxFanOut']} rows per left row (limit {maxFanOut}, {outputRows} rows in total), e.g. for {worstKeys}")
+
+    if stats["maxFanOut"] > 1:
+        print(f"{stats['rightDuplicateKeys']} keys repeat in the right table of the join on {leftOn}: {stats['matchedLeftRows']} matched rows give {matchedOutputRows} rows (max fan-out {stats['maxFanOut']}).")
+
+    dfJoined = pd.merge(dfLeft, dfRight[rightCodes >= 0], left_on=leftOn, right_on=rightOn, how=how)
+
+    if getStats:
+        return dfJoined, stats
+
+    return dfJoined
+
+
+@profile_stage
+def match_units_by_eia_and_unit_id(dfVeloU, dfGads, maxFanOut=None, getStats=False):
+    """
+    Match GADS units with Velocity Suite units on (EIA code, unit identifier).
+
+    Unlike `match_by_eia_code_and_add_recid`, which matches on the EIA code of
+    the plant and so pairs every GADS unit of a plant with the plant's Rec_ID,
+    this matches unit to unit: the EIA codes are compared as integers (see
+    `normalize_eia_ids`) and the GADS 'UnitName' and Velocity Suite 'Unit' as
+    normalized unit identifiers (see `normalize_unit_ids`), in one hash join
+    (see `join_on_keys`).
+
+    Parameters
+    ----------
+    - `dfVeloU` : pandas.DataFrame
+        Velocity Suite units with EIA IDs and Rec IDs of their plants, e.g. the
+        output of `match_by_plant_name_and_add_eia_recid` after `eia_filtering`.
+        Needs the columns 'EIA ID', 'Unit', 'Plant Name' and 'Rec_ID'.
+
+    - `dfGads` : pandas.DataFrame
+        GADS units with at least the columns 'EIACode' and 'UnitName'.
+
+    - `maxFanOut` : int, optional (default=None)
+        Largest number of Velocity Suite units one GADS unit may match, see `join_on_keys`.
+
+    - `getStats` : bool, optional (default=False)
+        If set to True, the function also returns the join statistics of `join_on_keys`.
+
+    Returns
+    ----------
+    If `getStats` is False:
+        `dfGadsMatched` : pandas.DataFrame
+            The matched GADS units with the 'Plant Name', 'Unit' and 'Rec_ID' of their Velocity Suite unit.
+
+    If `getStats` is True:
+        `dfGadsMatched`, `stats` : pandas.DataFrame, dict
+
+    Example
+    ----------
+    >>> dfVeloU = pd.DataFrame({
+    ...     'Plant Name': ['Joliet 29', 'Joliet 29'], 'Unit': [7, 8],
+    ...     'EIA ID': [384, 384], 'Rec_ID': ['R1', 'R1']
+    ... })
+    >>> dfGads = pd.DataFrame({'UnitName': ['Joliet 29 Unit 07', 'Joliet 29 Unit 9'], 'EIACode': [384, 384]})
+    >>> match_units_by_eia_and_unit_id(dfVeloU, dfGads)
+                UnitName  EIACode Plant Name  Unit Rec_ID
+    0  Joliet 29 Unit 07      384  Joliet 29     7     R1
+    """
+    dfVeloKeys = pd.DataFrame(
+        {
+            "EIACodeKey": normalize_eia_ids(dfVeloU["EIA ID"])[0].to_numpy(),
+            "UnitIdKey": normalize_unit_ids(dfVeloU["Unit"]).to_numpy(),
+            "Plant Name": dfVeloU["Plant Name"].to_numpy(),
+            "Unit": dfVeloU["Unit"].to_numpy(),
+            "Rec_ID": dfVeloU["Rec_ID"].to_numpy(),
+        }
+    )
+    dfGadsKeys = dfGads.assign(
+        EIACodeKey=normalize_eia_ids(dfGads["EIACode"])[0].to_numpy(),
+        UnitIdKey=normalize_unit_ids(dfGads["UnitName"]).to_numpy(),
+    )
+
+    dfGadsMatched, stats = join_on_keys(
+        dfGadsKeys, dfVeloKeys, ["EIACodeKey", "UnitIdKey"], maxFanOut=maxFanOut, getStats=True
+    )
+    dfGadsMatched = dfGadsMatched.drop(columns=["EIACodeKey", "UnitIdKey"])
+
+    if getStats:
+        return dfGadsMatched, stats
+
+    return dfGadsMatched
+
+
+@profile_stage
+def normalize_eia_ids(series):
+    """
+    Parse a column of raw EIA IDs into a nullable integer array in one batched pass.
+
+    Integers and integral floats are taken as they are. Strings are stripped, cut
+    at the first ':' or ',' (e.g. "12345:67890" or "12345,67890" keep only the
+    first number) and parsed as numbers, which also removes leading zeros.
+    Anything else, e.g. free text or non-integral numbers, is unparseable.
+
+    Parameters
+    ----------
+    - `series` : pandas.Series
+        The raw EIA IDs, e.g. `dfVeloP["EIA ID"]` or `dfGads["EIACode"]`, of any dtype.
+
+    Returns
+    ----------
+    `eiaIds`, `unparseable` : pandas.Series, pandas.Series
+        `eiaIds` holds the parsed IDs with dtype "Int64" (missing or unparseable
+        values are <NA>). `unparseable` is a boolean mask of the values that were
+        present but could not be parsed. Both share the index of `series`.
+
+    Example
+    ----------
+    >>> eiaIds, unparseable = normalize_eia_ids(pd.Series(['00235', 2341, None, '12345:67890', 'n/a']))
+    >>> print(eiaIds.tolist(), unparseable.tolist())
+    [235, 2341, <NA>, 12345, <NA>] [False, False, False, False, True]
+    """
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return series.astype("Int64"), pd.Series(False, index=series.index)
+
+    if pd.api.types.is_float_dtype(series.dtype):
+        numbers = series
+    else:
+        text = series.astype("string").str.strip()
+        firstNumber = text.str.split(r"[:,]", n=1, regex=True).str[0]
+        numbers = pd.to_numeric(firstNumber, errors="coerce").astype("Float64")
+
+    isIntegral = numbers.notna() & (numbers == numbers.round())
+    eiaIds = numbers.where(isIntegral).astype("Int64")
+    unparseable = series.notna() & ~isIntegral.fillna(False).astype(bool)
+
+    return eiaIds, unparseable
+
+
+@profile_stage
+def eia_filtering(df, column_name="EIA ID", getUnparseable=False):
     """
     Filter and clean EIA ID values in the specified column of a DataFrame.
 
-    This function filters out rows where the specified column (`column_name`)
-    contains NaN or 0 values. It also cleans up the values in the column by
-    removing leading zeros and handling cases where the values are formatted
-    as lists or ranges (e.g., "12345:67890" or "12345,67890") by keeping only
-    the first number.
+    This function parses the specified column (`column_name`) into nullable
+    integers with `normalize_eia_ids` (removing leading zeros and keeping only
+    the first number of values formatted as lists or ranges, e.g. "12345:67890"
+    or "12345,67890") and filters out rows where the ID is NaN or 0. Rows whose
+    value could not be parsed are dropped too and reported separately.
 
     Parameters
     ----------
@@ -202,11 +481,21 @@ def eia_filtering(df, column_name="EIA ID"):
         The name of the column in `df` that contains the EIA IDs to be filtered
         and cleaned.
 
+    - `getUnparseable` : bool, optional (default=False)
+        If set to True, the function also returns the rows of `df` whose value
+        in `column_name` could not be parsed.
+
     Returns
     ----------
-    `df_filtered` : pandas.DataFrame
-        A DataFrame where the specified column has been filtered for NaN or 0
-        values and cleaned of leading zeros and unwanted characters.
+    If `getUnparseable` is False:
+        `df_filtered` : pandas.DataFrame
+            A DataFrame where the specified column has been filtered for NaN or 0
+            values and parsed to integer IDs (dtype "Int64").
+
+    If `getUnparseable` is True:
+        `df_filtered`, `df_unparseable` : pandas.DataFrame, pandas.DataFrame
+            `df_filtered` is as described above.
+            `df_unparseable` contains the rows of `df` with unparseable IDs, unchanged.
 
     Example
     ----------
@@ -215,32 +504,28 @@ def eia_filtering(df, column_name="EIA ID"):
     ... })
     >>> df_filtered = eia_filtering(df, column_name="EIA ID")
     >>> print(df_filtered)
-        EIA ID
-    0    235
-    1   2341
-    4  12345
-    5  12345
+       EIA ID
+    0     235
+    1    2341
+    4   12345
+    5   12345
     """
-    # Drop rows where the specified column is NaN or 0
-    df_filtered = df.dropna(subset=[column_name]).copy()
-    df_filtered = df_filtered[df_filtered[column_name] != 0]
-
-    # Function to clean up the EIA ID
-    def clean_eia_id(value):
-        if isinstance(value, str):
-            # Handle weird numbers separated by ':' or ','
-            if ":" in value or "," in value:
-                value = value.split(":")[0].split(",")[0]
-            # Remove leading zeros
-            value = value.lstrip("0")
-        return value
-
-    # Apply the cleaning function to the specified column
-    df_filtered[column_name] = df_filtered[column_name].apply(clean_eia_id)
+    eiaIds, unparseable = normalize_eia_ids(df[column_name])
+
+    if unparseable.any():
+        print(f"{int(unparseable.sum())} rows have an unparseable '{column_name}' and were dropped.")
+
+    # Keep rows with a valid, non-zero EIA ID
+    keep = (eiaIds.notna() & (eiaIds != 0)).fillna(False).astype(bool)
+    df_filtered = df[keep].assign(**{column_name: eiaIds[keep]})
+
+    if getUnparseable:
+        return df_filtered, df[unparseable]
 
     return df_filtered
 
 
+@profile_stage
 def filter_non_empty_column(df, column_name="EIA ID"):
     """
     Filter out rows with NaN values in the specified column.
@@ -275,11 +560,12 @@ def filter_non_empty_column(df, column_name="EIA ID"):
     2  67890    Plant C
     """
     # Drop rows where the specified column is NaN
-    df_filtered = df.dropna(subset=[column_name]).copy()
+    df_filtered = df.dropna(subset=[column_name])
 
     return df_filtered
 
 
+@profile_stage
 def filterRetiredPlants(dfVeloP):
     """
     Filter out plants that have no non-zero values in specified capacity columns.
@@ -330,6 +616,7 @@ def filterRetiredPlants(dfVeloP):
     return dfVeloP_filtered
 
 
+@profile_stage
 def computeCombinedMWRating(dfVeloP):   
     """
     Compute and add a 'Combined Cap MW' column by summing capacity columns.
@@ -375,21 +662,21 @@ def computeCombinedMWRating(dfVeloP):
         "Retired Cap MW",
     ]
 
-    # Compute the sum of the specified columns
-    dfVeloP["Combined Cap MW"] = dfVeloP[capacity_columns].sum(axis=1)
-
-    return dfVeloP
+    # Compute the sum of the specified columns, as a new frame sharing the other columns with dfVeloP
+    return dfVeloP.assign(**{"Combined Cap MW": dfVeloP[capacity_columns].sum(axis=1)})
 
 
+@profile_stage
 def filter_states(dfGads, veloStates):
     """
     Filter rows in dfGads based on state abbreviations in veloStates.
 
     This function filters the `dfGads` DataFrame to include only rows where
     the state name in `StateName` matches any state abbreviation in the
-    `veloStates` set. The function temporarily maps full state names to their
-    abbreviations using the `us` package and then filters based on those
-    abbreviations.
+    `veloStates` set. State names are looked up in the static table of
+    `src/us_states.py` through their categorical codes (see `state_mask`);
+    `dfGads` is not modified, so one loaded GADS frame can be filtered for
+    any number of locations.
 
     Parameters
     ----------
@@ -409,7 +696,6 @@ def filter_states(dfGads, veloStates):
 
     Example
     ----------
-    >>> import us
     >>> dfGads = pd.DataFrame({
     ...     'StateName': ['Illinois', 'Indiana', 'Wisconsin', 'Ohio', 'Michigan']
     ... })
@@ -421,20 +707,9 @@ def filter_states(dfGads, veloStates):
     1   Indiana
     2 Wisconsin
     """
-    # Create a mapping of full state names to their abbreviations using the us package
-    state_abbreviations = {state.name: state.abbr for state in us.states.STATES}
-
-    # Map StateName to state abbreviations
-    dfGads["StateAbbreviation"] = dfGads["StateName"].map(state_abbreviations)
-
-    # Filter dfGads based on the StateAbbreviation being in veloStates
-    dfGadsFilt = dfGads[dfGads["StateAbbreviation"].isin(veloStates)]
-
-    # Drop the temporary 'StateAbbreviation' column
-    dfGadsFilt = dfGadsFilt.drop(columns=["StateAbbreviation"])
-
-    return dfGadsFilt
+    return dfGads[state_mask(dfGads["StateName"], veloStates)]
 
+@profile_stage
 def sort_and_reorder_columns(df, sort_columns=None):
     """
     Sort and reorder columns in a DataFrame.
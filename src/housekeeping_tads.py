@@ -1,9 +1,14 @@
 # %%
+import numpy as np
 import pandas as pd
 import os
 
+from src.profiling import profile_stage
+from src.schema import reducedTadsColumns, share_categories
+
 # pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
 
+@profile_stage
 def get_reduced_df(dfMatch):
     """
     This function takes a pandas DataFrame (dfMatch) and returns a new DataFrame containing specific columns
@@ -22,58 +27,32 @@ def get_reduced_df(dfMatch):
             - 'Rec_ID' (added)
     """
 
-    # Select desired columns from the input DataFrame
-    desired_cols = [
-        "ElementIdentifierName",
-        "CompanyName",
-        "RegionCode",
-        "FromBus",
-        "ToBus",
-        "TertiaryBus",
-        "Miles",
-        "BESExemptedFlag",
-        "NumberOfTerminals",
-        "CircuitTypeCode",
-        "VoltageClassCodeName",
-        "ParentCode",
-        "ConductorsPerPhaseCode",
-        "OverheadGroundWireCode",
-        "InsulatorTypeCode",
-        "CableTypeCode",
-        "StructureMaterialCode",
-        "StructureTypeCode",
-        "CircuitsPerStructureCode",
-        "TerrainCode",
-        "ElevationCode",
-        "InServiceDate",
-        "RetirementDate",
-        "Rec_ID",
-    ]
+    # Select desired columns from the input DataFrame (also what the TADS loader reads, see src/schema.py)
+    desired_cols = reducedTadsColumns
 
     df_reduced = dfMatch[desired_cols]
 
-    df_reduced = rearrangeColumns(df_reduced)
-    # Create a copy of the DataFrame to avoid modifying the original
-    df_reduced_copy = df_reduced.copy()
+    df_reduced_copy = rearrangeColumns(df_reduced)
 
     # Extract the first word from CircuitTypeCode
-    df_reduced_copy["CircuitTypeCode_FirstWord"] = (
-        df_reduced_copy["CircuitTypeCode"].str.split().str[0]
-    )
+    circuitTypeFirstWord = df_reduced_copy["CircuitTypeCode"].str.split().str[0]
 
-    # Temporary column to store the sorted Bus combination
-    df_reduced_copy["SortedBus"] = df_reduced_copy[["FromBus", "ToBus"]].apply(
-        lambda x: "-".join(sorted(x)), axis=1
-    )
+    # FromBus <= ToBus already holds after rearrangeColumns, so the sorted Bus
+    # combination is just the two columns joined, built over whole arrays
+    def as_str(values):
+        return pd.Series(_to_str_array(values), index=df_reduced_copy.index, dtype=object)
+
+    sortedBus = as_str(df_reduced_copy["FromBus"]) + "-" + as_str(df_reduced_copy["ToBus"])
 
     # Create a dynamic combo option string using the first word and sorted FromBus-ToBus
-    df_reduced_copy["combo"] = df_reduced_copy.apply(
-        lambda row: f"{row['CircuitTypeCode_FirstWord']} {row['SortedBus']} {row['ElementIdentifierName']}",
-        axis=1,
+    combo = (
+        as_str(circuitTypeFirstWord)
+        + " "
+        + sortedBus
+        + " "
+        + as_str(df_reduced_copy["ElementIdentifierName"])
     )
-
-    df_reduced_copy.pop("CircuitTypeCode_FirstWord")  # No longer needed
-    df_reduced_copy.pop("SortedBus")  # No longer needed
+    df_reduced_copy = df_reduced_copy.assign(combo=combo)
 
     # Sort the DataFrame by FromBus and ToBus
     df_reduced_copy = df_reduced_copy.sort_values(by=["FromBus", "ToBus"])
@@ -85,6 +64,21 @@ def get_reduced_df(dfMatch):
     return df_reduced_copy
 
 
+def _group_key(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy()
+    return series.to_numpy()
+
+
+def _to_str_array(series):
+    """
+    Convert a Series to a numpy array of Python-style strings (NaN becomes 'nan'),
+    matching what calling `str()` on each element would give.
+    """
+    return series.to_numpy(dtype=object).astype(str)
+
+
+@profile_stage
 def filter_tlines_by_latest_reported_year(df):
     """
     Filters a DataFrame to include only the first row for each unique combination of 'FromBus' and 'ToBus' columns,
@@ -134,14 +128,75 @@ def filter_tlines_by_latest_reported_year(df):
 
     return filtered_df
 
-def get_latest_entries(dfTadsSorted):
-    # Drop duplicates, keeping the first occurrence
-    dfTadsLatest = dfTadsSorted.drop_duplicates(
-        subset=["FromBus", "ToBus"], keep="first"
-    )
+@profile_stage
+def get_latest_entries(dfTads, directionAgnostic=False, sortOutput=False):
+    """
+    Keep only the row with the latest 'ReportingYearNbr' for every 'FromBus'/'ToBus' pair.
+
+    The maximum reporting year of each bus pair is found with a single grouped
+    reduction over the unsorted rows, so no global sort is needed beforehand. If a
+    bus pair has several rows with its latest year, the first of them is kept. The
+    kept rows stay in their input order, so for a `dfTads` already sorted by
+    `sort_and_shift_columns` the result is the same as dropping duplicate bus pairs
+    from it and keeping the first occurrence.
+
+    Parameters
+    ----------
+    - `dfTads` : pandas.DataFrame
+        A DataFrame containing columns 'FromBus', 'ToBus' and 'ReportingYearNbr', in any order.
+
+    - `directionAgnostic` : bool, optional (default=False)
+        If True, A-B and B-A are treated as the same element and only the latest
+        row of either direction is kept.
+
+    - `sortOutput` : bool, optional (default=False)
+        If True, the result is sorted by 'FromBus' and 'ToBus' (output only, the
+        selection itself never sorts).
+
+    Returns
+    ----------
+    `dfTadsLatest` : pandas.DataFrame
+        The latest row of every bus pair.
+
+    Example
+    ----------
+    >>> dfTads = pd.DataFrame({
+    ...     'FromBus': ['BusA', 'BusB', 'BusA'],
+    ...     'ToBus': ['BusB', 'BusA', 'BusB'],
+    ...     'ReportingYearNbr': [2021, 2023, 2022]
+    ... })
+    >>> print(get_latest_entries(dfTads))
+      FromBus ToBus  ReportingYearNbr
+    1    BusB  BusA              2023
+    2    BusA  BusB              2022
+    >>> print(get_latest_entries(dfTads, directionAgnostic=True))
+      FromBus ToBus  ReportingYearNbr
+    1    BusB  BusA              2023
+    """
+    # Categorical bus columns are grouped on their integer codes
+    useCodes = share_categories(dfTads, ["FromBus"], dfTads, ["ToBus"])
+    if directionAgnostic:
+        lo, hi = get_canonical_bus_pairs(dfTads, col1="FromBus", col2="ToBus", useCodes=useCodes)
+        keys = [lo, hi]
+    else:
+        keys = [_group_key(dfTads["FromBus"]), _group_key(dfTads["ToBus"])]
+
+    # Missing years lose against any reported year but still keep their bus pair
+    years = pd.Series(
+        dfTads["ReportingYearNbr"].to_numpy(dtype="float64", na_value=np.nan)
+    ).fillna(-np.inf)
+
+    # Position of the first row holding the maximum year, per bus pair
+    latestPos = years.groupby(keys, sort=False, dropna=False).idxmax().to_numpy()
+
+    dfTadsLatest = dfTads.iloc[np.sort(latestPos)]
+
+    if sortOutput:
+        dfTadsLatest = dfTadsLatest.sort_values(by=["FromBus", "ToBus"], kind="stable")
 
     return dfTadsLatest
 
+@profile_stage
 def sort_and_shift_columns(df):
     """
     Sorts a DataFrame by 'FromBus', 'ToBus', 'ReportingYearNbr' and rearranges those columns to be first.
@@ -172,6 +227,7 @@ def sort_and_shift_columns(df):
 
     return shifted_df
 
+@profile_stage
 def sort_and_shift_columns_dfVelo(df):
     """
     Sorts a DataFrame by 'From Sub', 'To Sub' and rearranges those columns to be first.
@@ -200,11 +256,12 @@ def sort_and_shift_columns_dfVelo(df):
     return shifted_df
 
 
+@profile_stage
 def get_matched_entries(dfVeloSorted, dfTadsLatest, getMatchVeloTlines=True):
     """
     Match entries between dfVeloSorted and dfTadsLatest based on 'From Sub'/'To Sub' and 'FromBus'/'ToBus' pairs.
 
-    This function iterates through `dfVeloSorted` and `dfTadsLatest`, matching rows where the
+    This function joins `dfVeloSorted` and `dfTadsLatest` on a direction-agnostic bus-pair key, matching rows where the
     'From Sub'/'To Sub' pair from `dfVeloSorted` matches the 'FromBus'/'ToBus' pair from `dfTadsLatest`,
     either in the same order or reversed. The matching rows from `dfTadsLatest` are returned in
     `dfTadsMatched`, with the corresponding 'Rec_ID' from `dfVeloSorted` appended. Optionally,
@@ -260,47 +317,115 @@ def get_matched_entries(dfVeloSorted, dfTadsLatest, getMatchVeloTlines=True):
     1     SubB    SubE     R2
     2     SubC    SubF     R3
     """
-    matched_rows = []
-    matched_velo_rows = []
-
-    # Iterate through both DataFrames
-    for i in range(len(dfVeloSorted)):
-        from_sub, to_sub = str(dfVeloSorted.iloc[i]["From Sub"]), str(
-            dfVeloSorted.iloc[i]["To Sub"]
-        )
-        rec_id = dfVeloSorted.iloc[i]["Rec_ID"]
-        matched = False
-
-        for j in range(len(dfTadsLatest)):
-            from_bus, to_bus = str(dfTadsLatest.iloc[j]["FromBus"]), str(
-                dfTadsLatest.iloc[j]["ToBus"]
-            )
-
-            if (from_sub == from_bus and to_sub == to_bus) or (
-                from_sub == to_bus and to_sub == from_bus
-            ):
-                matched_row = dfTadsLatest.iloc[j].copy()
-                matched_row["Rec_ID"] = rec_id
-                matched_rows.append(matched_row)
-                matched = True
-
-        if matched:
-            matched_velo_rows.append(dfVeloSorted.iloc[i])
-
-    dfTadsMatched = pd.DataFrame(matched_rows)
+    veloPos, tadsPos = get_matched_positions(dfVeloSorted, dfTadsLatest)
+
+    return assemble_matched_entries(dfVeloSorted, dfTadsLatest, veloPos, tadsPos, getMatchVeloTlines)
+
+@profile_stage
+def get_matched_positions(dfVeloSorted, dfTadsLatest):
+    """
+    Hash join of Velocity Suite and TADS lines on their direction-agnostic bus-pair key.
+
+    Returns
+    ----------
+    `veloPos`, `tadsPos` : numpy.ndarray, numpy.ndarray
+        Positional row indices of every matched (Velocity Suite row, TADS row) pair,
+        ordered by `veloPos` and then `tadsPos`, i.e. the order in which the old
+        nested loop over both DataFrames found them.
+    """
+    # Direction-agnostic bus-pair keys for both sides, built once. If both sides use
+    # the same categorical bus dictionary (see src/schema.py), the keys are integer codes.
+    useCodes = share_categories(dfVeloSorted, ["From Sub", "To Sub"], dfTadsLatest, ["FromBus", "ToBus"])
+    veloLo, veloHi = get_canonical_bus_pairs(dfVeloSorted, col1="From Sub", col2="To Sub", useCodes=useCodes)
+    tadsLo, tadsHi = get_canonical_bus_pairs(dfTadsLatest, col1="FromBus", col2="ToBus", useCodes=useCodes)
+
+    dfVeloKeys = pd.DataFrame(
+        {"lo": veloLo, "hi": veloHi, "veloPos": np.arange(len(dfVeloSorted))}
+    )
+    dfTadsKeys = pd.DataFrame(
+        {"lo": tadsLo, "hi": tadsHi, "tadsPos": np.arange(len(dfTadsLatest))}
+    )
+
+    # Hash join on the canonical key, then restore the (Velo row, TADS row) order
+    # the old nested loop produced so the row multiplicity and ordering are unchanged
+    dfPairs = pd.merge(dfVeloKeys, dfTadsKeys, on=["lo", "hi"], how="inner")
+    dfPairs = dfPairs.sort_values(by=["veloPos", "tadsPos"], kind="stable")
+
+    return dfPairs["veloPos"].to_numpy(), dfPairs["tadsPos"].to_numpy()
+
+@profile_stage
+def assemble_matched_entries(dfVeloSorted, dfTadsLatest, veloPos, tadsPos, getMatchVeloTlines=True):
+    """
+    Build the `get_matched_entries` outputs from matched (Velocity Suite row, TADS row) positions.
+
+    The TADS rows at `tadsPos` get the 'Rec_ID' of the Velocity Suite rows at `veloPos`.
+    """
+    dfTadsMatched = dfTadsLatest.iloc[tadsPos].assign(Rec_ID=dfVeloSorted["Rec_ID"].to_numpy()[veloPos])
 
     if getMatchVeloTlines:
-        dfVeloMatched = pd.DataFrame(matched_velo_rows)
+        dfVeloMatched = dfVeloSorted.iloc[np.unique(veloPos)]
         return dfTadsMatched, dfVeloMatched
 
     return dfTadsMatched
 
+def get_canonical_bus_pairs(df, col1="FromBus", col2="ToBus", useCodes=False):
+    """
+    Build direction-agnostic (lo, hi) bus-pair keys for every row of a DataFrame.
+
+    Both columns are compared as strings, and for each row the lexicographically
+    smaller value goes into `lo` and the larger one into `hi`, so that a line
+    A-B and a line B-A produce the same key.
+
+    Parameters
+    ----------
+    - `df` : pandas.DataFrame
+        The DataFrame containing the two bus columns.
+
+    - `col1` : str, optional (default="FromBus")
+        The name of the first bus column.
+
+    - `col2` : str, optional (default="ToBus")
+        The name of the second bus column.
+
+    - `useCodes` : bool, optional (default=False)
+        If True, both columns must be categoricals sharing one dictionary whose
+        categories are sorted as strings (see `src.schema.to_shared_categoricals`),
+        and the keys are built from their integer codes instead of strings.
+
+    Returns
+    ----------
+    `lo`, `hi` : numpy.ndarray, numpy.ndarray
+        String (or integer code) arrays of the same length as `df` holding the smaller and the
+        larger bus name of each row.
+
+    Example
+    ----------
+    >>> df = pd.DataFrame({'FromBus': ['BusC', 'BusA'], 'ToBus': ['BusA', 'BusC']})
+    >>> lo, hi = get_canonical_bus_pairs(df)
+    >>> print(lo, hi)
+    ['BusA' 'BusA'] ['BusC' 'BusC']
+    """
+    if useCodes:
+        codes1 = df[col1].cat.codes.to_numpy()
+        codes2 = df[col2].cat.codes.to_numpy()
+        return np.minimum(codes1, codes2), np.maximum(codes1, codes2)
+
+    values1 = _to_str_array(df[col1])
+    values2 = _to_str_array(df[col2])
+
+    swap = values1 > values2
+    lo = np.where(swap, values2, values1)
+    hi = np.where(swap, values1, values2)
+
+    return lo, hi
+
+@profile_stage
 def rearrangeColumns(df, col1="FromBus", col2="ToBus"):
     """
     Rearrange values between two columns based on lexicographic order.
 
-    This function iterates through each row of the DataFrame and swaps the
-    values of `col1` and `col2` if the value in `col1` is lexicographically
+    This function compares the two columns as strings over whole arrays and swaps
+    the values of `col1` and `col2` in every row where the value in `col1` is lexicographically
     greater than the value in `col2`. The purpose is to ensure that the values
     in `col1` are always lexicographically smaller or equal to the values
     in `col2`.
@@ -336,19 +461,20 @@ def rearrangeColumns(df, col1="FromBus", col2="ToBus"):
     1    BusA   BusC
     2    BusB   BusB
     """
-    # Make a copy of the DataFrame to avoid modifying the original
-    df = df.copy()
-
-    # Iterate through each row and swap col1 and col2 if necessary
-    for index, row in df.iterrows():
-        value1 = str(row[col1])
-        value2 = str(row[col2])
-
-        if value1 > value2:
-            df.at[index, col1] = value2
-            df.at[index, col2] = value1
-
-    return df
+    # Compare both columns as strings over whole arrays and swap only where needed
+    values1 = _to_str_array(df[col1])
+    values2 = _to_str_array(df[col2])
+    swap = values1 > values2
+
+    if not swap.any():
+        return df
+
+    # Only the two bus columns are new, the other columns are shared with the input
+    newCol1 = df[col1].to_numpy(dtype=object).copy()
+    newCol2 = df[col2].to_numpy(dtype=object).copy()
+    newCol1[swap] = values2[swap]
+    newCol2[swap] = values1[swap]
+    return df.assign(**{col1: newCol1, col2: newCol2})
 
 
 # %%
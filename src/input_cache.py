@@ -0,0 +1,260 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:  # Cache falls back to pickle files if pyarrow is not installed
+    pa = None
+    feather = None
+
+from src.profiling import profile_stage
+
+
+@profile_stage
+def read_csv_cached(fileAddr, cacheFolder, **read_kwargs):
+    """
+    Drop-in replacement for `pd.read_csv` that goes through the columnar input cache.
+
+    See `read_cached` for how the cache is keyed and invalidated.
+
+    Example
+    ----------
+    >>> dfTads0 = read_csv_cached(tadsFileAddr, cacheFolder)
+    >>> dfTads0 = read_csv_cached(tadsFileAddr, cacheFolder, usecols=load_columns("tads", csv_columns(tadsFileAddr)))
+    """
+    return read_cached(fileAddr, cacheFolder, pd.read_csv, **read_kwargs)
+
+
+@profile_stage
+def read_excel_cached(fileAddr, cacheFolder, **read_kwargs):
+    """
+    Drop-in replacement for `pd.read_excel` that goes through the columnar input cache.
+
+    See `read_cached` for how the cache is keyed and invalidated.
+
+    Example
+    ----------
+    >>> dfVeloTlines0 = read_excel_cached(veloFileTlinesAddr, cacheFolder, engine='openpyxl')
+    """
+    return read_cached(fileAddr, cacheFolder, pd.read_excel, **read_kwargs)
+
+
+def csv_columns(fileAddr, **read_kwargs):
+    """
+    Returns the column names of a CSV file, parsing only its header line.
+    """
+    return list(pd.read_csv(fileAddr, nrows=0, **read_kwargs).columns)
+
+
+def read_cached(fileAddr, cacheFolder, reader, **read_kwargs):
+    """
+    Load a raw input file through a content-hash-keyed columnar cache.
+
+    The first time a file is read, it is parsed with `reader` and the resulting
+    DataFrame is written to `cacheFolder` as a Feather (Arrow IPC) file whose
+    name contains the SHA-256 of the source file's contents. Later calls load
+    that Feather file (memory-mapped) instead of parsing the source again. If
+    the source file changes, its hash changes, so the stale cache entry is
+    replaced automatically.
+
+    A small JSON manifest per (source file, reader arguments) remembers the
+    source's size and modification time, so an unchanged file is not even
+    re-hashed. Frames that Arrow cannot represent (e.g. object columns mixing
+    strings and integers) are cached as pickle files instead.
+
+    Cache files and manifests are written to a temporary file and renamed into
+    place, so processes reading the same cache concurrently (batch workers,
+    `src.excel_loader.prefetch_excel`) never see a partial file. The cache file
+    of a previous version of the source is not deleted here, as another process
+    may still have it memory-mapped; `remove_stale_cache_files` cleans up.
+
+    Parameters
+    ----------
+    - `fileAddr` : str
+        Path of the raw CSV/xlsx input file.
+
+    - `cacheFolder` : str
+        Folder holding the cache files. Created if it does not exist.
+
+    - `reader` : callable
+        Function used to parse the source on a cache miss, e.g. `pd.read_csv`.
+
+    - `**read_kwargs` :
+        Keyword arguments passed to `reader`. They are part of the cache key.
+
+    Returns
+    ----------
+    `df` : pandas.DataFrame
+        The parsed (or cached) contents of `fileAddr`.
+    """
+    os.makedirs(cacheFolder, exist_ok=True)
+
+    stem, kwargsKey = _cache_key(fileAddr, reader, read_kwargs)
+    manifestAddr = os.path.join(cacheFolder, f"{stem}-{kwargsKey}.json")
+
+    stat = os.stat(fileAddr)
+    manifest = _load_manifest(manifestAddr)
+
+    # Fast path: size and mtime unchanged, so the recorded content hash still holds
+    if _manifest_current(manifest, stat):
+        return _read_cache_file(manifest["cacheAddr"])
+
+    contentHash = hash_file(fileAddr)
+
+    if _cache_usable(manifest) and manifest["contentHash"] == contentHash:
+        # File was touched but its contents are the same
+        df = _read_cache_file(manifest["cacheAddr"])
+    else:
+        print(f"Input cache miss for {os.path.basename(fileAddr)}, parsing the source file.")
+        df = reader(fileAddr, **read_kwargs)
+        cacheAddr = _write_cache_file(df, os.path.join(cacheFolder, f"{stem}-{kwargsKey}-{contentHash[:16]}"))
+        manifest = {"cacheAddr": cacheAddr, "contentHash": contentHash}
+
+    manifest.update({"source": os.path.abspath(fileAddr), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+    tmpAddr = _tmp_addr(manifestAddr)
+    with open(tmpAddr, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmpAddr, manifestAddr)
+
+    return df
+
+
+def remove_stale_cache_files(cacheFolder):
+    """
+    Delete the cache files no manifest in `cacheFolder` refers to any more, and leftover temporary files.
+
+    Call it only while no other process reads the cache, e.g. at the start of a
+    batch run before the worker processes are started.
+
+    Returns
+    ----------
+    `removedAddrs` : list of str
+    """
+    if not os.path.isdir(cacheFolder):
+        return []
+
+    fileNames = os.listdir(cacheFolder)
+    manifests = [_load_manifest(os.path.join(cacheFolder, fileName)) for fileName in fileNames if fileName.endswith(".json")]
+    currentAddrs = {os.path.abspath(manifest["cacheAddr"]) for manifest in manifests if isinstance(manifest, dict) and "cacheAddr" in manifest}
+
+    removedAddrs = []
+    for fileName in fileNames:
+        fileAddr = os.path.join(cacheFolder, fileName)
+        isStale = fileName.endswith((".feather", ".pkl")) and os.path.abspath(fileAddr) not in currentAddrs
+        if isStale or fileName.endswith(".tmp"):
+            os.remove(fileAddr)
+            removedAddrs.append(fileAddr)
+    return removedAddrs
+
+
+def is_cached(fileAddr, cacheFolder, reader, **read_kwargs):
+    """
+    Returns True if `read_cached` would load `fileAddr` from the cache without parsing
+    or hashing it, i.e. the file's size and modification time are unchanged.
+    """
+    stem, kwargsKey = _cache_key(fileAddr, reader, read_kwargs)
+    manifest = _load_manifest(os.path.join(cacheFolder, f"{stem}-{kwargsKey}.json"))
+    return _manifest_current(manifest, os.stat(fileAddr))
+
+
+def content_hash(fileAddr, cacheFolder):
+    """
+    Returns the SHA-256 hex digest of a file's contents, remembered in a manifest
+    in `cacheFolder` and recomputed only when the file's size or modification
+    time changed, as in `read_cached`.
+    """
+    os.makedirs(cacheFolder, exist_ok=True)
+    manifestAddr = os.path.join(cacheFolder, os.path.basename(fileAddr).replace(".", "_") + "-content.json")
+
+    stat = os.stat(fileAddr)
+    manifest = _load_manifest(manifestAddr)
+    if isinstance(manifest, dict) and manifest.get("size") == stat.st_size and manifest.get("mtime_ns") == stat.st_mtime_ns:
+        return manifest["contentHash"]
+
+    manifest = {"source": os.path.abspath(fileAddr), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "contentHash": hash_file(fileAddr)}
+    tmpAddr = _tmp_addr(manifestAddr)
+    with open(tmpAddr, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmpAddr, manifestAddr)
+    return manifest["contentHash"]
+
+
+def hash_file(fileAddr, chunkSize=1 << 20):
+    """
+    Returns the SHA-256 hex digest of a file's contents, read in chunks of `chunkSize` bytes.
+    """
+    digest = hashlib.sha256()
+    with open(fileAddr, "rb") as f:
+        for chunk in iter(lambda: f.read(chunkSize), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_key(fileAddr, reader, read_kwargs):
+    stem = os.path.basename(fileAddr).replace(".", "_")
+    kwargsKey = hashlib.sha256(
+        json.dumps([reader.__name__, read_kwargs], sort_keys=True, default=str).encode()
+    ).hexdigest()[:8]
+    return stem, kwargsKey
+
+
+def _manifest_current(manifest, stat):
+    return _cache_usable(manifest) and manifest["size"] == stat.st_size and manifest["mtime_ns"] == stat.st_mtime_ns
+
+
+def _load_manifest(manifestAddr):
+    if not os.path.exists(manifestAddr):
+        return None
+    try:
+        with open(manifestAddr, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _cache_usable(manifest):
+    if manifest is None or not os.path.exists(manifest["cacheAddr"]):
+        return False
+    # A Feather cache written earlier cannot be read back without pyarrow
+    return feather is not None or not manifest["cacheAddr"].endswith(".feather")
+
+
+def _tmp_addr(fileAddr):
+    # Unique per process and thread, in the same folder so that os.replace is a rename
+    return f"{fileAddr}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+
+def _write_cache_file(df, cacheAddrNoExt):
+    if feather is not None:
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            cacheAddr = cacheAddrNoExt + ".feather"
+            tmpAddr = _tmp_addr(cacheAddr)
+            feather.write_feather(table, tmpAddr, compression="uncompressed")
+            os.replace(tmpAddr, cacheAddr)
+            return cacheAddr
+        except (pa.ArrowInvalid, pa.ArrowTypeError, ValueError, TypeError):
+            pass
+
+    cacheAddr = cacheAddrNoExt + ".pkl"
+    tmpAddr = _tmp_addr(cacheAddr)
+    df.to_pickle(tmpAddr)
+    os.replace(tmpAddr, cacheAddr)
+    return cacheAddr
+
+
+def _read_cache_file(cacheAddr):
+    if cacheAddr.endswith(".feather"):
+        # Uncompressed Feather files can be memory-mapped instead of read into a buffer
+        return feather.read_table(cacheAddr, memory_map=True).to_pandas()
+    return pd.read_pickle(cacheAddr)
+
+
+# %%
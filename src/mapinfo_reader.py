@@ -0,0 +1,377 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+"""
+Reader for MapInfo native tables (.TAB + .DAT + .MAP + .ID), as saved by MapInfo
+Pro and Velocity Suite, e.g. the layers under `queries/`.
+
+The .DAT attribute file is a dBase-style file of fixed-width records and is
+memory-mapped as one numpy structured array, so every column is a strided view
+decoded in one vectorized step. The .MAP geometry file is memory-mapped as
+well; the .ID file gives the offset of each record's object in it, and the
+vertices of all objects are returned as flat columnar arrays.
+
+Supported geometries are points, lines, polylines and multi-polylines, and the
+outer and inner rings of regions (MapInfo 3.0 and 4.5 object types). Other
+objects (text, arcs, ellipses, ...) are skipped.
+"""
+import os
+import re
+import struct
+
+import numpy as np
+import pandas as pd
+
+from src.profiling import profile_stage
+
+# TAB field type -> numpy dtype of its binary form in the .DAT file (char, decimal and date are special-cased)
+datFieldDtypes = {
+    "integer": "<i4",
+    "smallint": "<i2",
+    "float": "<f8",
+    "logical": "S1",
+}
+
+# MapInfo object type codes (see the MapInfo .MAP file format as documented by the GDAL "mitab" driver)
+symbolTypes = {0x01, 0x02}
+fontSymbolTypes = {0x28, 0x29}
+customSymbolTypes = {0x2B, 0x2C}
+lineTypes = {0x04, 0x05}
+plineTypes = {0x07, 0x08}
+multiSectionTypes = {0x0D, 0x0E, 0x25, 0x26}  # regions and multi-polylines, MapInfo 3.0 sections
+multiSectionV450Types = {0x2E, 0x2F, 0x31, 0x32}  # same, MapInfo 4.5 sections with 32-bit counts
+mapHeaderMagic = 42424242
+
+# Fields of the Velocity Suite layers whose name differs from the column of the Velocity Suite xlsx exports
+# (MapInfo does not allow spaces in field names). Other fields keep their MapInfo name, e.g. 'Rec_ID' and 'Proposed'.
+veloColumnNames = {
+    "Company_Name": "Company Name",
+    "From_Sub": "From Sub",
+    "To_Sub": "To Sub",
+    "Voltage_kV": "Voltage kV",
+}
+
+
+def read_tab_fields(tabFileAddr):
+    """
+    Field definitions of a MapInfo .TAB file.
+
+    Returns
+    ----------
+    `fields` : list of tuple
+        (name, type, width, decimals) per field, in .DAT column order. `width`
+        and `decimals` are 0 where the type has none, e.g. ("From_Sub", "char", 50, 0).
+    """
+    with open(tabFileAddr, encoding="cp1252") as f:
+        lines = f.read().splitlines()
+
+    numFieldsAt = next(i for i, line in enumerate(lines) if line.strip().lower().startswith("fields "))
+    numFields = int(lines[numFieldsAt].split()[1])
+
+    fieldPattern = re.compile(r"^\s*(\S+)\s+(\w+)\s*(?:\(\s*(\d+)\s*(?:,\s*(\d+))?\s*\))?")
+    fields = []
+    for line in lines[numFieldsAt + 1:numFieldsAt + 1 + numFields]:
+        name, fieldType, width, decimals = fieldPattern.match(line).groups()
+        fields.append((name, fieldType.lower(), int(width or 0), int(decimals or 0)))
+
+    return fields
+
+
+def read_dat(tabFileAddr, columns=None):
+    """
+    Attribute table of a MapInfo layer, read from its memory-mapped .DAT file.
+
+    Parameters
+    ----------
+    - `tabFileAddr` : str
+        Path of the .TAB file; the .DAT file next to it is read.
+
+    - `columns` : list of str, optional (default=None)
+        Only decode these fields. All fields by default.
+
+    Returns
+    ----------
+    `dfAttributes` : pandas.DataFrame
+        One row per record, deleted records included (see `read_mapinfo_layer`),
+        with the .TAB field names as columns. char fields become strings, integer
+        and smallint fields integers, float and decimal fields floats, logical
+        fields booleans and date fields datetimes.
+    """
+    datFileAddr = _sibling(tabFileAddr, ".DAT")
+    with open(datFileAddr, "rb") as f:
+        numRecords, headerLen, recordLen = struct.unpack("<4xIHH", f.read(12))
+
+    fields = read_tab_fields(tabFileAddr)
+    recordDtype = np.dtype(
+        {
+            "names": ["_deleted"] + [name for name, _, _, _ in fields],
+            "formats": ["S1"] + [_field_dtype(fieldType, width) for _, fieldType, width, _ in fields],
+        }
+    )
+    if recordDtype.itemsize != recordLen:
+        raise ValueError(f"{datFileAddr}: record length {recordLen} does not match the .TAB fields ({recordDtype.itemsize})")
+
+    if numRecords == 0:
+        records = np.zeros(0, dtype=recordDtype)
+    else:
+        records = np.memmap(datFileAddr, dtype=recordDtype, mode="r", offset=headerLen, shape=(numRecords,))
+
+    data = {}
+    for name, fieldType, _, _ in fields:
+        if columns is None or name in columns:
+            data[name] = _decode_field(records[name], fieldType)
+
+    return pd.DataFrame(data)
+
+
+def read_map_geometry(tabFileAddr):
+    """
+    Vertices of all objects of a MapInfo layer, read from its memory-mapped .MAP and .ID files.
+
+    Returns
+    ----------
+    `dfVertices` : pandas.DataFrame
+        One row per vertex, in drawing order, with columns 'row' (0-based record
+        position in the .DAT file), 'part' (section of a multi-polyline or ring
+        of a region, 0 for single parts) and 'lon', 'lat' (or x, y in the layer's
+        projection). Points are a single vertex, records without (supported)
+        geometry have no rows.
+    """
+    idFileAddr = _sibling(tabFileAddr, ".ID")
+    mapFileAddr = _sibling(tabFileAddr, ".MAP")
+    objectOffsets = np.fromfile(idFileAddr, dtype="<i4")
+
+    buf = np.memmap(mapFileAddr, dtype=np.uint8, mode="r")
+    header = _read_map_header(buf, mapFileAddr)
+
+    rows, parts, xs, ys = [], [], [], []
+    for row, offset in enumerate(objectOffsets.tolist()):
+        if offset <= 0:
+            continue
+        for part, (x, y) in enumerate(_read_object(buf, offset, header["blockSize"])):
+            rows.append(np.full(len(x), row, dtype=np.int64))
+            parts.append(np.full(len(x), part, dtype=np.int64))
+            xs.append(x)
+            ys.append(y)
+
+    if not rows:
+        return pd.DataFrame({"row": np.empty(0, np.int64), "part": np.empty(0, np.int64), "lon": np.empty(0), "lat": np.empty(0)})
+
+    intX = np.concatenate(xs).astype(np.float64)
+    intY = np.concatenate(ys).astype(np.float64)
+
+    # Integer to layer coordinates, per the coordinate origin quadrant of the header
+    quadrant = header["quadrant"]
+    if quadrant in (0, 2, 3):
+        lon = -(intX + header["xDispl"]) / header["xScale"]
+    else:
+        lon = (intX - header["xDispl"]) / header["xScale"]
+    if quadrant in (0, 3, 4):
+        lat = -(intY + header["yDispl"]) / header["yScale"]
+    else:
+        lat = (intY - header["yDispl"]) / header["yScale"]
+
+    return pd.DataFrame({"row": np.concatenate(rows), "part": np.concatenate(parts), "lon": lon, "lat": lat})
+
+
+@profile_stage
+def read_mapinfo_layer(tabFileAddr, columns=None):
+    """
+    Attributes and geometry of a MapInfo layer, without deleted records.
+
+    Parameters
+    ----------
+    - `tabFileAddr` : str
+        Path of the .TAB file, e.g. "queries/tlines-near-chicago-ohare-raw_Layers/tlinesnearohareraw.TAB".
+
+    - `columns` : list of str, optional (default=None)
+        Attribute fields to decode, all by default.
+
+    Returns
+    ----------
+    `dfAttributes` : pandas.DataFrame
+        See `read_dat`, with the record position in the .DAT file as index.
+
+    `dfVertices` : pandas.DataFrame
+        See `read_map_geometry`; its 'row' column refers to the index of `dfAttributes`.
+
+    Example
+    ----------
+    >>> dfTlines, dfVertices = read_mapinfo_layer(tabFileAddr)
+    >>> spatialIndex = SpatialIndex(dfTlines.loc[dfVertices["row"], "Rec_ID"], dfVertices["lon"], dfVertices["lat"], dfVertices["part"])
+    """
+    dfAttributes = read_dat(tabFileAddr, columns=columns)
+    isDeleted = _read_deleted_flags(tabFileAddr)
+    dfAttributes = dfAttributes[~isDeleted]
+
+    dfVertices = read_map_geometry(tabFileAddr)
+    dfVertices = dfVertices[~isDeleted[dfVertices["row"].to_numpy()]].reset_index(drop=True)
+
+    return dfAttributes, dfVertices
+
+
+@profile_stage
+def read_velo_layer(tabFileAddr):
+    """
+    Attribute table of a Velocity Suite MapInfo layer, with the column names of the Velocity Suite xlsx exports.
+
+    Fields are renamed with `veloColumnNames`, so the table can be used in place
+    of e.g. tlines-near-chicago-ohare-raw.xlsx by `run_tads_location` and `main_tads.py`.
+
+    Example
+    ----------
+    >>> dfVeloTlines0 = read_velo_layer("queries/tlines-near-chicago-ohare-raw_Layers/tlinesnearohareraw.TAB")
+    """
+    dfAttributes = read_dat(tabFileAddr)
+    dfAttributes = dfAttributes[~_read_deleted_flags(tabFileAddr)]
+    return dfAttributes.rename(columns=veloColumnNames)
+
+
+def _sibling(tabFileAddr, ext):
+    # MapInfo writes the extension in upper or lower case
+    base = os.path.splitext(tabFileAddr)[0]
+    for candidate in (base + ext.upper(), base + ext.lower()):
+        if os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError(f"No {ext} file next to {tabFileAddr}")
+
+
+def _field_dtype(fieldType, width):
+    if fieldType in datFieldDtypes:
+        return datFieldDtypes[fieldType]
+    if fieldType == "date":
+        return "<i4"  # YYYYMMDD as a 32-bit integer
+    if fieldType in ("char", "decimal"):
+        return f"S{width}"
+    raise ValueError(f"Unsupported MapInfo field type: {fieldType}")
+
+
+def _decode_field(values, fieldType):
+    values = np.asarray(values)
+    if fieldType == "char":
+        # Trailing NULs are dropped by numpy's bytes dtype
+        return pd.Series(np.char.decode(values, "cp1252"), dtype=object).str.rstrip()
+    if fieldType == "decimal":
+        return pd.to_numeric(pd.Series(np.char.decode(values, "ascii")).str.strip(), errors="coerce")
+    if fieldType == "logical":
+        return pd.Series(np.isin(values, [b"T", b"t", b"Y", b"y"]))
+    if fieldType == "date":
+        return pd.Series(pd.to_datetime(values.astype(str), format="%Y%m%d", errors="coerce"))
+    return pd.Series(values.copy())
+
+
+def _read_deleted_flags(tabFileAddr):
+    datFileAddr = _sibling(tabFileAddr, ".DAT")
+    with open(datFileAddr, "rb") as f:
+        numRecords, headerLen, recordLen = struct.unpack("<4xIHH", f.read(12))
+    if numRecords == 0:
+        return np.zeros(0, dtype=bool)
+    records = np.memmap(datFileAddr, dtype=np.uint8, mode="r", offset=headerLen, shape=(numRecords, recordLen))
+    return records[:, 0] == ord("*")
+
+
+def _read_map_header(buf, mapFileAddr):
+    magic, version, blockSize = struct.unpack_from("<iHH", buf, 0x100)
+    if magic != mapHeaderMagic:
+        raise ValueError(f"{mapFileAddr} is not a MapInfo .MAP file")
+    quadrant = int(buf[0x161])
+    xScale, yScale, xDispl, yDispl = struct.unpack_from("<4d", buf, 0x170)
+    return {
+        "version": version,
+        "blockSize": blockSize,
+        "quadrant": quadrant,
+        "xScale": xScale,
+        "yScale": yScale,
+        "xDispl": xDispl,
+        "yDispl": yDispl,
+    }
+
+
+def _read_object(buf, offset, blockSize):
+    # Parts of one object as (x, y) integer coordinate arrays
+    objType = int(buf[offset])
+    isCompressed = objType % 3 == 1  # compressed variants are the codes 0x01, 0x04, 0x07, ...
+    pos = offset + 5  # type byte and row id
+
+    # Origin of compressed coordinates stored in the object itself: the object block's center
+    blockStart = offset - offset % blockSize
+    centerX, centerY = struct.unpack_from("<ii", buf, blockStart + 4)
+
+    if objType in symbolTypes or objType in customSymbolTypes:
+        if objType in customSymbolTypes:
+            pos += 2
+        return [_read_int_coords(buf, pos, 1, isCompressed, centerX, centerY)]
+
+    if objType in fontSymbolTypes:
+        return [_read_int_coords(buf, pos + 12, 1, isCompressed, centerX, centerY)]
+
+    if objType in lineTypes:
+        return [_read_int_coords(buf, pos, 2, isCompressed, centerX, centerY)]
+
+    if objType in plineTypes or objType in multiSectionTypes or objType in multiSectionV450Types:
+        coordBlockPtr, coordDataSize = struct.unpack_from("<iI", buf, pos)
+        coordDataSize &= 0x7FFFFFFF  # top bit flags smoothed lines
+        pos += 8
+        numSections = 1
+        if objType not in plineTypes:
+            numSections = struct.unpack_from("<h", buf, pos)[0]
+            pos += 2
+
+        comprOrgX, comprOrgY = 0, 0
+        if isCompressed:
+            comprOrgX, comprOrgY = struct.unpack_from("<ii", buf, pos + 4)  # after the label point
+
+        data = _read_coord_data(buf, coordBlockPtr, coordDataSize, blockSize)
+        coordSize = 4 if isCompressed else 8
+
+        if objType in plineTypes:
+            numVertices = [coordDataSize // coordSize]
+            dataPos = 0
+        else:
+            # Section headers: vertex count, hole count, bounding box and data offset
+            countFormat = "<ih" if objType in multiSectionV450Types else "<hh"
+            countSize = struct.calcsize(countFormat)
+            headerSize = countSize + 2 * coordSize + 4
+            numVertices = [struct.unpack_from(countFormat, data, i * headerSize)[0] for i in range(numSections)]
+            dataPos = numSections * headerSize
+
+        parts = []
+        for n in numVertices:
+            parts.append(_read_int_coords(data, dataPos, n, isCompressed, comprOrgX, comprOrgY))
+            dataPos += n * coordSize
+        return parts
+
+    return []
+
+
+def _read_int_coords(buf, pos, numVertices, isCompressed, originX, originY):
+    if isCompressed:
+        xy = np.frombuffer(buf, dtype="<i2", count=2 * numVertices, offset=pos).astype(np.int64)
+        return xy[0::2] + originX, xy[1::2] + originY
+    xy = np.frombuffer(buf, dtype="<i4", count=2 * numVertices, offset=pos).astype(np.int64)
+    return xy[0::2], xy[1::2]
+
+
+def _read_coord_data(buf, coordBlockPtr, numBytes, blockSize):
+    # Coordinate data may continue over a chain of coordinate blocks, each with an 8-byte header:
+    # type, unused byte, number of data bytes and the address of the next block
+    if numBytes == 0:
+        return b""
+    chunks = []
+    pos = coordBlockPtr
+    blockStart = pos - pos % blockSize
+    while numBytes > 0:
+        numDataBytes, nextBlock = struct.unpack_from("<hi", buf, blockStart + 2)
+        take = min(numBytes, blockStart + 8 + numDataBytes - pos)
+        if take > 0:
+            chunks.append(bytes(buf[pos:pos + take]))
+            numBytes -= take
+        if numBytes > 0:
+            if nextBlock <= 0:
+                raise ValueError(f"Truncated coordinate data in block {blockStart}")
+            # Blocks of a chain are not necessarily in file order
+            blockStart = nextBlock
+            pos = nextBlock + 8
+    return b"".join(chunks)
+
+
+# %%
@@ -0,0 +1,103 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import numpy as np
+import pandas as pd
+
+from src.profiling import profile_stage
+
+reportColumns = ["match", "dimension", "group", "rows", "matched", "unmatched", "duplicated", "matchedRows", "matchRate", "fanOut1", "fanOut2", "fanOut3+"]
+
+
+@profile_stage
+def match_report(dfSource, dfMatched, keys, groupBy=(), name="match"):
+    """
+    Coverage of a match: matched, unmatched and multiply matched source rows, overall and per group.
+
+    Every row of `dfSource` gets its fan-out, the number of rows of the join
+    output `dfMatched` carrying its key. The fan-out indicators of all rows are
+    then summed in one group-by over all `groupBy` columns together; the
+    per-column and overall figures are sums of that small table.
+
+    Parameters
+    ----------
+    - `dfSource` : pandas.DataFrame
+        The rows to be matched, e.g. the Velocity Suite lines or plants.
+
+    - `dfMatched` : pandas.DataFrame
+        The join output, one row per match, carrying the `keys` of the source row it matched.
+
+    - `keys` : list of str
+        Columns identifying a source row in both frames, e.g. ["Rec_ID"].
+
+    - `groupBy` : list of str, optional (default=())
+        Columns of `dfSource` to break the figures down by, e.g. ["Company Name", "Voltage kV"].
+
+    - `name` : str, optional (default="match")
+        Written to the 'match' column, to tell several matches apart in one table.
+
+    Returns
+    ----------
+    `dfReport` : pandas.DataFrame
+        One row for all source rows (dimension "all") and one per value of every
+        `groupBy` column, with the columns of `reportColumns`: 'rows', 'matched',
+        'unmatched', 'duplicated' (matched more than once), 'matchedRows' (join
+        output rows), 'matchRate' and the fan-out histogram 'fanOut1', 'fanOut2'
+        and 'fanOut3+' (source rows matched once, twice, three or more times).
+
+    Example
+    ----------
+    >>> dfVelo = pd.DataFrame({'Rec_ID': [1, 2, 3, 4], 'Company Name': ['A', 'A', 'B', 'B']})
+    >>> dfMatched = pd.DataFrame({'Rec_ID': [1, 1, 3]})
+    >>> match_report(dfVelo, dfMatched, ["Rec_ID"], ["Company Name"])[["dimension", "group", "rows", "matched", "duplicated", "matchRate"]]
+          dimension group  rows  matched  duplicated  matchRate
+    0           all   all     4        2           1        0.5
+    1  Company Name     A     2        1           1        0.5
+    2  Company Name     B     2        1           0        0.5
+    """
+    keys = list(keys)
+    groupBy = list(groupBy)
+
+    # Fan-out of every source row: rows of the join output with its key
+    matchCounts = dfMatched.groupby(keys, sort=False, observed=True).size()
+    sourceKeys = pd.MultiIndex.from_frame(dfSource[keys]) if len(keys) > 1 else pd.Index(dfSource[keys[0]])
+    positions = matchCounts.index.get_indexer(sourceKeys)
+    fanOut = np.append(matchCounts.to_numpy(), 0)[positions]  # position -1, a key without match, picks the appended 0
+
+    dfCounts = pd.DataFrame(
+        {
+            "rows": np.ones(len(fanOut), dtype="int64"),
+            "unmatched": fanOut == 0,
+            "duplicated": fanOut > 1,
+            "matchedRows": fanOut,
+            "fanOut1": fanOut == 1,
+            "fanOut2": fanOut == 2,
+            "fanOut3+": fanOut >= 3,
+        }
+    )
+
+    if groupBy:
+        groupValues = [dfSource[col].to_numpy() for col in groupBy]
+        dfGroups = dfCounts.groupby(groupValues, sort=True, dropna=False).sum()
+        dfGroups.index.names = groupBy
+        parts = [_report_part(dfGroups.sum().to_frame().T, "all", ["all"])]
+        for col in groupBy:
+            dfDimension = dfGroups.groupby(level=col, dropna=False).sum()
+            parts.append(_report_part(dfDimension, col, dfDimension.index.tolist()))
+    else:
+        parts = [_report_part(dfCounts.sum().to_frame().T, "all", ["all"])]
+
+    dfReport = pd.concat(parts, ignore_index=True)
+    dfReport.insert(0, "match", name)
+    return dfReport[reportColumns]
+
+
+def _report_part(dfSums, dimension, groups):
+    dfPart = dfSums.astype("int64").reset_index(drop=True)
+    dfPart.insert(0, "dimension", dimension)
+    dfPart.insert(1, "group", pd.Series(groups, dtype=object).astype(str))
+    dfPart["matched"] = dfPart["rows"] - dfPart["unmatched"]
+    dfPart["matchRate"] = (dfPart["matched"] / dfPart["rows"]).round(4)
+    return dfPart
+
+
+# %%
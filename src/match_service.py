@@ -0,0 +1,283 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from src.housekeeping_gads import eia_filtering, match_by_eia_code_and_add_recid, normalize_eia_ids, sort_and_reorder_columns
+from src.housekeeping_tads import get_canonical_bus_pairs, get_latest_entries, get_matched_entries, sort_and_shift_columns_dfVelo
+from src.pipeline_tads import filter_velo_tlines, map_company_names_velo2tads
+from src.profiling import profiler
+from src.us_states import state_mask
+
+# Profiler records kept by a running service before they are dropped (see /stats in `MatchRequestHandler`)
+maxProfilerRecords = 100_000
+
+
+class MatchService:
+    """
+    The preprocessed national TADS and GADS inventories held in memory, with join indexes, answering match and lookup requests.
+
+    Built once from the outputs of `load_tads_inventory` and `load_gads_inventory`.
+    The TADS rows are indexed by their direction-agnostic bus pair (see
+    `get_canonical_bus_pairs`) and the GADS rows, sorted and EIA-filtered as in
+    `gads_location_dag`, by their EIA code. A request only touches the rows
+    of the bus pairs or EIA codes it names. These candidate rows are handed to
+    the same functions the pipelines use, `get_latest_entries` and
+    `get_matched_entries` or `match_by_eia_code_and_add_recid`. Restricting to
+    the candidates does not change their result, because both the latest entry
+    and the match are decided per bus pair or EIA code.
+
+    The indexes and frames are never modified after construction, so requests
+    can be answered concurrently from several threads.
+
+    Parameters
+    ----------
+    - `dfTadsNational` : pandas.DataFrame
+        Output of `load_tads_inventory`.
+
+    - `dfGadsNational` : pandas.DataFrame
+        Output of `load_gads_inventory`.
+
+    Example
+    ----------
+    >>> service = MatchService(load_tads_inventory(tadsRawFolder, tadsCacheFolder), load_gads_inventory(gadsRawFolder, gadsCacheFolder))
+    >>> dfTadsMatched, dfVeloMatched = service.match_tlines(dfVeloTlines0, location="chicago-ohare")
+    >>> service.lookup_units([10474])  # GADS units of EIA plant 10474
+    """
+
+    def __init__(self, dfTadsNational, dfGadsNational):
+        start = time.perf_counter()
+        self.dfTads = dfTadsNational
+        lo, hi = get_canonical_bus_pairs(self.dfTads, col1="FromBus", col2="ToBus")
+        self._tadsPairRows = _row_groups([lo, hi])
+        self._tadsCompanyNames = self.dfTads["CompanyName"].unique()
+
+        self.dfGads = eia_filtering(sort_and_reorder_columns(dfGadsNational, sort_columns=["UnitName", "UtilityName"]), column_name="EIACode")
+        self._gadsEiaRows = _row_groups([self.dfGads["EIACode"].to_numpy(dtype="int64")])
+        self.warmUpSeconds = time.perf_counter() - start
+
+    def health(self):
+        return {
+            "tadsRows": len(self.dfTads),
+            "tadsBusPairs": len(self._tadsPairRows),
+            "gadsRows": len(self.dfGads),
+            "gadsEiaCodes": len(self._gadsEiaRows),
+            "warmUpSeconds": round(self.warmUpSeconds, 3),
+        }
+
+    def lookup_tlines(self, busPairs, companies=None, latest=True):
+        """
+        TADS lines between each (bus, bus) pair in `busPairs`, in either direction.
+
+        With `latest=True` only the latest reported year of every ('FromBus', 'ToBus')
+        is kept (see `get_latest_entries`), among the lines of `companies` if given.
+        """
+        lo, hi = get_canonical_bus_pairs(pd.DataFrame(list(busPairs), columns=["FromBus", "ToBus"]))
+        dfCandidates = self._tads_candidates(zip(lo.tolist(), hi.tolist()), companies)
+        return get_latest_entries(dfCandidates) if latest else dfCandidates
+
+    def match_tlines(self, dfVeloTlines0, companies=None, location=None):
+        """
+        `get_matched_entries` of Velocity Suite lines against the latest TADS entries.
+
+        The lines are filtered and sorted by `filter_velo_tlines` first, as in
+        `run_tads_location`. Lines given without a 'Voltage kV' or 'Proposed'
+        column are taken as 100 kV and above and in service, and only sorted.
+
+        TADS is restricted to the lines of `companies` first, as in `main_tads.py`.
+        With `location` and no `companies`, these are the Velocity Suite
+        'Company Name's renamed by `map_company_names_velo2tads` that name a
+        TADS company; the lines of the others are not matched. With neither,
+        all companies are matched.
+
+        Returns
+        ----------
+        `dfTadsMatched`, `dfVeloMatched` : pandas.DataFrame, pandas.DataFrame
+            As returned by `get_matched_entries(dfVeloSorted, dfTadsLatest)`.
+        """
+        if {"Voltage kV", "Proposed"}.issubset(dfVeloTlines0.columns):
+            dfVeloSorted = filter_velo_tlines(dfVeloTlines0)
+        else:
+            dfVeloSorted = sort_and_shift_columns_dfVelo(dfVeloTlines0)
+
+        if companies is None and location is not None:
+            companies, _ = map_company_names_velo2tads(set(dfVeloSorted["Company Name"]), location, tadsCompanyNames=self._tadsCompanyNames)
+
+        lo, hi = get_canonical_bus_pairs(dfVeloSorted, col1="From Sub", col2="To Sub")
+        dfTadsLatest = get_latest_entries(self._tads_candidates(zip(lo.tolist(), hi.tolist()), companies))
+        return get_matched_entries(dfVeloSorted, dfTadsLatest, getMatchVeloTlines=True)
+
+    def lookup_units(self, eiaIds, states=None):
+        """
+        GADS units with an 'EIACode' in `eiaIds`, in states `states` (abbreviations) if given.
+        """
+        eiaIds, _ = normalize_eia_ids(pd.Series(list(eiaIds), dtype=object))
+        return self._gads_candidates(eiaIds.dropna().tolist(), states)
+
+    def match_plants(self, dfVeloP, states=None):
+        """
+        `match_by_eia_code_and_add_recid` of Velocity Suite plants against GADS.
+
+        GADS is restricted to the states `states`, or to the plants' 'State's
+        when `dfVeloP` has that column, as in `main_gads.py`.
+
+        Returns
+        ----------
+        `dfGadsMatched`, `dfVeloPMatched` : pandas.DataFrame, pandas.DataFrame
+            As returned by `match_by_eia_code_and_add_recid(dfVeloP, dfGads, getMatchVeloP=True)`.
+        """
+        if states is None and "State" in dfVeloP.columns:
+            states = set(dfVeloP["State"])
+
+        eiaIds, _ = normalize_eia_ids(dfVeloP["EIA ID"])
+        dfCandidates = self._gads_candidates(eiaIds.dropna().tolist(), states)
+        return match_by_eia_code_and_add_recid(dfVeloP, dfCandidates, getMatchVeloP=True)
+
+    def _tads_candidates(self, keys, companies):
+        dfCandidates = self.dfTads.iloc[_lookup_rows(self._tadsPairRows, keys)]
+        if companies is not None:
+            dfCandidates = dfCandidates[dfCandidates["CompanyName"].isin(companies)]
+        return dfCandidates
+
+    def _gads_candidates(self, eiaIds, states):
+        dfCandidates = self.dfGads.iloc[_lookup_rows(self._gadsEiaRows, ((eiaId,) for eiaId in eiaIds))]
+        if states is not None:
+            dfCandidates = dfCandidates[state_mask(dfCandidates["StateName"], set(states))]
+        return dfCandidates
+
+
+def _row_groups(keys):
+    # Maps every key (a tuple of the values in `keys`) to the ascending row positions holding it
+    groups = pd.Series(np.arange(len(keys[0]))).groupby(keys, sort=False).indices
+    return {key if isinstance(key, tuple) else (key,): rows for key, rows in groups.items()}
+
+
+def _lookup_rows(rowGroups, keys):
+    # Row positions of all `keys`, each row once and in table order
+    found = [rowGroups[key] for key in dict.fromkeys(keys) if key in rowGroups]
+    return np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+
+def to_records(df):
+    """
+    Rows of `df` as a list of JSON-compatible dicts (missing values as null, dates in ISO format).
+    """
+    return json.loads(df.to_json(orient="records", date_format="iso"))
+
+
+class MatchRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP for a `MatchService`, set as the `service` attribute of the server.
+
+    GET  /health                               inventory sizes and warm-up time
+    GET  /stats                                per-stage time of the requests so far (see `src.profiling`)
+    GET  /tads/tlines?from=A&to=B[&company=C]  latest TADS lines between two buses
+    POST /tads/tlines  {"pairs": [[A, B], ...], "companies": [...]}
+    POST /tads/match   {"tlines": [{"From Sub", "To Sub", "Rec_ID", ...}, ...], "companies": [...] or "location": ...}
+    GET  /gads/units?eia=X[&state=IL]          GADS units of an EIA plant
+    POST /gads/units   {"eia": [X, ...], "states": [...]}
+    POST /gads/match   {"plants": [{"EIA ID", "Rec_ID", ...}, ...], "states": [...]}
+
+    "companies", "location" and "states" are optional. Errors are answered with
+    {"error": message} and status 400 (bad request), 404 (unknown path) or 500
+    (any other error while answering).
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        service = self.server.service
+
+        if url.path == "/health":
+            return self._reply(service.health())
+        if url.path == "/stats":
+            return self._reply({"stages": to_records(profiler.summary().reset_index())})
+        if url.path == "/tads/tlines":
+            return self._answer(lambda: {"tads": to_records(service.lookup_tlines([(query["from"][0], query["to"][0])], companies=query.get("company")))})
+        if url.path == "/gads/units":
+            return self._answer(lambda: {"gads": to_records(service.lookup_units(query["eia"], states=query.get("state")))})
+        return self._reply({"error": f"Unknown path {url.path}"}, status=404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        service = self.server.service
+
+        def answer_post():
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if path == "/tads/tlines":
+                return {"tads": to_records(service.lookup_tlines(body["pairs"], companies=body.get("companies")))}
+            if path == "/tads/match":
+                dfTadsMatched, dfVeloMatched = service.match_tlines(pd.DataFrame(body["tlines"]), companies=body.get("companies"), location=body.get("location"))
+                return {"tads": to_records(dfTadsMatched), "matchedRecIds": dfVeloMatched["Rec_ID"].tolist()}
+            if path == "/gads/units":
+                return {"gads": to_records(service.lookup_units(body["eia"], states=body.get("states")))}
+            if path == "/gads/match":
+                dfGadsMatched, dfVeloPMatched = service.match_plants(pd.DataFrame(body["plants"]), states=body.get("states"))
+                return {"gads": to_records(dfGadsMatched), "matchedRecIds": dfVeloPMatched["Rec_ID"].tolist()}
+            return None
+
+        if path not in ("/tads/tlines", "/tads/match", "/gads/units", "/gads/match"):
+            return self._reply({"error": f"Unknown path {path}"}, status=404)
+        return self._answer(answer_post)
+
+    def _answer(self, handle):
+        start = time.perf_counter()
+        try:
+            result = handle()
+        except (KeyError, ValueError, TypeError) as error:
+            return self._reply({"error": f"{type(error).__name__}: {error}"}, status=400)
+        except Exception as error:  # pylint: disable=broad-except
+            return self._reply({"error": f"{type(error).__name__}: {error}"}, status=500)
+        finally:
+            # Keep the records of a long-running service bounded
+            profiler.reset_above(maxProfilerRecords)
+        result["milliseconds"] = round(1000 * (time.perf_counter() - start), 2)
+        return self._reply(result)
+
+    def _reply(self, result, status=200):
+        payload = json.dumps(result, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(service, host="127.0.0.1", port=8765, background=False, verbose=False):
+    """
+    Serve `service` over HTTP (see `MatchRequestHandler`), one thread per request.
+
+    Blocks until interrupted, or with `background=True` (e.g. in a notebook)
+    returns the server running on a daemon thread; stop it with `server.shutdown()`.
+    `port=0` picks a free port, see `server.server_address`.
+    """
+    server = ThreadingHTTPServer((host, port), MatchRequestHandler)
+    server.service = service
+    server.verbose = verbose
+    server.daemon_threads = True
+    print(f"Matching service on http://{host}:{server.server_address[1]}")
+
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return server
+
+
+# %%
@@ -0,0 +1,135 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyarrow as pa
+except ImportError:  # Parquet output needs pyarrow, otherwise tables fall back to CSV
+    pa = None
+
+from src.profiling import profile_stage
+
+supportedFormats = ("parquet", "csv", "xlsx")
+
+
+class OutputSink:
+    """
+    Writes the pipeline's output tables in a per-table format on a thread pool.
+
+    Every table is written with `write(df, fileAddr, fmt=None)`. The extension of
+    `fileAddr` is replaced by the chosen format, so the existing `...xlsx` output
+    addresses can be passed unchanged. Intermediate tables use `defaultFormat`
+    (Parquet unless stated otherwise), while the final human-facing tables are
+    written as xlsx by passing `fmt="xlsx"` at the call site.
+
+    Writes are submitted to a thread pool and run concurrently with each other
+    and with the rest of the pipeline. `close()` waits for all of them and
+    re-raises the first error. A shallow snapshot of each DataFrame is taken at
+    submission time, so adding or dropping columns on it afterwards is safe, but
+    values must not be modified in place until `close()` returns.
+
+    Parameters
+    ----------
+    - `defaultFormat` : str, optional (default="parquet")
+        Format for tables written without an explicit `fmt`. One of
+        "parquet", "csv" or "xlsx".
+
+    - `maxWorkers` : int, optional (default=4)
+        Number of writer threads. `maxWorkers=0` writes synchronously.
+
+    Example
+    ----------
+    >>> sink = OutputSink(defaultFormat="parquet")
+    >>> sink.write(dfTadsSorted, tadsSortedAddr)  # -> ...-Sorted.parquet
+    >>> sink.write(dfMatchTads_with_VSTlines, tadsMatch_with_VSTlines_Addr, fmt="xlsx")
+    >>> writtenAddrs = sink.close()
+    """
+
+    def __init__(self, defaultFormat="parquet", maxWorkers=4):
+        if defaultFormat not in supportedFormats:
+            raise ValueError(f"Unsupported output format '{defaultFormat}', expected one of {supportedFormats}")
+        self.defaultFormat = defaultFormat
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers) if maxWorkers > 0 else None
+        self.futures = []
+
+    def write(self, df, fileAddr, fmt=None):
+        """
+        Schedule `df` to be written to `fileAddr` (extension replaced by `fmt`).
+
+        Returns the address the table will be written to.
+        """
+        fmt = fmt or self.defaultFormat
+        if fmt not in supportedFormats:
+            raise ValueError(f"Unsupported output format '{fmt}', expected one of {supportedFormats}")
+        outAddr = os.path.splitext(fileAddr)[0] + "." + fmt
+
+        snapshot = df.copy(deep=False)
+        if self.executor is None:
+            self.futures.append(_DoneFuture(write_table(snapshot, outAddr, fmt)))
+        else:
+            self.futures.append(self.executor.submit(write_table, snapshot, outAddr, fmt))
+        return outAddr
+
+    def close(self):
+        """
+        Wait for all scheduled writes and shut the thread pool down.
+
+        Returns the list of written file addresses, in submission order.
+        """
+        try:
+            writtenAddrs = [future.result() for future in self.futures]
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+            self.futures = []
+        return writtenAddrs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Runs on the sink's threads next to the pipeline, so the process's peak RSS says nothing about the write
+@profile_stage(peakRss=False)
+def write_table(df, outAddr, fmt):
+    """
+    Write a single DataFrame to `outAddr` in the given format and return the address written.
+
+    Parquet output falls back to CSV (with a printed note) when pyarrow is not
+    installed or cannot type a column, e.g. an object column mixing strings and
+    integers.
+    """
+    os.makedirs(os.path.dirname(outAddr) or ".", exist_ok=True)
+
+    if fmt == "parquet":
+        if pa is not None:
+            try:
+                df.to_parquet(outAddr, index=False)
+                return outAddr
+            except (pa.ArrowInvalid, pa.ArrowTypeError, ValueError, TypeError) as err:
+                print(f"Could not write {os.path.basename(outAddr)} as Parquet ({err}), writing CSV instead.")
+                if os.path.exists(outAddr):
+                    os.remove(outAddr)
+        outAddr = os.path.splitext(outAddr)[0] + ".csv"
+        fmt = "csv"
+
+    if fmt == "csv":
+        df.to_csv(outAddr, index=False)
+    elif fmt == "xlsx":
+        df.to_excel(outAddr, index=False)
+
+    return outAddr
+
+
+class _DoneFuture:
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+# %%
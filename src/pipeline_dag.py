@@ -0,0 +1,201 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from src.profiling import count_rows, profiler
+
+
+class Stage:
+    """
+    One node of a `PipelineDAG`: `func` called with the values named `inputs`, producing the values named `outputs`.
+
+    Parameters
+    ----------
+    - `name` : str
+        Unique stage name, also the `StageStore` stage name when cached.
+
+    - `func` : callable
+        Called as `func(*[values[name] for name in inputs])`. With a single
+        output it returns that value, with several a tuple in `outputs` order.
+
+    - `inputs`, `outputs` : list of str
+        Names of the values the stage reads and produces.
+
+    - `cache` : bool, optional (default=True)
+        Store the output in the `StageStore` passed to `PipelineDAG.run`, if
+        any. Only stages whose inputs are all DataFrames or Series are cached,
+        since the store keys on their content fingerprints.
+    """
+
+    def __init__(self, name, func, inputs, outputs, cache=True):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.cache = cache
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, inputs={self.inputs}, outputs={self.outputs})"
+
+
+class PipelineDAG:
+    """
+    Pipeline declared as stages with named inputs and outputs, run with independent branches in parallel.
+
+    The dependencies follow from the names: a stage runs as soon as every value
+    it reads has been produced, by an earlier stage or as an initial value passed
+    to `run`. Ready stages are run on a thread pool, so stages of independent
+    branches can overlap, e.g. reading a file with computing. The run can take
+    no less than the slowest chain of dependent stages (see `critical_path`);
+    how close it gets depends on how much of each stage holds the GIL.
+
+    Parameters
+    ----------
+    - `stages` : list of Stage
+
+    Example
+    ----------
+    >>> dag = PipelineDAG([
+    ...     Stage("sort_velo_plants", sort_velo_plants, ["dfVeloP"], ["dfVeloPSorted"]),
+    ...     Stage("eia_filter_velo_plants", eia_filtering, ["dfVeloPSorted"], ["dfVeloPEIA"]),
+    ... ])
+    >>> values = dag.run({"dfVeloP": dfVeloP}, maxWorkers=4)
+    >>> values["dfVeloPEIA"]
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+        names = [stage.name for stage in self.stages]
+        duplicateNames = {name for name in names if names.count(name) > 1}
+        if duplicateNames:
+            raise ValueError(f"Duplicate stage names: {sorted(duplicateNames)}")
+
+        self.producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"'{output}' is produced by both '{self.producers[output].name}' and '{stage.name}'")
+                self.producers[output] = stage
+
+        self.order = self._topological_order()
+
+    def initial_inputs(self):
+        """
+        Names of the values no stage produces, which `run` has to be given.
+        """
+        return sorted({name for stage in self.stages for name in stage.inputs if name not in self.producers})
+
+    def critical_path(self, seconds):
+        """
+        Longest chain of dependent stages, given the `seconds` each stage took (e.g. from `run`).
+
+        Returns (total seconds, list of stage names).
+        """
+        longest = {}
+        for stage in self.order:
+            upstream = [longest[self.producers[name].name] for name in stage.inputs if name in self.producers]
+            best = max(upstream, key=lambda entry: entry[0], default=(0.0, []))
+            longest[stage.name] = (best[0] + seconds.get(stage.name, 0.0), best[1] + [stage.name])
+        return max(longest.values(), key=lambda entry: entry[0], default=(0.0, []))
+
+    def run(self, initial, maxWorkers=4, stageStore=None, onOutput=None):
+        """
+        Run all stages and return every value, initial and produced, by name.
+
+        Parameters
+        ----------
+        - `initial` : dict
+            Values of `initial_inputs()`, by name.
+
+        - `maxWorkers` : int, optional (default=4)
+            Stages run at the same time. 1 runs them one after the other in dependency order.
+
+        - `stageStore` : src.stage_store.StageStore, optional (default=None)
+            Store for the outputs of cacheable stages, so unchanged stages are skipped on reruns.
+
+        - `onOutput` : callable, optional (default=None)
+            Called as `onOutput(name, value)` in the calling thread for every
+            produced value as soon as it is available, e.g. to hand tables to an
+            `OutputSink` while later stages still run.
+
+        Returns
+        ----------
+        `values` : dict
+            The run's values, plus `self.seconds`, the wall time of every stage.
+        """
+        missing = [name for name in self.initial_inputs() if name not in initial]
+        if missing:
+            raise ValueError(f"Missing initial inputs: {missing}")
+
+        values = dict(initial)
+        self.seconds = {}
+        pending = list(self.order)
+
+        def ready(stage):
+            return all(name in values for name in stage.inputs)
+
+        def collect(stage, result):
+            result, seconds = result
+            self.seconds[stage.name] = seconds
+            results = (result,) if len(stage.outputs) == 1 else tuple(result)
+            for name, value in zip(stage.outputs, results):
+                values[name] = value
+                if onOutput is not None:
+                    onOutput(name, value)
+
+        if maxWorkers <= 1:
+            for stage in pending:
+                collect(stage, self._run_stage(stage, [values[name] for name in stage.inputs], stageStore))
+            return values
+
+        with ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="stage") as executor:
+            running = {}
+            while pending or running:
+                for stage in [stage for stage in pending if ready(stage)]:
+                    pending.remove(stage)
+                    args = [values[name] for name in stage.inputs]
+                    running[executor.submit(self._run_stage, stage, args, stageStore)] = stage
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(running.pop(future), future.result())
+
+        return values
+
+    def _run_stage(self, stage, args, stageStore):
+        with profiler.stage(stage.name, rowsIn=count_rows(args)) as record:
+            cacheable = stage.cache and stageStore is not None and all(isinstance(arg, (pd.DataFrame, pd.Series)) for arg in args)
+            if cacheable:
+                result = stageStore.run(stage.name, stage.func, *args)
+            else:
+                result = stage.func(*args)
+            record["rowsOut"] = count_rows(result)
+        return result, record["seconds"]
+
+    def _topological_order(self):
+        order = []
+        done = set()
+        visiting = set()
+
+        def visit(stage):
+            if stage.name in done:
+                return
+            if stage.name in visiting:
+                raise ValueError(f"Cycle through stage '{stage.name}'")
+            visiting.add(stage.name)
+            for name in stage.inputs:
+                if name in self.producers:
+                    visit(self.producers[name])
+            visiting.discard(stage.name)
+            done.add(stage.name)
+            order.append(stage)
+
+        for stage in self.stages:
+            visit(stage)
+        return order
+
+
+# %%
@@ -0,0 +1,227 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import os
+import time
+
+import pandas as pd
+
+from src.excel_loader import excel_reader
+from src.housekeeping_gads import (
+    computeCombinedMWRating,
+    eia_filtering,
+    filter_states,
+    match_by_eia_code_and_add_recid,
+    match_by_plant_name_and_add_eia_recid,
+    match_units_by_eia_and_unit_id,
+    sort_and_reorder_columns,
+)
+from src.input_cache import csv_columns, read_cached, read_csv_cached
+from src.match_report import match_report
+from src.output_sink import OutputSink
+from src.pipeline_dag import PipelineDAG, Stage
+from src.profiling import profiler
+from src.schema import load_columns, to_shared_categoricals, use_copy_on_write
+from src.stage_store import StageStore
+
+components1 = "genUnits"
+components2 = "genPlants"
+ext = ".xlsx"
+
+
+def load_gads_inventory(rawDataFolder, cacheFolder):
+    """
+    Load the national GADS inventory once so that it can be shared by every location.
+
+    Only the columns declared in `src.schema.stageColumns` are parsed.
+
+    Returns
+    ----------
+    `dfGadsNational` : pandas.DataFrame
+    """
+    use_copy_on_write()
+    gadsFileAddr = os.path.join(rawDataFolder, "GADS inventory 2024.csv")
+    dfGadsNational = read_csv_cached(gadsFileAddr, cacheFolder, usecols=load_columns("gads", csv_columns(gadsFileAddr)))
+    dfGadsNational = to_shared_categoricals({"gads": dfGadsNational})["gads"]
+    print(f"Size of GADS db before filtering: {dfGadsNational.shape[0]}, {dfGadsNational.shape[1]}")
+
+    return dfGadsNational
+
+
+def gads_location_dag():
+    """
+    The per-location GADS stages as a `PipelineDAG`.
+
+    The Velocity Suite plants branch (sort, EIA filter, GADS state filter, plant
+    match) and the Velocity Suite units branch (load, shared categoricals, plant
+    name match, EIA filter) only meet in the final unit match, so they run
+    concurrently. Initial values are 'dfGadsNational', 'veloFileGenPlantsAddr',
+    'veloFileGenUnitsAddr', 'cacheFolder' and 'xlsxStreaming' (see
+    `src.excel_loader.excel_reader`).
+    """
+
+    def load_velo_export(veloFileAddr, cacheFolder, xlsxStreaming):
+        reader, readKwargs = excel_reader(xlsxStreaming)
+        return read_cached(veloFileAddr, cacheFolder, reader, **readKwargs)
+
+    def sort_velo_plants(dfVeloP):
+        return dfVeloP.sort_values(by=["Plant Name", "Plant Operator Name"])
+
+    def filter_gads_states(dfGadsNational, dfVeloPEIA):
+        dfGadsFilt = filter_states(dfGadsNational, set(dfVeloPEIA["State"]))
+        return sort_and_reorder_columns(dfGadsFilt, sort_columns=["UnitName", "UtilityName"])
+
+    def share_plant_names(dfVeloP, dfVeloU):
+        sharedFrames = to_shared_categoricals({"veloPlants": dfVeloP, "veloUnits": dfVeloU})
+        return sharedFrames["veloPlants"], sharedFrames["veloUnits"]
+
+    def sort_velo_units(dfVeloU):
+        return sort_and_reorder_columns(dfVeloU, sort_columns=["Plant Name", "Unit"])
+
+    def match_gads_with_velo(dfVelo, dfGadsFilt):
+        return match_by_eia_code_and_add_recid(dfVelo, dfGadsFilt, getMatchVeloP=True)
+
+    def report_matches(dfVeloPEIA, dfMatchGads_with_VSPlants, dfMatchGads_with_VSUnits, dfMatchVeloUEIA, dfMatchGads_with_VSUnitIds):
+        return pd.concat(
+            [
+                match_report(dfVeloPEIA, dfMatchGads_with_VSPlants, ["Rec_ID"], ["State"], name="plants"),
+                match_report(dfVeloPEIA, dfMatchGads_with_VSUnits, ["Rec_ID"], ["State"], name="plants via units"),
+                match_report(dfMatchVeloUEIA, dfMatchGads_with_VSUnitIds, ["Rec_ID", "Unit"], name="units"),
+            ],
+            ignore_index=True,
+        )
+
+    def eia_filter(columnName):
+        return lambda df: eia_filtering(df, column_name=columnName)
+
+    return PipelineDAG(
+        [
+            # Velocity Suite Gen Plants and the GADS units in the states of the location
+            Stage("load_velo_plants", load_velo_export, ["veloFileGenPlantsAddr", "cacheFolder", "xlsxStreaming"], ["dfVeloP"]),
+            Stage("sort_velo_plants", sort_velo_plants, ["dfVeloP"], ["dfVeloPSorted"]),
+            Stage("eia_filter_velo_plants", eia_filter("EIA ID"), ["dfVeloPSorted"], ["dfVeloPEIA"]),
+            # Not cached: its key would hash the whole national inventory for every location
+            Stage("filter_gads_states", filter_gads_states, ["dfGadsNational", "dfVeloPEIA"], ["dfGadsFilt"], cache=False),
+            Stage("eia_filter_gads", eia_filter("EIACode"), ["dfGadsFilt"], ["dfGadsFiltEIA"]),
+            Stage("match_gads_plants", match_gads_with_velo, ["dfVeloPEIA", "dfGadsFilt"], ["dfMatchGads_with_VSPlants", "dfMatchVSPlants_with_Gads"]),
+            # Velocity Suite Gen Units, which get EIA IDs and Rec IDs from the plants by Plant Name
+            Stage("load_velo_units", load_velo_export, ["veloFileGenUnitsAddr", "cacheFolder", "xlsxStreaming"], ["dfVeloU"]),
+            Stage("share_plant_names", share_plant_names, ["dfVeloP", "dfVeloU"], ["dfVeloPCat", "dfVeloUCat"]),
+            Stage("sort_velo_units", sort_velo_units, ["dfVeloUCat"], ["dfVeloUSorted"]),
+            Stage("match_units_to_plants", match_by_plant_name_and_add_eia_recid, ["dfVeloPCat", "dfVeloUSorted"], ["dfMatchVeloUAllEIA"]),
+            Stage("eia_filter_velo_units", eia_filter("EIA ID"), ["dfMatchVeloUAllEIA"], ["dfMatchVeloUEIA"]),
+            # GADS units <-> Velocity Suite units
+            Stage("match_gads_units", match_gads_with_velo, ["dfMatchVeloUEIA", "dfGadsFilt"], ["dfMatchGads_with_VSUnits", "dfMatchVSUnits_with_Gads"]),
+            Stage("match_gads_unit_ids", match_units_by_eia_and_unit_id, ["dfMatchVeloUEIA", "dfGadsFilt"], ["dfMatchGads_with_VSUnitIds"]),
+            # Match coverage (see src/match_report.py)
+            Stage(
+                "report_matches",
+                report_matches,
+                ["dfVeloPEIA", "dfMatchGads_with_VSPlants", "dfMatchGads_with_VSUnits", "dfMatchVeloUEIA", "dfMatchGads_with_VSUnitIds"],
+                ["dfMatchReport"],
+                cache=False,
+            ),
+        ]
+    )
+
+
+# Written tables of the GADS DAG: value name -> (prefix, components, suffix, format or None for the sink's default)
+gadsOutputFiles = {
+    "dfVeloPSorted": ("dfVelo", components2, "Sorted", None),
+    "dfVeloPEIA": ("dfVelo", components2, "validEIA", None),
+    "dfGadsFilt": ("dfGads", components1, "filteredStates", None),
+    "dfGadsFiltEIA": ("dfGads", components1, "filteredStates-validEIA", None),
+    "dfMatchGads_with_VSPlants": ("dfGads", components1, "Matched-with-VSPlants", "xlsx"),
+    "dfMatchVSPlants_with_Gads": ("dfVelo", components2, "Matched-with-Gads", "xlsx"),
+    "dfVeloUSorted": ("dfVelo", components1, "Sorted", None),
+    "dfMatchVeloUAllEIA": ("dfVelo", components1, "Matched-with-VSPlants-allEIA", None),
+    "dfMatchVeloUEIA": ("dfVelo", components1, "Matched-with-VSPlants-validEIA", None),
+    "dfMatchGads_with_VSUnits": ("dfGads", components1, "Matched-with-VSUnits", "xlsx"),
+    "dfMatchVSUnits_with_Gads": ("dfVelo", components1, "Matched-with-Gads", "xlsx"),
+    "dfMatchGads_with_VSUnitIds": ("dfGads", components1, "Matched-with-VSUnits-unitLevel", "xlsx"),
+}
+
+
+def run_gads_location(location, dfGadsNational, rawDataFolder, processedDataFolder, cacheFolder, useStageStore=False, stageWorkers=4, xlsxStreaming=False):
+    """
+    Run the per-location GADS stages of `main_gads.py` for one weather station.
+
+    Loads the Velocity Suite plant and unit exports for `location`, filters the
+    national GADS inventory to the location's states, matches GADS units with
+    Velocity Suite plants and units on EIA codes, and with units also on unit
+    identifiers, and writes all tables under `processedDataFolder/<location>/`. The stages are run by `gads_location_dag`,
+    and every table is handed to the output sink as soon as it is produced.
+
+    Parameters
+    ----------
+    - `location` : str
+        The weather station, e.g. "chicago-ohare".
+
+    - `dfGadsNational` : pandas.DataFrame
+        Output of `load_gads_inventory`. Only read, never modified.
+
+    - `rawDataFolder`, `processedDataFolder`, `cacheFolder` : str
+        Folders of the generator_data category.
+
+    - `useStageStore` : bool, optional (default=False)
+        If True, stages whose input tables are unchanged since the last run load
+        their stored output instead of running (see `src.stage_store.StageStore`).
+
+    - `stageWorkers` : int, optional (default=4)
+        Stages run at the same time. 1 runs them one after the other.
+
+    - `xlsxStreaming` : bool, optional (default=False)
+        Parse the Velocity Suite exports with `src.excel_loader.read_xlsx_streaming`
+        instead of `pd.read_excel`, cached separately.
+
+    Returns
+    ----------
+    `summary` : dict
+        Row counts of the main tables for this location, and the critical path
+        of the stage graph in seconds (its stages are in the run report). 'veloPlantsAtLeast75MW' counts, for
+        reference only, the plants with a valid EIA ID that are large enough to
+        be in GADS (its cutoff is 75 MW).
+    """
+    locationFolder = os.path.join(processedDataFolder, location)
+    profiler.reset()
+    stageStore = StageStore(os.path.join(cacheFolder, "stages", location)) if useStageStore else None
+    outputSink = OutputSink(defaultFormat="parquet", maxWorkers=2)
+
+    def write_output(name, df):
+        if name == "dfMatchReport":
+            outputSink.write(df, os.path.join(locationFolder, "matchReport-" + location + ".csv"), fmt="csv")
+        elif name in gadsOutputFiles:
+            prefix, components, suffix, fmt = gadsOutputFiles[name]
+            outputSink.write(df, os.path.join(locationFolder, prefix + "-" + components + "-" + location + "-" + suffix + ext), fmt=fmt)
+
+    dag = gads_location_dag()
+    values = dag.run(
+        {
+            "dfGadsNational": dfGadsNational,
+            "veloFileGenPlantsAddr": os.path.join(rawDataFolder, components2 + "-near-" + location + "-raw" + ext),
+            "veloFileGenUnitsAddr": os.path.join(rawDataFolder, components1 + "-near-" + location + "-raw" + ext),
+            "cacheFolder": cacheFolder,
+            "xlsxStreaming": xlsxStreaming,
+        },
+        maxWorkers=stageWorkers,
+        stageStore=stageStore,
+        onOutput=write_output,
+    )
+    criticalSeconds, criticalPath = dag.critical_path(dag.seconds)
+
+    outputSink.close()
+    profiler.write_report(os.path.join(locationFolder, "runReport-" + location + ".json"), location=location, criticalPath=criticalPath)
+
+    return {
+        "location": location,
+        "seconds": round(time.time() - profiler.startedAt, 2),
+        "criticalPathSeconds": round(criticalSeconds, 2),
+        "veloPlantsAtLeast75MW": int((computeCombinedMWRating(values["dfVeloPEIA"])["Combined Cap MW"] >= 75).sum()),
+        "gadsFilteredStates": len(values["dfGadsFilt"]),
+        "gadsMatchedVSPlants": len(values["dfMatchGads_with_VSPlants"]),
+        "uniquePlantsMatched": int(values["dfMatchReport"].loc[0, "matched"]),
+        "gadsMatchedVSUnits": len(values["dfMatchGads_with_VSUnits"]),
+        "gadsMatchedVSUnitIds": len(values["dfMatchGads_with_VSUnitIds"]),
+    }
+
+
+# %%
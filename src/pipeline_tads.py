@@ -0,0 +1,345 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+from src.company_aliases import normalize_company_names
+from src.housekeeping_tads import (
+    get_latest_entries,
+    get_matched_entries,
+    get_reduced_df,
+    sort_and_shift_columns,
+    sort_and_shift_columns_dfVelo,
+)
+from src.fuzzy_matching import propose_fuzzy_matches
+from src.input_cache import content_hash, csv_columns, read_csv_cached, read_excel_cached
+from src.mapinfo_reader import read_mapinfo_layer, read_velo_layer, veloColumnNames
+from src.match_report import match_report
+from src.output_sink import OutputSink
+from src.profiling import profiler
+from src.schema import load_columns, to_shared_categoricals, use_copy_on_write
+from src.spatial_index import SpatialIndex, read_weather_stations, select_near_locations
+from src.stage_store import StageStore, code_version
+from src.streaming_reader import read_csv_filtered
+
+components1 = "tlines"
+ext = ".xlsx"
+
+
+def map_company_names_velo2tads(companyNamesVelo, location, tadsCompanyNames=None):
+    """
+    Rename Velocity Suite company names to the exact strings used in TADS for a location.
+
+    The renames come from the alias table `src/company_aliases.csv` (see
+    `src.company_aliases`), which holds general aliases and location-specific
+    ones, so no location needs code of its own.
+
+    A Velocity Suite name without an alias row is kept as it is and usually
+    names no TADS company, so that company's lines find no TADS lines. With
+    `tadsCompanyNames`, these names are left out of the filter and returned
+    (and printed) as unresolved, so the caller can report them; the filter
+    keeps the names that resolve. Add the missing rows to the alias table to
+    match their lines.
+
+    Parameters
+    ----------
+    - `companyNamesVelo` : set
+        Company names found in the Velocity Suite tlines export for `location`.
+
+    - `location` : str
+        The weather station the export was made for, e.g. "chicago-ohare".
+
+    - `tadsCompanyNames` : array-like, optional (default=None)
+        The company names in TADS, e.g. `dfTads0["CompanyName"].unique()`.
+
+    Returns
+    ----------
+    `companyNamesVelo2Tads`, `unresolvedCompanies` : set, list
+        The renamed company names that TADS should be filtered to, and the
+        Velocity Suite names (sorted) that match no TADS company. The latter is
+        empty without `tadsCompanyNames`.
+    """
+    companyNamesVelo = pd.Series(sorted(companyNamesVelo, key=str), dtype=object)
+    companyNamesTads = normalize_company_names(companyNamesVelo, location)
+
+    if tadsCompanyNames is None:
+        return set(companyNamesTads), []
+
+    isUnknown = ~companyNamesTads.isin(set(tadsCompanyNames)).to_numpy()
+    unresolvedCompanies = companyNamesVelo[isUnknown].tolist()
+    if unresolvedCompanies:
+        print(
+            f"Velocity Suite companies near {location} without a TADS company (add them to src/company_aliases.csv): "
+            f"{unresolvedCompanies}. Their lines are not matched."
+        )
+    return set(companyNamesTads[~isUnknown]), unresolvedCompanies
+
+
+def filter_velo_tlines(dfVeloTlines0):
+    """
+    The Velocity Suite tlines matched with TADS, sorted by 'From Sub' and 'To Sub' (see `sort_and_shift_columns_dfVelo`).
+
+    Lines below 100 kV and lines not in service ('Proposed' other than "In Service") are dropped.
+    """
+    dfVeloTlines = dfVeloTlines0[dfVeloTlines0["Voltage kV"] >= 100]
+    dfVeloTlines = dfVeloTlines[dfVeloTlines["Proposed"] == "In Service"]
+    return sort_and_shift_columns_dfVelo(dfVeloTlines)
+
+
+def load_tads_inventory(rawDataFolder, cacheFolder, streaming=False):
+    """
+    Load the national TADS inventory and run the location-independent preprocessing once.
+
+    Lines below 100 kV are dropped. The inventory is not sorted:
+    `get_latest_entries` does not need sorted input, and each location sorts
+    only the tables it writes. Only the columns declared in
+    `src.schema.stageColumns` are parsed.
+
+    With `streaming=True` the CSV is read chunk by chunk and the voltage-class
+    filter is applied to each chunk (see `src.streaming_reader.read_csv_filtered`),
+    so the full inventory is never held in memory. The input cache is bypassed
+    in that mode.
+
+    Returns
+    ----------
+    `dfTadsNational` : pandas.DataFrame
+    """
+    use_copy_on_write()
+    tadsFileAddr = os.path.join(rawDataFolder, "TADS 2024 AC Inventory.csv")
+
+    tadsColumns = load_columns("tads", csv_columns(tadsFileAddr))
+
+    if streaming:
+        dfTads = read_csv_filtered(tadsFileAddr, drop={"VoltageClassCodeName": {"0-99 kV"}}, usecols=tadsColumns)
+    else:
+        dfTads0 = read_csv_cached(tadsFileAddr, cacheFolder, usecols=tadsColumns)
+        print(f"Size of TADS db before filtering: {dfTads0.shape[0]}, {dfTads0.shape[1]}")
+
+        voltageClassesAllowedTads = set(dfTads0["VoltageClassCodeName"])
+        voltageClassesAllowedTads.discard("0-99 kV")
+        dfTads = dfTads0[dfTads0["VoltageClassCodeName"].isin(voltageClassesAllowedTads)]
+
+    # Bus, company and voltage-class names as categoricals (see src/schema.py)
+    return to_shared_categoricals({"tads": dfTads})["tads"]
+
+
+def tads_inventory_fingerprint(dfTadsNational, rawDataFolder, cacheFolder):
+    """
+    `StageStore` fingerprint of the output of `load_tads_inventory`, without hashing its rows.
+
+    Hashing the rows of the national inventory costs about as much as the
+    per-location stages a rerun would skip. The fingerprint is built from the
+    content hash of the TADS file instead (see `src.input_cache.content_hash`,
+    which rehashes it only after it changed), the code of `load_tads_inventory`
+    and the modules it uses, and the length, columns and dtypes of the frame.
+    """
+    tadsFileAddr = os.path.join(rawDataFolder, "TADS 2024 AC Inventory.csv")
+    digest = hashlib.sha256(content_hash(tadsFileAddr, cacheFolder).encode())
+    digest.update(code_version(load_tads_inventory).encode())
+    digest.update(json.dumps([len(dfTadsNational)] + [[str(col), str(dtype)] for col, dtype in dfTadsNational.dtypes.items()]).encode())
+    return digest.hexdigest()
+
+
+def select_tads_lines(dfTadsNational, companies=None):
+    """
+    The TADS lines of `companies` (all if None) and the latest entry of each of their bus pairs.
+
+    Both are sorted and have the bus columns first (see `sort_and_shift_columns`);
+    the latest entries are taken from the unsorted lines.
+
+    Returns
+    ----------
+    `dfTadsSorted`, `dfTadsLatest` : pandas.DataFrame, pandas.DataFrame
+    """
+    if companies is None:
+        dfTads = dfTadsNational
+    else:
+        dfTads = dfTadsNational[dfTadsNational["CompanyName"].isin(companies)]
+    dfTadsLatest = sort_and_shift_columns(get_latest_entries(dfTads))
+    return sort_and_shift_columns(dfTads), dfTadsLatest
+
+
+def select_velo_tlines(tlinesLayerAddr, stationsLayerAddr, locations, radiusMiles=50):
+    """
+    The Velocity Suite tlines within `radiusMiles` of every location's weather station, selected from one MapInfo layer.
+
+    Replaces the per-location `tlines-near-<location>-raw.xlsx` exports: the
+    tlines layer is read once, indexed with `SpatialIndex` and queried for all
+    stations of `stationsLayerAddr` (see `read_weather_stations`) in one pass.
+    A line is selected when any part of it is within the radius, as in the
+    exports. Columns are renamed as in `read_velo_layer`.
+
+    Parameters
+    ----------
+    - `tlinesLayerAddr` : str
+        Velocity Suite electric transmission lines layer (.TAB) covering all locations.
+
+    - `stationsLayerAddr` : str
+        Velocity Suite weather stations layer (.TAB).
+
+    - `locations` : list of str
+        Locations to select for, e.g. ["chicago-ohare"]. Locations without a
+        station in `stationsLayerAddr` are reported and left out.
+
+    - `radiusMiles` : float, optional (default=50)
+
+    Returns
+    ----------
+    `veloTlinesExtracts` : dict
+        Maps every location with a station to its tlines, to be passed as
+        `veloTlinesLayers` to `run_tads_location`.
+    """
+    dfTlines, dfVertices = read_mapinfo_layer(tlinesLayerAddr)
+    dfTlines = dfTlines.rename(columns=veloColumnNames)
+    spatialIndex = SpatialIndex(
+        dfTlines.loc[dfVertices["row"], "Rec_ID"].to_numpy(), dfVertices["lon"], dfVertices["lat"], dfVertices["part"]
+    )
+
+    dfStations = read_weather_stations(stationsLayerAddr)
+    stationLocations = set(dfStations["location"])
+    missing = [location for location in locations if location not in stationLocations]
+    if missing:
+        print(f"No weather station in {stationsLayerAddr} for {missing}.")
+    dfStations = dfStations[dfStations["location"].isin(locations)].drop_duplicates(subset="location")
+
+    return select_near_locations(dfTlines, spatialIndex, dfStations, radiusMiles=radiusMiles)
+
+
+def run_tads_location(location, dfTadsNational, rawDataFolder, processedDataFolder, cacheFolder, useStageStore=False, veloTlinesLayers=None):
+    """
+    Run the per-location TADS stages of `main_tads.py` for one weather station.
+
+    Loads the Velocity Suite tlines export for `location`, filters it, restricts the
+    preprocessed national TADS inventory to the location's companies, keeps the
+    latest reported year per bus pair, matches the two and writes all tables under
+    `processedDataFolder/<location>/`.
+
+    Parameters
+    ----------
+    - `location` : str
+        The weather station, e.g. "chicago-ohare".
+
+    - `dfTadsNational` : pandas.DataFrame
+        Output of `load_tads_inventory`. Only read, never modified.
+
+    - `rawDataFolder`, `processedDataFolder`, `cacheFolder` : str
+        Folders of the transmission_data category.
+
+    - `useStageStore` : bool, optional (default=False)
+        If True, the TADS line selection (`select_tads_lines`), the match and the
+        fuzzy proposals load their stored output when their inputs are unchanged
+        since the last run for this location (see `src.stage_store.StageStore`).
+        The national inventory is identified by `tads_inventory_fingerprint`, so
+        no stage hashes its rows.
+
+    - `veloTlinesLayers` : dict, optional (default=None)
+        Maps locations to the Velocity Suite tlines to use instead of
+        `tlines-near-<location>-raw.xlsx`: the path of a MapInfo tlines layer
+        (.TAB) read with `read_velo_layer`, e.g.
+        {"chicago-ohare": "queries/tlines-near-chicago-ohare-raw_Layers/tlinesnearohareraw.TAB"},
+        or the table itself, e.g. from `select_velo_tlines`. Locations not in
+        it read the xlsx export.
+
+    Returns
+    ----------
+    `summary` : dict
+        Row counts of the main tables for this location, and the number of
+        unresolved companies (`map_company_names_velo2tads`), whose names are in
+        the run report.
+    """
+    locationFolder = os.path.join(processedDataFolder, location)
+    profiler.reset()
+    stageStore = StageStore(os.path.join(cacheFolder, "stages", location)) if useStageStore else None
+    outputSink = OutputSink(defaultFormat="parquet", maxWorkers=2)
+
+    if veloTlinesLayers is not None and location in veloTlinesLayers:
+        dfVeloTlines0 = veloTlinesLayers[location]
+        if isinstance(dfVeloTlines0, str):
+            dfVeloTlines0 = read_velo_layer(dfVeloTlines0)
+    else:
+        filenameVeloTlines = components1 + "-near-" + location + "-raw" + ext
+        veloFileTlinesAddr = os.path.join(rawDataFolder, filenameVeloTlines)
+        dfVeloTlines0 = read_excel_cached(veloFileTlinesAddr, cacheFolder, engine="openpyxl")
+
+    dfVeloTlinesSorted = filter_velo_tlines(dfVeloTlines0)
+    outputSink.write(
+        dfVeloTlinesSorted,
+        os.path.join(locationFolder, "dfVelo-" + components1 + "-" + location + "-Sorted" + ext),
+    )
+
+    def run_stage(stageName, func, *frames, **params):
+        if stageStore is None:
+            return func(*frames, **params)
+        return stageStore.run(stageName, func, *frames, **params)
+
+    if stageStore is not None:
+        stageStore.remember(dfTadsNational, tads_inventory_fingerprint(dfTadsNational, rawDataFolder, cacheFolder))
+
+    companyNamesVelo2Tads, unresolvedCompanies = map_company_names_velo2tads(
+        set(dfVeloTlinesSorted["Company Name"]), location, tadsCompanyNames=dfTadsNational["CompanyName"].unique()
+    )
+    dfTadsSorted, dfTadsLatest = run_stage("select_tads_lines", select_tads_lines, dfTadsNational, companies=sorted(companyNamesVelo2Tads))
+    outputSink.write(
+        dfTadsSorted,
+        os.path.join(locationFolder, "dfTads-" + components1 + "-" + location + "-Sorted" + ext),
+    )
+    outputSink.write(
+        dfTadsLatest,
+        os.path.join(locationFolder, "dfTads-" + components1 + "-" + location + "-Latest" + ext),
+    )
+
+    dfMatchTads_with_VSTlines, dfMatchVSTlines_with_Tads = run_stage(
+        "get_matched_entries", get_matched_entries, dfVeloTlinesSorted, dfTadsLatest, getMatchVeloTlines=True
+    )
+    outputSink.write(
+        dfMatchTads_with_VSTlines,
+        os.path.join(locationFolder, "dfTads-" + components1 + "-" + location + "-Matched-with-VSTlines" + ext),
+        fmt="xlsx",
+    )
+    outputSink.write(
+        dfMatchVSTlines_with_Tads,
+        os.path.join(locationFolder, "dfVelo-" + components1 + "-" + location + "-Matched-with-Tads" + ext),
+        fmt="xlsx",
+    )
+
+    dfMatchReport = match_report(dfVeloTlinesSorted, dfMatchTads_with_VSTlines, ["Rec_ID"], ["Company Name", "Voltage kV"], name="tlines")
+    outputSink.write(dfMatchReport, os.path.join(locationFolder, "matchReport-" + location + ".csv"), fmt="csv")
+
+    dfVeloTlinesUnmatched = dfVeloTlinesSorted[~dfVeloTlinesSorted.index.isin(dfMatchVSTlines_with_Tads.index)]
+    dfFuzzyProposals = run_stage("propose_fuzzy_matches", propose_fuzzy_matches, dfVeloTlinesUnmatched, dfTadsLatest)
+    outputSink.write(
+        dfFuzzyProposals,
+        os.path.join(locationFolder, "dfVelo-" + components1 + "-" + location + "-Unmatched-FuzzyProposals" + ext),
+        fmt="xlsx",
+    )
+
+    dfMatchTads_with_VSTlines_Reduced = get_reduced_df(dfMatchTads_with_VSTlines)
+    outputSink.write(
+        dfMatchTads_with_VSTlines_Reduced,
+        os.path.join(locationFolder, "dfTads-" + components1 + "-" + location + "-Matched-with-VSTlines-Reduced" + ext),
+        fmt="xlsx",
+    )
+
+    outputSink.close()
+    profiler.write_report(
+        os.path.join(locationFolder, "runReport-" + location + ".json"), location=location, unresolvedCompanies=unresolvedCompanies
+    )
+
+    return {
+        "location": location,
+        "seconds": round(time.time() - profiler.startedAt, 2),
+        "veloTlines": len(dfVeloTlinesSorted),
+        "unresolvedCompanies": len(unresolvedCompanies),
+        "tadsLatest": len(dfTadsLatest),
+        "tadsMatched": len(dfMatchTads_with_VSTlines),
+        "veloMatched": len(dfMatchVSTlines_with_Tads),
+        "veloMatchRate": float(dfMatchReport.loc[0, "matchRate"]),
+        "veloFuzzyProposed": dfFuzzyProposals["Rec_ID"].nunique(),
+    }
+
+
+# %%
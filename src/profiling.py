@@ -0,0 +1,194 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class StageProfiler:
+    """
+    Records wall time, peak RSS and rows in/out of pipeline stages, and writes them as a run report.
+
+    Stages are timed with the `stage` context manager or the `profile` decorator
+    and may be nested; every record names its parent stage. Peak RSS is the
+    process's high-water mark, so 'peakRssDeltaMB' is how much a stage raised
+    it: 0 for a stage that stayed below an earlier peak. It is shared by all
+    threads, while times and nesting are tracked per thread, so a stage run on
+    a pool thread next to other work should be recorded with `peakRss=False`.
+    Peak RSS is not available on Windows. Where it is not recorded it is
+    reported as None.
+
+    Example
+    ----------
+    >>> with profiler.stage("filter voltage", rowsIn=len(dfTads0)) as record:
+    ...     dfTads = dfTads0[dfTads0["VoltageClassCodeName"] != "0-99 kV"]
+    ...     record["rowsOut"] = len(dfTads)
+    >>> profiler.write_report("runReport-chicago-ohare.json", location="chicago-ohare")
+    """
+
+    def __init__(self):
+        self.records = []
+        self.startedAt = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def reset(self):
+        """
+        Forget all records, e.g. at the start of a new location in a batch worker.
+        """
+        with self._lock:
+            self.records = []
+            self.startedAt = time.time()
+
+    def reset_above(self, maxRecords):
+        """
+        `reset` if more than `maxRecords` records are held, checked and done under
+        one lock, so concurrent callers (e.g. request threads of a long-running
+        service) drop the records once. Returns True if they were dropped.
+        """
+        with self._lock:
+            if len(self.records) <= maxRecords:
+                return False
+            self.records = []
+            self.startedAt = time.time()
+            return True
+
+    @contextlib.contextmanager
+    def stage(self, name, rowsIn=None, peakRss=True):
+        """
+        Context manager timing the enclosed block as stage `name`.
+
+        Yields the stage's record (a dict), in which 'rowsOut' can be set. With
+        `peakRss=False` only time and rows are recorded, e.g. for a stage on a
+        pool thread whose RSS increase could come from any other thread.
+        """
+        stack = self._stack()
+        record = {
+            "stage": name,
+            "parent": stack[-1]["stage"] if stack else None,
+            "thread": threading.current_thread().name,
+            "rowsIn": rowsIn,
+            "rowsOut": None,
+        }
+        stack.append(record)
+        peakBefore = _peak_rss_mb() if peakRss else None
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            peakAfter = _peak_rss_mb() if peakRss else None
+            record["peakRssMB"] = peakAfter
+            record["peakRssDeltaMB"] = None if peakAfter is None else peakAfter - peakBefore
+            stack.pop()
+            with self._lock:
+                self.records.append(record)
+
+    def profile(self, func=None, *, name=None, peakRss=True):
+        """
+        Decorator timing every call of a function as a stage named after it.
+
+        Rows in are the total rows of the DataFrame and Series arguments, rows out
+        those of the returned DataFrame(s). Can be used bare (`@profile`) or with
+        a stage name and `peakRss` (see `stage`), e.g. `@profile(peakRss=False)`.
+        """
+        if func is None:
+            return functools.partial(self.profile, name=name, peakRss=peakRss)
+
+        stageName = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(stageName, rowsIn=count_rows(list(args) + list(kwargs.values())), peakRss=peakRss) as record:
+                result = func(*args, **kwargs)
+                record["rowsOut"] = count_rows(result)
+                return result
+
+        return wrapper
+
+    def report(self):
+        """
+        Returns the records as a DataFrame, one row per stage call in completion order.
+        """
+        with self._lock:
+            return pd.DataFrame(self.records, columns=["stage", "parent", "thread", "rowsIn", "rowsOut", "seconds", "peakRssMB", "peakRssDeltaMB"])
+
+    def summary(self):
+        """
+        Returns total seconds, calls, rows and largest peak RSS increase per stage, slowest first.
+        """
+        dfReport = self.report()
+        return (
+            dfReport.groupby("stage", sort=False)
+            .agg(
+                calls=("seconds", "size"),
+                seconds=("seconds", "sum"),
+                rowsIn=("rowsIn", "sum"),
+                rowsOut=("rowsOut", "sum"),
+                peakRssDeltaMB=("peakRssDeltaMB", "max"),
+            )
+            .sort_values("seconds", ascending=False)
+        )
+
+    def write_report(self, reportAddr, **metadata):
+        """
+        Write the records as JSON to `reportAddr`, together with `metadata`
+        (e.g. the location), the run's start time and total wall time.
+        """
+        with self._lock:
+            records = list(self.records)
+        report = {
+            "startedAt": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.startedAt)),
+            "totalSeconds": time.time() - self.startedAt,
+            "peakRssMB": _peak_rss_mb(),
+            "metadata": metadata,
+            "stages": records,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(reportAddr)), exist_ok=True)
+        with open(reportAddr, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+        return reportAddr
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+
+def count_rows(obj):
+    """
+    Rows of a DataFrame or Series, or total rows of those in a list/tuple; None if there are none.
+    """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    if isinstance(obj, (list, tuple)):
+        counts = [len(item) for item in obj if isinstance(item, (pd.DataFrame, pd.Series))]
+        return sum(counts) if counts else None
+    return None
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return maxRss / (1 << 20) if sys.platform == "darwin" else maxRss / (1 << 10)
+
+
+# Process-wide profiler used by the housekeeping, cache and output modules
+profiler = StageProfiler()
+profile_stage = profiler.profile
+
+
+# %%
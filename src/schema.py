@@ -0,0 +1,198 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import numpy as np
+import pandas as pd
+
+# Columns sharing one category dictionary, as (frame name, column name) pairs.
+# Frame names are the keys of the dict passed to `to_shared_categoricals`.
+sharedCategoryGroups = {
+    "bus": [
+        ("tads", "FromBus"),
+        ("tads", "ToBus"),
+        ("veloTlines", "From Sub"),
+        ("veloTlines", "To Sub"),
+    ],
+    "company": [
+        ("tads", "CompanyName"),
+        ("veloTlines", "Company Name"),
+    ],
+    "voltageClass": [
+        ("tads", "VoltageClassCodeName"),
+    ],
+    "state": [
+        ("gads", "StateName"),
+    ],
+    "utility": [
+        ("gads", "UtilityName"),
+    ],
+    "plant": [
+        ("veloPlants", "Plant Name"),
+        ("veloUnits", "Plant Name"),
+    ],
+}
+
+
+# Columns of the reduced TADS table written by `get_reduced_df`, in output order ('Rec_ID' comes from Velocity Suite)
+reducedTadsColumns = [
+    "ElementIdentifierName",
+    "CompanyName",
+    "RegionCode",
+    "FromBus",
+    "ToBus",
+    "TertiaryBus",
+    "Miles",
+    "BESExemptedFlag",
+    "NumberOfTerminals",
+    "CircuitTypeCode",
+    "VoltageClassCodeName",
+    "ParentCode",
+    "ConductorsPerPhaseCode",
+    "OverheadGroundWireCode",
+    "InsulatorTypeCode",
+    "CableTypeCode",
+    "StructureMaterialCode",
+    "StructureTypeCode",
+    "CircuitsPerStructureCode",
+    "TerrainCode",
+    "ElevationCode",
+    "InServiceDate",
+    "RetirementDate",
+    "Rec_ID",
+]
+
+# Columns every stage reads from the national inventories, as frame name -> stage -> columns.
+# The inventories are loaded with only the union of these (see `load_columns`), so a
+# column a stage starts to use has to be declared here.
+stageColumns = {
+    "tads": {
+        "filter companies and voltage classes": ["CompanyName", "VoltageClassCodeName"],
+        "sort_and_shift_columns": ["FromBus", "ToBus", "ReportingYearNbr"],
+        "get_latest_entries": ["FromBus", "ToBus", "ReportingYearNbr"],
+        "get_reduced_df": reducedTadsColumns,
+    },
+    "gads": {
+        "filter_states": ["StateName"],
+        "eia_filtering": ["EIACode"],
+        "sort_and_reorder_columns": ["UnitName", "UtilityName"],
+        "match_units_by_eia_and_unit_id": ["EIACode", "UnitName"],
+        "company count in main_gads": ["CompanyName"],
+        # Shown in the matched GADS tables
+        "output tables": ["UtilityName", "UnitName", "UnitCode", "EIACode", "StateName", "UnitTypeCodeName", "NetMaximumCapacity", "CommercialDate"],
+    },
+}
+
+
+def use_copy_on_write():
+    """
+    Turn on pandas copy-on-write, which is always on from pandas 3.0.
+
+    The stages add columns with `.assign` and are correct either way; with
+    copy-on-write the frames they pass on (e.g. the national inventory shared
+    by every location) are only copied when written to. Called when a national
+    inventory is loaded, so every entry script gets it.
+    """
+    if int(pd.__version__.split(".")[0]) < 3:
+        pd.set_option("mode.copy_on_write", True)
+
+
+def to_shared_categoricals(frames, groups=None):
+    """
+    Convert repeated string columns to categoricals with one dictionary per group of columns.
+
+    All columns of a group (e.g. TADS 'FromBus'/'ToBus' and Velocity Suite
+    'From Sub'/'To Sub') get the same `pandas.CategoricalDtype`, whose categories
+    are the union of their values as sorted strings. Values are converted with
+    `str()` first (missing values stay missing), so a bus read as the integer 5
+    from Excel and as "5" from the TADS CSV get the same code, as they would
+    compare equal as strings. Equal strings therefore get equal integer codes
+    across frames, so `isin`, merges, group-bys and sorts on these columns run
+    on the codes, and the code order is the string order.
+
+    The input frames are not modified, converted frames are shallow copies.
+
+    Parameters
+    ----------
+    - `frames` : dict
+        Maps frame names used in `groups` (e.g. "tads", "veloTlines", "gads",
+        "veloPlants", "veloUnits") to DataFrames. Frames or columns missing from
+        it are skipped.
+
+    - `groups` : dict, optional (default=`sharedCategoryGroups`)
+        Maps a group name to the list of (frame name, column name) pairs sharing
+        one dictionary.
+
+    Returns
+    ----------
+    `framesCategorical` : dict
+        Same keys as `frames`, with the converted DataFrames.
+
+    Example
+    ----------
+    >>> frames = to_shared_categoricals({"tads": dfTads0, "veloTlines": dfVeloTlines0})
+    >>> dfTads0, dfVeloTlines0 = frames["tads"], frames["veloTlines"]
+    >>> dfTads0["FromBus"].dtype == dfVeloTlines0["From Sub"].dtype
+    True
+    """
+    if groups is None:
+        groups = sharedCategoryGroups
+
+    framesCategorical = {name: df.copy(deep=False) for name, df in frames.items()}
+
+    for members in groups.values():
+        members = [
+            (frameName, col)
+            for frameName, col in members
+            if frameName in framesCategorical and col in framesCategorical[frameName].columns
+        ]
+        if not members:
+            continue
+
+        # Codes of every column over its distinct values, converted to strings
+        factorized = {}
+        values = set()
+        for frameName, col in members:
+            codes, uniques = pd.factorize(framesCategorical[frameName][col])
+            uniques = pd.Index([str(value) for value in uniques], dtype=object)
+            factorized[frameName, col] = (codes, uniques)
+            values.update(uniques)
+
+        sharedDtype = pd.CategoricalDtype(categories=sorted(values))
+        for (frameName, col), (codes, uniques) in factorized.items():
+            positions = sharedDtype.categories.get_indexer(uniques)
+            sharedCodes = np.where(codes >= 0, positions[codes] if len(positions) else -1, -1)
+            framesCategorical[frameName][col] = pd.Categorical.from_codes(sharedCodes, dtype=sharedDtype)
+
+    return framesCategorical
+
+
+def share_categories(df1, cols1, df2, cols2):
+    """
+    Returns True if all columns `cols1` of `df1` and `cols2` of `df2` are categoricals
+    with one and the same dictionary, i.e. their codes can be compared directly.
+    """
+    dtypes = [df1[col].dtype for col in cols1] + [df2[col].dtype for col in cols2]
+    if not all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+        return False
+    # CategoricalDtype equality ignores the category order, the codes do not
+    return all(dtype.categories.equals(dtypes[0].categories) for dtype in dtypes)
+
+
+def load_columns(frameName, availableColumns=None):
+    """
+    The columns of `frameName` ("tads" or "gads") read by any stage in `stageColumns`.
+
+    With `availableColumns` (e.g. the header of the raw file) only those present
+    are returned, in the order of `availableColumns`, so the result can be passed
+    as `usecols` to `pd.read_csv` without failing on a column the file lacks.
+
+    Example
+    ----------
+    >>> dfTads0 = read_csv_cached(tadsFileAddr, cacheFolder, usecols=load_columns("tads", csv_columns(tadsFileAddr)))
+    """
+    needed = dict.fromkeys(col for columns in stageColumns[frameName].values() for col in columns)
+    if availableColumns is None:
+        return list(needed)
+    return [col for col in availableColumns if col in needed]
+
+
+# %%
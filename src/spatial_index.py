@@ -0,0 +1,266 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import numpy as np
+import pandas as pd
+
+from src.mapinfo_reader import read_mapinfo_layer
+
+earthRadiusMiles = 3958.8
+milesPerDegreeLat = earthRadiusMiles * np.pi / 180
+
+
+class SpatialIndex:
+    """
+    Grid index over point and polyline features for "within X miles of station" selections.
+
+    Every polyline is split into its segments (a point is a segment of length
+    zero) and every segment is registered in all cells of a regular
+    longitude/latitude grid that its bounding box touches. A radius query only
+    looks at the segments registered in the cells covered by the bounding box
+    of the circle, and keeps the features whose exact distance to the station,
+    the smallest distance over all their segments, is within the radius. So a
+    line is selected as soon as any part of it is close enough, as in the
+    MapInfo "within distance" selections the Velocity Suite extracts were made
+    with. Distances are computed on a local equirectangular projection around
+    each station, which is accurate to well below a mile at 50 miles.
+
+    Parameters
+    ----------
+    - `featureIds` : array-like
+        Feature id of every vertex (e.g. the Velocity Suite 'Rec_ID').
+
+    - `lon`, `lat` : array-like of float
+        Vertex coordinates in degrees, in drawing order within each feature.
+
+    - `partIds` : array-like, optional (default=None)
+        Part of every vertex for multi-part polylines. Consecutive vertices are
+        only joined when both their feature and part ids are equal.
+
+    - `cellSizeDeg` : float, optional (default=0.5)
+        Grid cell size in degrees, about 35 miles in latitude.
+
+    Example
+    ----------
+    >>> spatialIndex = SpatialIndex(dfVertices["Rec_ID"], dfVertices["lon"], dfVertices["lat"], dfVertices["part"])
+    >>> spatialIndex.query_radius(-87.9048, 41.9786, 50)  # lines within 50 miles of Chicago O'Hare
+    """
+
+    def __init__(self, featureIds, lon, lat, partIds=None, cellSizeDeg=0.5):
+        featureIds = np.asarray(featureIds)
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        partIds = np.zeros(len(featureIds), dtype=np.int64) if partIds is None else np.asarray(partIds)
+
+        # Segment i joins vertex i with vertex i + 1 of the same part. A part of a
+        # single vertex (a point feature) becomes a segment from the vertex to itself.
+        samePart = np.zeros(len(featureIds), dtype=bool)
+        samePart[:-1] = (featureIds[1:] == featureIds[:-1]) & (partIds[1:] == partIds[:-1])
+        startsPart = np.ones(len(featureIds), dtype=bool)
+        startsPart[1:] = ~samePart[:-1]
+        isSinglePoint = startsPart & ~samePart
+
+        start = np.flatnonzero(samePart | isSinglePoint)
+        end = np.where(samePart[start], start + 1, start)
+
+        self.cellSizeDeg = cellSizeDeg
+        self.segFeature = featureIds[start]
+        self.segLon1, self.segLat1 = lon[start], lat[start]
+        self.segLon2, self.segLat2 = lon[end], lat[end]
+
+        cellSeg, cellKeys = _cells_of_boxes(
+            np.minimum(self.segLon1, self.segLon2),
+            np.minimum(self.segLat1, self.segLat2),
+            np.maximum(self.segLon1, self.segLon2),
+            np.maximum(self.segLat1, self.segLat2),
+            cellSizeDeg,
+        )
+        self.dfCells = pd.DataFrame({"cell": cellKeys, "seg": cellSeg})
+
+    def query_radius(self, lon, lat, radiusMiles):
+        """
+        Features within `radiusMiles` of the point (`lon`, `lat`).
+
+        Returns
+        ----------
+        `dfNear` : pandas.DataFrame
+            Columns 'featureId' and 'distanceMiles', nearest first.
+        """
+        dfNear = self.query_radius_batch([lon], [lat], radiusMiles)
+        return dfNear.drop(columns="stationPos").sort_values("distanceMiles", kind="stable").reset_index(drop=True)
+
+    def query_radius_batch(self, stationLon, stationLat, radiusMiles, chunkSize=500):
+        """
+        Features within `radiusMiles` of each of many stations, in one pass per chunk of stations.
+
+        Parameters
+        ----------
+        - `stationLon`, `stationLat` : array-like of float
+            Station coordinates in degrees.
+
+        - `radiusMiles` : float or array-like of float
+            One radius for all stations or one per station.
+
+        - `chunkSize` : int, optional (default=500)
+            Stations handled together, bounds the size of the candidate table.
+
+        Returns
+        ----------
+        `dfNear` : pandas.DataFrame
+            Columns 'stationPos' (position of the station in the inputs),
+            'featureId' and 'distanceMiles', one row per (station, feature).
+        """
+        stationLon = np.asarray(stationLon, dtype=np.float64)
+        stationLat = np.asarray(stationLat, dtype=np.float64)
+        radiusMiles = np.broadcast_to(np.asarray(radiusMiles, dtype=np.float64), stationLon.shape)
+
+        dfNear = []
+        for chunkStart in range(0, len(stationLon), chunkSize):
+            chunk = slice(chunkStart, chunkStart + chunkSize)
+            dfNear.append(
+                self._query_chunk(stationLon[chunk], stationLat[chunk], radiusMiles[chunk], chunkStart)
+            )
+
+        if not dfNear:
+            return pd.DataFrame({"stationPos": np.empty(0, dtype=np.int64), "featureId": self.segFeature[:0], "distanceMiles": np.empty(0)})
+        return pd.concat(dfNear, ignore_index=True)
+
+    def _query_chunk(self, stationLon, stationLat, radiusMiles, offset):
+        # Bounding box of every circle in degrees
+        dLat = radiusMiles / milesPerDegreeLat
+        dLon = radiusMiles / (milesPerDegreeLat * np.maximum(np.cos(np.radians(stationLat)), 1e-6))
+        stationPos, cellKeys = _cells_of_boxes(stationLon - dLon, stationLat - dLat, stationLon + dLon, stationLat + dLat, self.cellSizeDeg)
+
+        # Candidate (station, segment) pairs through the shared cells
+        dfCand = pd.DataFrame({"cell": cellKeys, "stationPos": stationPos}).merge(self.dfCells, on="cell")
+        dfCand = dfCand.drop_duplicates(subset=["stationPos", "seg"])
+        pos = dfCand["stationPos"].to_numpy()
+        seg = dfCand["seg"].to_numpy()
+
+        distance = _point_segment_miles(
+            stationLon[pos], stationLat[pos],
+            self.segLon1[seg], self.segLat1[seg], self.segLon2[seg], self.segLat2[seg],
+        )
+        isNear = distance <= radiusMiles[pos]
+
+        dfNear = pd.DataFrame(
+            {"stationPos": pos[isNear] + offset, "featureId": self.segFeature[seg[isNear]], "distanceMiles": distance[isNear]}
+        )
+        return dfNear.groupby(["stationPos", "featureId"], as_index=False, sort=True)["distanceMiles"].min()
+
+
+def select_near_locations(dfFeatures, spatialIndex, dfStations, radiusMiles=50, featureIdCol="Rec_ID"):
+    """
+    The "near-location" extracts of a feature table for many weather stations at once.
+
+    Parameters
+    ----------
+    - `dfFeatures` : pandas.DataFrame
+        Attribute table of the indexed features, e.g. all Velocity Suite transmission lines.
+
+    - `spatialIndex` : SpatialIndex
+        Index over the geometries of `dfFeatures`, with `featureIdCol` as feature ids.
+
+    - `dfStations` : pandas.DataFrame
+        Columns 'location' (e.g. "chicago-ohare"), 'lon' and 'lat'.
+
+    - `radiusMiles` : float, optional (default=50)
+
+    - `featureIdCol` : str, optional (default="Rec_ID")
+
+    Returns
+    ----------
+    `extracts` : dict
+        Maps every location to the rows of `dfFeatures` within `radiusMiles` of
+        its station, in the order of `dfFeatures`.
+
+    Example
+    ----------
+    >>> extracts = select_near_locations(dfVeloTlinesAll, spatialIndex, dfStations)
+    >>> extracts["chicago-ohare"]  # same rows as tlines-near-chicago-ohare-raw.xlsx
+    """
+    dfNear = spatialIndex.query_radius_batch(dfStations["lon"], dfStations["lat"], radiusMiles)
+
+    # Row positions of the selected features, looked up once for all stations
+    featurePos = pd.Index(dfFeatures[featureIdCol]).get_indexer(dfNear["featureId"])
+    dfNear = dfNear.assign(featurePos=featurePos)
+    dfNear = dfNear[dfNear["featurePos"] >= 0]
+
+    locations = dfStations["location"].to_numpy()
+    extracts = {location: dfFeatures.iloc[:0] for location in locations}
+    for stationPos, featurePos in dfNear.groupby("stationPos", sort=False)["featurePos"]:
+        extracts[locations[stationPos]] = dfFeatures.iloc[np.sort(featurePos.to_numpy())]
+
+    return extracts
+
+
+def read_weather_stations(tabFileAddr, nameCol="Weather_Station_Name"):
+    """
+    Station table for `select_near_locations` from a Velocity Suite weather stations layer.
+
+    Every station is named like the rawData files by `station_location`, e.g.
+    "Chicago/Ohare" becomes "chicago-ohare". Stations without a point are dropped.
+
+    Returns
+    ----------
+    `dfStations` : pandas.DataFrame
+        Columns 'location', 'lon', 'lat' and the attributes of the layer.
+
+    Example
+    ----------
+    >>> dfStations = read_weather_stations("queries/chicagoFiltered_Layers/_results_Weather_Stations.TAB")
+    """
+    dfAttributes, dfVertices = read_mapinfo_layer(tabFileAddr)
+    dfPoints = dfVertices.groupby("row")[["lon", "lat"]].first()
+
+    dfStations = dfAttributes.join(dfPoints, how="inner")
+    dfStations.insert(0, "location", [station_location(name) for name in dfStations[nameCol]])
+    return dfStations.reset_index(drop=True)
+
+
+def station_location(stationName):
+    """
+    Location name of a weather station as used in the rawData file names.
+
+    Example
+    ----------
+    >>> station_location("Chicago/Ohare"), station_location("New York/JFK")
+    ('chicago-ohare', 'newYork-jfk')
+    """
+    parts = []
+    for part in stationName.replace("'", "").split("/"):
+        words = part.split()
+        if words:
+            parts.append(words[0].lower() + "".join(word[:1].upper() + word[1:].lower() for word in words[1:]))
+    return "-".join(parts)
+
+
+def _cells_of_boxes(lon1, lat1, lon2, lat2, cellSizeDeg):
+    # (box position, cell key) for every grid cell each box touches
+    ix1 = np.floor((lon1 + 180) / cellSizeDeg).astype(np.int64)
+    iy1 = np.floor((lat1 + 90) / cellSizeDeg).astype(np.int64)
+    ix2 = np.floor((lon2 + 180) / cellSizeDeg).astype(np.int64)
+    iy2 = np.floor((lat2 + 90) / cellSizeDeg).astype(np.int64)
+
+    nx = ix2 - ix1 + 1
+    counts = nx * (iy2 - iy1 + 1)
+    boxPos = np.repeat(np.arange(len(counts)), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    ix = ix1[boxPos] + within % nx[boxPos]
+    iy = iy1[boxPos] + within // nx[boxPos]
+    return boxPos, iy * (1 << 32) + ix
+
+
+def _point_segment_miles(lon0, lat0, lon1, lat1, lon2, lat2):
+    # Distance from (lon0, lat0) to the segment, on an equirectangular projection centred on the point
+    scaleX = milesPerDegreeLat * np.cos(np.radians(lat0))
+    ax, ay = (lon1 - lon0) * scaleX, (lat1 - lat0) * milesPerDegreeLat
+    bx, by = (lon2 - lon0) * scaleX, (lat2 - lat0) * milesPerDegreeLat
+    dx, dy = bx - ax, by - ay
+
+    length2 = dx * dx + dy * dy
+    t = np.clip(-(ax * dx + ay * dy) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+    return np.hypot(ax + t * dx, ay + t * dy)
+
+
+# %%
@@ -0,0 +1,175 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import hashlib
+import inspect
+import json
+import os
+import sys
+import weakref
+
+import pandas as pd
+
+
+class StageStore:
+    """
+    Persisted store of stage outputs, keyed by the fingerprints of their inputs.
+
+    `run(stageName, func, *frames, **params)` returns `func(*frames, **params)`.
+    The result is pickled under a key built from the stage name, the code of
+    `func`, a fingerprint of every input DataFrame and the keyword parameters.
+    If the same stage is run again on unchanged inputs with the same parameters
+    and code, the stored output is loaded and `func` is skipped.
+
+    The code of `func` is its module and qualified name plus a hash of the
+    source of its module and of every module of the same package it imports,
+    directly or through those modules (see `code_version`). Editing the stage,
+    or a helper it calls from e.g. `src.housekeeping_gads`, therefore
+    invalidates the stored outputs.
+
+    A DataFrame's fingerprint is a SHA-256 over its column names, dtypes and
+    `pd.util.hash_pandas_object` of its rows and index. Outputs returned by `run`
+    (also the DataFrames in a returned tuple) get the fingerprint of the stage
+    key, so chaining stages does not rehash them. A frame too large to hash
+    cheaply, e.g. a national inventory, can be given a fingerprint with
+    `remember`, such as one derived from the content hash of its source file.
+    Frames must not be modified in place once handed to the store.
+
+    Parameters
+    ----------
+    - `storeFolder` : str
+        Folder the stage outputs are pickled to. Created if it does not exist.
+
+    - `keepVersions` : int, optional (default=1)
+        Number of stored outputs kept per stage name. Older ones are deleted.
+
+    Example
+    ----------
+    >>> stageStore = StageStore(os.path.join(wd, "cachedData", "transmission_data", "stages"))
+    >>> dfTadsSorted = stageStore.run("sort_and_shift_columns", sort_and_shift_columns, dfTads)
+    >>> dfTadsLatest = stageStore.run("get_latest_entries", get_latest_entries, dfTadsSorted)
+    """
+
+    def __init__(self, storeFolder, keepVersions=1):
+        os.makedirs(storeFolder, exist_ok=True)
+        self.storeFolder = storeFolder
+        self.keepVersions = keepVersions
+        self._fingerprints = {}
+
+    def run(self, stageName, func, *frames, **params):
+        key = self.stage_key(stageName, func, *frames, **params)
+        outputAddr = os.path.join(self.storeFolder, f"{stageName}-{key[:16]}.pkl")
+
+        if os.path.exists(outputAddr):
+            output = pd.read_pickle(outputAddr)
+        else:
+            output = func(*frames, **params)
+            pd.to_pickle(output, outputAddr)
+            self._prune(stageName, keep=outputAddr)
+
+        if isinstance(output, pd.DataFrame):
+            self.remember(output, key)
+        elif isinstance(output, tuple):
+            for position, item in enumerate(output):
+                if isinstance(item, pd.DataFrame):
+                    self.remember(item, f"{key}-{position}")
+        return output
+
+    def stage_key(self, stageName, func, *frames, **params):
+        digest = hashlib.sha256(stageName.encode())
+        digest.update(code_version(func).encode())
+        for df in frames:
+            digest.update(self.fingerprint(df).encode())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def fingerprint(self, df):
+        """
+        Returns the content fingerprint (hex str) of `df`, memoized per object.
+        """
+        entry = self._fingerprints.get(id(df))
+        if entry is not None and entry[0]() is df:
+            return entry[1]
+
+        digest = hashlib.sha256()
+        digest.update(json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()]).encode())
+        digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+        fingerprint = digest.hexdigest()
+
+        self.remember(df, fingerprint)
+        return fingerprint
+
+    def remember(self, df, fingerprint):
+        """
+        Use `fingerprint` (str) as the fingerprint of `df` from now on, instead of hashing its rows.
+        """
+        dfId = id(df)
+        # Drop the entry once the DataFrame is garbage collected, before its id can be reused
+        self._fingerprints[dfId] = (
+            weakref.ref(df, lambda _ref: self._fingerprints.pop(dfId, None)),
+            fingerprint,
+        )
+
+    def _prune(self, stageName, keep):
+        prefix = stageName + "-"
+        olderAddrs = [
+            os.path.join(self.storeFolder, fileName)
+            for fileName in os.listdir(self.storeFolder)
+            if fileName.startswith(prefix) and len(fileName) == len(prefix) + 16 + len(".pkl")
+        ]
+        olderAddrs = [addr for addr in olderAddrs if addr != keep]
+        olderAddrs.sort(key=os.path.getmtime, reverse=True)
+        for olderAddr in olderAddrs[max(self.keepVersions - 1, 0):]:
+            os.remove(olderAddr)
+
+
+def code_version(func):
+    """
+    Returns a str identifying the code of `func`: its module, qualified name and
+    a SHA-256 of the source of its module and of the modules that one depends on
+    (see `package_dependencies`), or of its own source if its module's is not
+    available (e.g. for a function defined in a notebook cell).
+    """
+    func = inspect.unwrap(func)
+    moduleName = getattr(func, "__module__", None)
+    qualName = getattr(func, "__qualname__", repr(func))
+
+    try:
+        digest = hashlib.sha256()
+        for dependencyName in package_dependencies(moduleName):
+            digest.update(dependencyName.encode())
+            digest.update(inspect.getsource(sys.modules[dependencyName]).encode())
+        return f"{moduleName}.{qualName}:" + digest.hexdigest()
+    except (OSError, TypeError, KeyError):
+        pass
+
+    try:
+        return f"{moduleName}.{qualName}:" + hashlib.sha256(inspect.getsource(func).encode()).hexdigest()
+    except (OSError, TypeError):
+        pass
+
+    code = getattr(func, "__code__", None)
+    return f"{moduleName}.{qualName}:" + hashlib.sha256(code.co_code if code is not None else repr(func).encode()).hexdigest()
+
+
+def package_dependencies(moduleName):
+    """
+    Sorted names of `moduleName` and of the modules of its top-level package it
+    depends on, directly or indirectly, through the modules, functions, classes
+    and objects it imports, e.g. "src.pipeline_gads" -> [..., "src.housekeeping_gads", ..., "src.pipeline_gads", ...].
+    """
+    packageName = moduleName.split(".")[0]
+    found = {moduleName}
+    pending = [moduleName]
+    while pending:
+        module = sys.modules[pending.pop()]
+        for value in vars(module).values():
+            dependencyName = value.__name__ if inspect.ismodule(value) else getattr(value, "__module__", None)
+            if not isinstance(dependencyName, str) or dependencyName in found or dependencyName not in sys.modules:
+                continue
+            if dependencyName == packageName or dependencyName.startswith(packageName + "."):
+                found.add(dependencyName)
+                pending.append(dependencyName)
+    return sorted(found)
+
+
+# %%
@@ -0,0 +1,90 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import pandas as pd
+
+from src.profiling import profile_stage
+
+
+@profile_stage
+def read_csv_filtered(fileAddr, keep=None, drop=None, usecols=None, chunksize=200_000, **read_kwargs):
+    """
+    Stream a large CSV in chunks and keep only the rows passing column-value predicates.
+
+    Each chunk is filtered (and projected to `usecols`) as soon as it is parsed, so
+    only the surviving rows of the file are ever held in memory together. Peak
+    memory is bounded by one raw chunk plus the filtered result, no matter how
+    large the file is.
+
+    Parameters
+    ----------
+    - `fileAddr` : str
+        Path of the CSV file.
+
+    - `keep` : dict, optional (default=None)
+        Maps a column name to the collection of values a row must have in that
+        column to be kept, e.g. `{"CompanyName": {"Commonwealth Edison Company"}}`.
+
+    - `drop` : dict, optional (default=None)
+        Maps a column name to the collection of values for which a row is dropped,
+        e.g. `{"VoltageClassCodeName": {"0-99 kV"}}`.
+
+    - `usecols` : list, optional (default=None)
+        Columns to return. Columns only needed by `keep`/`drop` are parsed but not
+        returned. None returns all columns.
+
+    - `chunksize` : int, optional (default=200_000)
+        Number of rows parsed per chunk.
+
+    - `**read_kwargs` :
+        Further keyword arguments passed to `pd.read_csv`.
+
+    Returns
+    ----------
+    `df` : pandas.DataFrame
+        The rows of the file satisfying all predicates, with a fresh RangeIndex.
+
+    Example
+    ----------
+    >>> dfTads = read_csv_filtered(
+    ...     tadsFileAddr,
+    ...     keep={"CompanyName": companyNamesVelo2Tads},
+    ...     drop={"VoltageClassCodeName": {"0-99 kV"}},
+    ... )
+    """
+    keep = {col: set(values) for col, values in (keep or {}).items()}
+    drop = {col: set(values) for col, values in (drop or {}).items()}
+
+    readCols = None
+    if usecols is not None:
+        readCols = list(dict.fromkeys(list(usecols) + list(keep) + list(drop)))
+
+    filteredChunks = []
+    numRowsRead = 0
+
+    for chunk in pd.read_csv(fileAddr, usecols=readCols, chunksize=chunksize, **read_kwargs):
+        numRowsRead += len(chunk)
+
+        mask = pd.Series(True, index=chunk.index)
+        for col, values in keep.items():
+            mask &= chunk[col].isin(values)
+        for col, values in drop.items():
+            mask &= ~chunk[col].isin(values)
+
+        chunk = chunk[mask]
+        if usecols is not None:
+            chunk = chunk[list(usecols)]
+        filteredChunks.append(chunk)
+
+    if filteredChunks:
+        df = pd.concat(filteredChunks, ignore_index=True)
+    else:
+        df = pd.read_csv(fileAddr, usecols=readCols, nrows=0, **read_kwargs)
+        if usecols is not None:
+            df = df[list(usecols)]
+
+    print(f"Streamed {numRowsRead} rows from {fileAddr}, kept {len(df)} after filtering.")
+
+    return df
+
+
+# %%
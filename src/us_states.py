@@ -0,0 +1,122 @@
+# %%
+# pylint: disable=undefined-variable line-too-long invalid-name missing-function-docstring f-string-without-interpolation
+import numpy as np
+import pandas as pd
+
+# U.S. states, the District of Columbia and the territories as (name, abbreviation, FIPS code),
+# the names spelled as in the GADS 'StateName' column. Built once at import, replacing the
+# lookups through the `us` package.
+stateTable = pd.DataFrame(
+    [
+    ("Alabama", "AL", "01"),
+    ("Alaska", "AK", "02"),
+    ("Arizona", "AZ", "04"),
+    ("Arkansas", "AR", "05"),
+    ("California", "CA", "06"),
+    ("Colorado", "CO", "08"),
+    ("Connecticut", "CT", "09"),
+    ("Delaware", "DE", "10"),
+    ("District of Columbia", "DC", "11"),
+    ("Florida", "FL", "12"),
+    ("Georgia", "GA", "13"),
+    ("Hawaii", "HI", "15"),
+    ("Idaho", "ID", "16"),
+    ("Illinois", "IL", "17"),
+    ("Indiana", "IN", "18"),
+    ("Iowa", "IA", "19"),
+    ("Kansas", "KS", "20"),
+    ("Kentucky", "KY", "21"),
+    ("Louisiana", "LA", "22"),
+    ("Maine", "ME", "23"),
+    ("Maryland", "MD", "24"),
+    ("Massachusetts", "MA", "25"),
+    ("Michigan", "MI", "26"),
+    ("Minnesota", "MN", "27"),
+    ("Mississippi", "MS", "28"),
+    ("Missouri", "MO", "29"),
+    ("Montana", "MT", "30"),
+    ("Nebraska", "NE", "31"),
+    ("Nevada", "NV", "32"),
+    ("New Hampshire", "NH", "33"),
+    ("New Jersey", "NJ", "34"),
+    ("New Mexico", "NM", "35"),
+    ("New York", "NY", "36"),
+    ("North Carolina", "NC", "37"),
+    ("North Dakota", "ND", "38"),
+    ("Ohio", "OH", "39"),
+    ("Oklahoma", "OK", "40"),
+    ("Oregon", "OR", "41"),
+    ("Pennsylvania", "PA", "42"),
+    ("Rhode Island", "RI", "44"),
+    ("South Carolina", "SC", "45"),
+    ("South Dakota", "SD", "46"),
+    ("Tennessee", "TN", "47"),
+    ("Texas", "TX", "48"),
+    ("Utah", "UT", "49"),
+    ("Vermont", "VT", "50"),
+    ("Virginia", "VA", "51"),
+    ("Washington", "WA", "53"),
+    ("West Virginia", "WV", "54"),
+    ("Wisconsin", "WI", "55"),
+    ("Wyoming", "WY", "56"),
+    ("American Samoa", "AS", "60"),
+    ("Guam", "GU", "66"),
+    ("Northern Mariana Islands", "MP", "69"),
+    ("Puerto Rico", "PR", "72"),
+    ("Virgin Islands", "VI", "78"),
+    ],
+    columns=["name", "abbr", "fips"],
+)
+stateNameIndex = pd.Index(stateTable["name"])
+stateAbbrCategories = pd.CategoricalDtype(categories=stateTable["abbr"])
+
+
+def state_positions(stateNames):
+    """
+    Row of `stateTable` for every state name in `stateNames` (-1 for unknown or missing names).
+
+    A categorical `stateNames`, such as the GADS 'StateName' after
+    `to_shared_categoricals`, is mapped through its categories only, so the
+    per-row work is a lookup by integer code. Other columns are factorized first.
+    """
+    if isinstance(stateNames.dtype, pd.CategoricalDtype):
+        codes, categories = stateNames.cat.codes.to_numpy(), stateNames.cat.categories
+    else:
+        codes, categories = pd.factorize(stateNames.to_numpy(dtype=object))
+
+    categoryPositions = np.append(stateNameIndex.get_indexer(categories), -1)
+    # Code -1 (missing) picks the appended -1
+    return categoryPositions[codes]
+
+
+def state_abbreviations(stateNames):
+    """
+    Two-letter abbreviations of the state names in `stateNames`, as a categorical Series.
+
+    Unknown or missing names give missing values. The input is not modified.
+
+    Example
+    ----------
+    >>> state_abbreviations(pd.Series(["Illinois", "District of Columbia", "Ontario"])).tolist()
+    ['IL', 'DC', nan]
+    """
+    return pd.Series(
+        pd.Categorical.from_codes(state_positions(stateNames), dtype=stateAbbrCategories),
+        index=stateNames.index,
+    )
+
+
+def state_mask(stateNames, abbreviations):
+    """
+    Boolean array, True where the state name in `stateNames` has one of the two-letter `abbreviations`.
+
+    Example
+    ----------
+    >>> state_mask(pd.Series(["Illinois", "Ohio", None]), {"IL", "IN"})
+    array([ True, False, False])
+    """
+    selected = np.append(stateTable["abbr"].isin(set(abbreviations)).to_numpy(), False)
+    return selected[state_positions(stateNames)]
+
+
+# %%